@@ -1,12 +1,30 @@
 import os
+import logging
 from flask import Flask
-from .routes import main_bp
+from werkzeug.middleware.proxy_fix import ProxyFix
+from .routes import main_bp, limiter
+from .utils.shared_storage import RATELIMIT_STORAGE_URI
 
-def create_app():
+def create_app(test_config=None):
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
     app = Flask(__name__)
     config_path = os.path.join(os.path.dirname(__file__), '..', 'config.py')
     app.config.from_pyfile(config_path)
+    # Rate-limit counters live in shared storage so every worker process enforces the same limits
+    app.config.setdefault("RATELIMIT_STORAGE_URI", RATELIMIT_STORAGE_URI)
+    # Reverse proxies (such as Heroku's router) in front of the app; their X-Forwarded-* headers are trusted
+    app.config.setdefault("PROXY_COUNT", int(os.getenv("PROXY_COUNT", "0")))
+    if test_config:
+        app.config.update(test_config)
+    if app.config["PROXY_COUNT"]:
+        # Rate limits and LLM fairness key on the client address, not the proxy's
+        proxies = app.config["PROXY_COUNT"]
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
 
     app.register_blueprint(main_bp)
+    limiter.init_app(app)
 
     return app
@@ -1,22 +1,172 @@
-from flask import Blueprint, jsonify, request, render_template
-from .utils.docstring_generator import generate_docstring, improve_docstring, generate_markdown_docs, generate_html_docs, save_docs, tag_documentation_version, detect_outdated_docs, generate_repo_docs
-from app.utils.github_api import fetch_repo_contents, filter_python_files, download_file_contents
-from app.utils.code_parser import extract_functions_and_classes, extract_function_signature, extract_class_metadata
-from .utils.query_handler import explain_code
+from flask import Blueprint, Response, current_app, g, jsonify, make_response, request, render_template, send_file, send_from_directory, stream_with_context, url_for
+from .utils.docstring_generator import generate_docstring, improve_docstring, find_docstring_targets, run_docstring_batch, generate_markdown_docs, save_docs, tag_documentation_version, detect_outdated_docs, generate_repo_docs, generate_local_docs, load_docs_manifest, save_docs_manifest
+from app.utils.github_api import fetch_repo_contents, filter_python_files, download_file_contents, iter_repo_files
+from app.utils.code_parser import build_symbol_index
+from .utils.query_handler import explain_code, stream_explanation, EXPLAIN_MAX_TOKENS
+from .utils.retrieval import retrieve_context
+from .utils.docs_writer import DocsSite, docs_path, save_html_docs
+from .utils.llm_cache import get_llm_cache
+from .utils.response_cache import CachedResponse, get_response_cache, make_request_key
+from .utils.llm_client import UsageTracker, get_llm_client, track_usage
+from .utils.llm_scheduler import BULK, caller, get_llm_scheduler, set_caller
+from .utils.prompt_builder import output_budget
+from .utils.jobs import get_job_manager
+from .utils.ai_comparison import compare_ai_tools, PROVIDERS
+from .utils.metrics import REQUEST_DURATION, TRACE_REQUESTS, publish_metrics, render_metrics, server_timing, start_trace, stop_trace
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import functools
 import os
+import json
+import logging
+import re
+import tempfile
+import time
 
 main_bp = Blueprint('main', __name__)
 
+logger = logging.getLogger(__name__)
+
 # Rate limiting for API endpoints
 limiter = Limiter(key_func=get_remote_address)
 
+# Largest number of items accepted by one batch docstring request
+DOCSTRING_BATCH_MAX_ITEMS = int(os.getenv("DOCSTRING_BATCH_MAX_ITEMS", "500"))
+# Folder POST /generate-local-docs may read "path" from; unset, only uploaded archives are accepted
+LOCAL_SOURCE_ROOT = os.getenv("LOCAL_SOURCE_ROOT")
+
+def _wants_stream(data):
+    """
+    Streaming is opt-in: "stream": true in the body or an Accept: text/event-stream header.
+    """
+    return bool(data.get("stream")) or "text/event-stream" in request.headers.get("Accept", "")
+
+def _question_inputs(data, code_snippet, query, call_type):
+    """
+    Resolve the code context and answer length for a question; the length defaults to the call type's output budget.
+    Only the symbols most relevant to the query are sent when the code (or the
+    repository named by "owner"/"repo"/"ref") is larger than the retrieval budget.
+    """
+    context = retrieve_context(
+        query or "", code=code_snippet,
+        owner=data.get("owner"), repo=data.get("repo"), ref=data.get("ref")
+    )
+    max_tokens = min(int(data.get("max_tokens", output_budget(call_type))), EXPLAIN_MAX_TOKENS)
+    return context, max_tokens
+
+def _sse_response(fragments):
+    """
+    Forward text fragments as server-sent events, ending with a "done" event carrying the
+    token usage (or an "error" event).
+    If the client disconnects, closing this generator closes the upstream DeepSeek stream.
+    """
+    def events():
+        with track_usage() as usage:
+            try:
+                for fragment in fragments:
+                    yield f"data: {json.dumps({'token': fragment})}\n\n"
+                yield f"event: done\ndata: {json.dumps({'usage': usage.to_dict()})}\n\n"
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            finally:
+                fragments.close()
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def single_flight(view):
+    """
+    Share one computation among identical concurrent requests to a JSON route, and serve its
+    successful response from the route response cache for ROUTE_CACHE_TTL seconds.
+    Requests match on the path and a canonical hash of the JSON body; "no_cache": true skips both.
+    Successful responses carry an ETag, and a request whose If-None-Match names it gets a 304.
+    The X-Cache header tells whether the response was computed (MISS), shared with a request
+    in flight (COALESCED) or cached (HIT). A "usage" field is kept out of the shared response:
+    the request that computed it gets its own, and the others get zero counts marked with "shared".
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or data.get("no_cache"):
+            return view(*args, **kwargs)
+        own = {}
+
+        def compute():
+            response = make_response(view(*args, **kwargs))
+            body = response.get_json(silent=True)
+            if isinstance(body, dict) and "usage" in body:
+                own["usage"] = body.pop("usage")
+                return CachedResponse(response.status_code, _json_bytes(body), response.mimetype, has_usage=True)
+            return CachedResponse(response.status_code, response.get_data(), response.mimetype)
+
+        cached, outcome = get_response_cache().fetch(make_request_key(request.path, data), compute)
+        if cached.status == 200 and request.if_none_match.contains(cached.etag):
+            response = Response(status=304)
+        elif cached.has_usage:
+            usage = own["usage"] if outcome == "miss" else dict(UsageTracker().to_dict(), shared=outcome)
+            body = dict(json.loads(cached.body), usage=usage)
+            response = Response(_json_bytes(body), status=cached.status, mimetype=cached.mimetype)
+        else:
+            response = Response(cached.body, status=cached.status, mimetype=cached.mimetype)
+        if cached.status == 200:
+            response.set_etag(cached.etag)
+        response.headers["X-Cache"] = outcome.upper()
+        return response
+
+    return wrapper
+
+def _json_bytes(data):
+    return current_app.json.dumps(data).encode("utf-8")
+
+@main_bp.before_app_request
+def start_request_timer():
+    """
+    Time every request, and collect trace spans when TRACE_REQUESTS is set or the request sends X-Trace: 1.
+    """
+    g.request_started = time.perf_counter()
+    # LLM calls of this request share the fair-scheduling queue of its client
+    set_caller(get_remote_address())
+    if TRACE_REQUESTS or request.headers.get("X-Trace") == "1":
+        g.trace_spans = start_trace()
+    else:
+        stop_trace()
+
+@main_bp.after_app_request
+def record_request_metrics(response):
+    """
+    Record the request in the latency histogram and report trace spans in a Server-Timing header.
+    Streamed responses are measured up to their first byte.
+    """
+    started = g.pop("request_started", None)
+    if started is not None:
+        duration = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_DURATION.observe(duration, route=route, method=request.method, status=response.status_code)
+        publish_metrics()
+    spans = g.pop("trace_spans", None)
+    if spans is not None:
+        stop_trace()
+        if spans:
+            response.headers["Server-Timing"] = server_timing(spans)
+        logger.debug("Trace %s %s: %s", request.method, request.path, spans)
+    return response
+
+@main_bp.route("/metrics", methods=["GET"])
+def metrics_route():
+    """
+    Expose request, pipeline stage, LLM, GitHub and cache metrics in the Prometheus text format.
+    """
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 @main_bp.route('/')
 def home():
     return render_template("index.html") 
 
 @main_bp.route('/generate-docstring', methods=['POST'])
+@single_flight
 def generate_docstring_route():
     """
     Generate a docstring for a given code snippet.
@@ -24,14 +174,88 @@ def generate_docstring_route():
     data = request.json
     code_snippet = data.get("code")
     context = data.get("context", "")
+    use_cache = not data.get("no_cache", False)
 
     try:
-        docstring = generate_docstring(code_snippet, context)
-        return jsonify({"docstring": docstring})
+        with track_usage() as usage:
+            docstring = generate_docstring(code_snippet, context, use_cache=use_cache)
+        return jsonify({"docstring": docstring, "usage": usage.to_dict()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+def _batch_items(data, key):
+    """
+    Normalize the "items" of a batch request: each one may be a string or an object with the
+    string under `key` and an optional "context"; the request's "context" is the default.
+    Raises ValueError for a malformed item.
+    """
+    items = data.get("items")
+    if not isinstance(items, list):
+        raise ValueError('Expected "items" to be a list or "code" to be a Python file')
+    _check_batch_size(items)
+    for position, item in enumerate(items):
+        if not isinstance(item, (str, dict)):
+            raise ValueError(f"Item {position} must be a string or an object")
+        if isinstance(item, dict) and not isinstance(item.get(key), str):
+            raise ValueError(f'Item {position} must have a "{key}" string')
+    default_context = data.get("context", "")
+    return [
+        {key: item, "context": default_context} if isinstance(item, str)
+        else dict(item, context=item.get("context", default_context))
+        for item in items
+    ]
+
+def _check_batch_size(items):
+    """
+    Raise ValueError if a batch (given as items, or found in a file) has more than DOCSTRING_BATCH_MAX_ITEMS items.
+    """
+    if len(items) > DOCSTRING_BATCH_MAX_ITEMS:
+        raise ValueError(f"At most {DOCSTRING_BATCH_MAX_ITEMS} items are accepted per request")
+    return items
+
+def _batch_response(results, usage):
+    failed = sum(1 for result in results if "error" in result)
+    return jsonify({
+        "results": results,
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "usage": usage.to_dict()
+    })
+
+@main_bp.route("/generate-docstrings", methods=["POST"])
+def generate_docstrings_route():
+    """
+    Generate docstrings for many snippets at once.
+    Pass "items" (snippets, or objects with "code" and optional "context"), or "code" with a
+    whole file to document its functions, methods and classes that have no docstring yet
+    ("force": true includes the documented ones too). Items run concurrently and each gets its
+    own result or error. Batches over DOCSTRING_BATCH_MAX_ITEMS and malformed items get a 400.
+    """
+    data = request.json
+    use_cache = not data.get("no_cache", False)
+
+    try:
+        if data.get("code") is not None:
+            items = _check_batch_size(find_docstring_targets(data["code"], force=bool(data.get("force"))))
+            for item in items:
+                item["context"] = data.get("context", "")
+        else:
+            items = _batch_items(data, "code")
+        with track_usage() as usage:
+            results = run_docstring_batch(
+                lambda item: generate_docstring(item.get("code"), item["context"], use_cache=use_cache, priority=BULK),
+                items, "docstring"
+            )
+        return _batch_response(results, usage)
+    except SyntaxError as e:
+        return jsonify({"error": f"Could not parse code: {e.msg} (line {e.lineno})"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @main_bp.route("/fetch-repo", methods=["POST"])
+@single_flight
 def fetch_repo():
     """
     Fetch and display Python files from a GitHub repository.
@@ -39,15 +263,17 @@ def fetch_repo():
     data = request.json
     owner = data.get("owner")
     repo = data.get("repo")
+    ref = data.get("ref")
 
     try:
-        contents = fetch_repo_contents(owner, repo)
+        contents = fetch_repo_contents(owner, repo, ref=ref)
         python_files = filter_python_files(contents)
         return jsonify({"python_files": python_files})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @main_bp.route("/parse-file", methods=["POST"])
+@single_flight
 def parse_file():
     """
     Parse a Python file and extract metadata.
@@ -57,9 +283,9 @@ def parse_file():
 
     try:
         code = download_file_contents(download_url)
-        functions, classes = extract_functions_and_classes(code)
-        function_metadata = [extract_function_signature(func) for func in functions]
-        class_metadata = [extract_class_metadata(cls) for cls in classes]
+        index = build_symbol_index(code)
+        function_metadata = [func.metadata() for func in index.functions]
+        class_metadata = [cls.metadata() for cls in index.classes]
         return jsonify({
             "functions": function_metadata,
             "classes": class_metadata
@@ -75,10 +301,46 @@ def improve_docstring_route():
     data = request.json
     existing_docstring = data.get("docstring")
     context = data.get("context", "")
+    use_cache = not data.get("no_cache", False)
 
     try:
-        improved_docstring = improve_docstring(existing_docstring, context)
-        return jsonify({"improved_docstring": improved_docstring})
+        with track_usage() as usage:
+            improved_docstring = improve_docstring(existing_docstring, context, use_cache=use_cache)
+        return jsonify({"improved_docstring": improved_docstring, "usage": usage.to_dict()})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@main_bp.route("/improve-docstrings", methods=["POST"])
+def improve_docstrings_route():
+    """
+    Improve many docstrings at once.
+    Pass "items" (docstrings, or objects with "docstring" and optional "context"), or "code"
+    with a whole file to improve the docstrings of its functions, methods and classes.
+    Items run concurrently and each gets its own result or error. Batches over
+    DOCSTRING_BATCH_MAX_ITEMS and malformed items get a 400.
+    """
+    data = request.json
+    use_cache = not data.get("no_cache", False)
+
+    try:
+        if data.get("code") is not None:
+            items = _check_batch_size(
+                [item for item in find_docstring_targets(data["code"], force=True) if item["docstring"]]
+            )
+            for item in items:
+                item["context"] = data.get("context") or item.pop("code")
+        else:
+            items = _batch_items(data, "docstring")
+        with track_usage() as usage:
+            results = run_docstring_batch(
+                lambda item: improve_docstring(item.get("docstring"), item["context"], use_cache=use_cache, priority=BULK),
+                items, "improved_docstring"
+            )
+        return _batch_response(results, usage)
+    except SyntaxError as e:
+        return jsonify({"error": f"Could not parse code: {e.msg} (line {e.lineno})"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -87,14 +349,20 @@ def improve_docstring_route():
 def explain_code_route():
     """
     Explain code functionality based on a natural language query.
+    Streams the explanation as server-sent events when requested (see _wants_stream).
     """
     data = request.json
     code_snippet = data.get("code")
     query = data.get("query")
+    use_cache = not data.get("no_cache", False)
 
     try:
-        explanation = explain_code(code_snippet, query)
-        return jsonify({"explanation": explanation})
+        context, max_tokens = _question_inputs(data, code_snippet, query, "explain")
+        if _wants_stream(data):
+            return _sse_response(stream_explanation(context, query, use_cache=use_cache, max_tokens=max_tokens))
+        with track_usage() as usage:
+            explanation = explain_code(context, query, use_cache=use_cache, max_tokens=max_tokens)
+        return jsonify({"explanation": explanation, "usage": usage.to_dict()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -103,15 +371,23 @@ def explain_code_route():
 def chatbot_route():
     """
     Chatbot endpoint for interactive code understanding.
+    Streams the response as server-sent events when requested (see _wants_stream).
     """
     data = request.json
     user_input = data.get("input")
     code_snippet = data.get("code", "")
+    use_cache = not data.get("no_cache", False)
 
     try:
+        context, max_tokens = _question_inputs(data, code_snippet, user_input, "chat")
+        if _wants_stream(data):
+            return _sse_response(stream_explanation(
+                context, user_input, use_cache=use_cache, max_tokens=max_tokens, call_type="chat"
+            ))
         # Use the same explain_code utility for chatbot responses
-        response = explain_code(code_snippet, user_input)
-        return jsonify({"response": response})
+        with track_usage() as usage:
+            response = explain_code(context, user_input, use_cache=use_cache, max_tokens=max_tokens, call_type="chat")
+        return jsonify({"response": response, "usage": usage.to_dict()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -119,28 +395,93 @@ def chatbot_route():
 def generate_docs_route():
     """
     Generate Markdown and HTML documentation from a code snippet.
+    Only symbols that changed since the last run are sent to the model unless "full" is set.
+    The HTML is served from the returned "html_url" rather than included in the response.
     """
     data = request.json
     code_snippet = data.get("code")
+    use_cache = not data.get("no_cache", False)
 
     try:
+        manifest = load_docs_manifest("docs.md")
+        if data.get("full"):
+            manifest["symbols"] = {}
+
         # Generate Markdown documentation
-        markdown_docs = generate_markdown_docs(code_snippet)
+        with track_usage() as usage:
+            markdown_docs = generate_markdown_docs(code_snippet, use_cache=use_cache, manifest=manifest)
         save_docs(markdown_docs, "docs.md")  # Save Markdown to /docs/docs.md
+        save_docs_manifest(manifest, "docs.md")  # Save symbol fingerprints to /docs/docs.manifest.json
 
-        # Generate HTML documentation
-        html_docs = generate_html_docs(markdown_docs)
-        save_docs(html_docs, "index.html")  # Save HTML to /docs/index.html
+        # Generate HTML documentation, unless /docs/index.html was rendered from the same Markdown
+        save_html_docs(markdown_docs, "index.html")
 
         return jsonify({
             "message": "Documentation generated successfully!",
+            "symbols": manifest["last_run"],
+            "usage": usage.to_dict(),
             "markdown_docs": markdown_docs,
-            "html_docs": html_docs
+            "html_url": url_for("main.docs_route", filename="index.html")
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
 
+@main_bp.route("/compare-ai", methods=["POST"])
+@limiter.limit("5 per minute")
+def compare_ai_route():
+    """
+    Document the same code with DeepSeek, OpenAI GPT and Claude concurrently.
+    "providers" limits the run to some of them and "timeout" overrides every provider's deadline.
+    Providers that miss their deadline are reported as timeouts; the others' output and
+    latency, token and size metrics are returned.
+    """
+    data = request.json
+    code = data.get("code")
+    names = data.get("providers") or list(PROVIDERS)
+    unknown = [name for name in names if name not in PROVIDERS]
+    if unknown:
+        return jsonify({"error": f"Unknown providers: {', '.join(unknown)}"}), 400
+
+    try:
+        timeout = data.get("timeout")
+        results = compare_ai_tools(
+            code,
+            providers={name: PROVIDERS[name] for name in names},
+            timeouts={name: float(timeout) for name in names} if timeout else None
+        )
+        return jsonify(results)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@main_bp.route("/llm-cache/stats", methods=["GET"])
+def llm_cache_stats_route():
+    """
+    Report hit/miss counters and tier sizes for the LLM completion cache.
+    """
+    return jsonify(get_llm_cache().stats())
+
+@main_bp.route("/route-cache/stats", methods=["GET"])
+def route_cache_stats_route():
+    """
+    Report cached route responses, requests in flight and hit, miss and coalesced counts.
+    """
+    return jsonify(get_response_cache().stats())
+
+@main_bp.route("/llm-scheduler/stats", methods=["GET"])
+def llm_scheduler_stats_route():
+    """
+    Report DeepSeek slots in use, queue depth and wait times per priority class, and the token budget.
+    """
+    return jsonify(get_llm_scheduler().stats())
+
+@main_bp.route("/llm-client/stats", methods=["GET"])
+def llm_client_stats_route():
+    """
+    Report the DeepSeek circuit breaker state and hedged request win rates.
+    """
+    return jsonify(get_llm_client().stats())
+
 @main_bp.route("/tag-version", methods=["POST"])
 def tag_version_route():
     """
@@ -157,34 +498,229 @@ def tag_version_route():
 @main_bp.route("/check-docs", methods=["POST"])
 def check_docs_route():
     """
-    Check if documentation is outdated.
+    Check if documentation is outdated and report the added, removed and changed symbols.
+    Pass "code" to check docs/docs.md, or "owner"/"repo" (and optional "ref") to check that repository's docs.
     """
     data = request.json
     code = data.get("code")
     docs = data.get("docs")
+    owner = data.get("owner")
+    repo = data.get("repo")
+    error = _repo_error(owner, repo, data.get("ref")) if owner or repo else None
+    if error:
+        return jsonify({"error": error}), 400
     try:
-        result = detect_outdated_docs(code, docs)
-        return jsonify({"message": result})
+        if owner and repo:
+            code = iter_repo_files(owner, repo, ref=data.get("ref"))
+        target = _docs_target(data.get("target") or (
+            f"{_site_name('repo_docs', owner, repo, data.get('ref') or 'HEAD')}/index.md" if owner and repo else "docs.md"
+        ))
+        result = detect_outdated_docs(code, docs, load_docs_manifest(target))
+        return jsonify(result)
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+def _docs_target(target):
+    """
+    Check that a document named by a request, such as repo_docs/octo/demo/HEAD/index.md, is inside
+    the docs folder. Raises PermissionError if it isn't.
+    """
+    root = os.path.realpath(docs_path())
+    if not isinstance(target, str) or os.path.commonpath([root, os.path.realpath(docs_path(target))]) != root:
+        raise PermissionError("Target is outside the docs folder")
+    return target
     
+def _flag(value):
+    """
+    Read a boolean option from JSON (any truthy value) or a form field ("1", "true" or "yes").
+    """
+    return value.lower() in ("1", "true", "yes") if isinstance(value, str) else bool(value)
+
+def _repo_error(owner, repo, ref):
+    """
+    Return why "owner"/"repo"/"ref" can't name a repository's docs folder, or None if they can.
+    """
+    if not all(isinstance(value, str) and value for value in (owner, repo)):
+        return 'Expected "owner" and "repo" to be non-empty strings'
+    if ref is not None and not isinstance(ref, str):
+        return 'Expected "ref" to be a string'
+    return None
+
+def _site_name(kind, *parts):
+    """
+    Docs folder (under /docs) of one source, such as repo_docs/octo/demo/main. Every source gets its
+    own folder and manifest, so runs for different sources never overwrite or sweep each other's pages.
+    """
+    names = [re.sub(r"[^A-Za-z0-9_.-]", "_", part).lstrip(".") or "_" for part in parts]
+    return "/".join([kind] + names)
+
+def _build_docs(name, generate, full=False, progress=None):
+    """
+    Generate and save documentation under /docs/<name>/; shared by the repository and local docs routes in both modes.
+    `generate(manifest=..., progress=..., writer=...)` streams the docs to the writer, so module
+    pages are written (and rendered, if changed) as they are generated. Runs for the same folder
+    wait for each other, in this and other worker processes.
+    """
+    site = DocsSite(name)
+    with site.lock():
+        manifest = load_docs_manifest(f"{name}/index.md")
+        if full:
+            manifest["symbols"] = {}
+        with track_usage() as usage:
+            generate(manifest=manifest, progress=progress, writer=site)
+        if progress:
+            progress(phase="saving")
+        pages = site.close()
+        save_docs_manifest(manifest, f"{name}/index.md")  # Save symbol fingerprints to /docs/<name>/index.manifest.json
+    return site, pages, manifest["last_run"], usage.to_dict()
+
+def _run_docs_job(job, name, generate, full, urls):
+    job.update(phase="documenting")
+    with caller(f"job:{job.id}"):
+        site, pages, symbols, usage = _build_docs(name, generate, full=full, progress=job.update)
+    for artifact in ("index.md", "search.json"):
+        job.add_artifact(artifact, site.outputs[artifact])
+    return dict(urls, pages=pages, symbols=symbols, usage=usage)
+
+def _docs_response(name, generate, full, data, job_key, message, cleanup=None):
+    """
+    Build docs synchronously, or as a background job when the request has "async": true.
+    `cleanup` runs once the docs are built (or the build failed).
+    """
+    urls = {
+        "index_url": url_for("main.docs_route", filename=f"{name}/index.html"),
+        "search_url": url_for("main.docs_route", filename=f"{name}/search.json")
+    }
+    if _flag(data.get("async")):
+        def run(job):
+            try:
+                return _run_docs_job(job, name, generate, full, urls)
+            finally:
+                if cleanup:
+                    cleanup()
+
+        job, created = get_job_manager().submit(job_key, run)
+        return jsonify({
+            "job_id": job.id,
+            "status": job.status,
+            "deduplicated": not created,
+            "status_url": url_for("main.job_status_route", job_id=job.id)
+        }), 202
+
+    try:
+        _, pages, symbols, usage = _build_docs(name, generate, full=full)
+        return jsonify(dict(urls, message=message, pages=pages, symbols=symbols, usage=usage))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if cleanup:
+            cleanup()
+
 @main_bp.route("/generate-repo-docs", methods=["POST"])
 def generate_repo_docs_route():
     """
     Generate documentation for an entire repository.
+    With "async": true the work runs as a background job and the job id is returned immediately;
+    concurrent requests for the same owner/repo/ref share one job.
+    The docs are written to /docs/repo_docs/<owner>/<repo>/<ref>/ (HEAD when no ref is given).
     """
     data = request.json
     owner = data.get("owner")
     repo = data.get("repo")
-    try:
-        markdown_docs = generate_repo_docs(owner, repo)
-        save_docs(markdown_docs, "repo_docs.md")  # Save Markdown to /docs/repo_docs.md
-        html_docs = generate_html_docs(markdown_docs)
-        save_docs(html_docs, "repo_index.html")  # Save HTML to /docs/repo_index.html
-        return jsonify({
-            "message": "Repository documentation generated successfully!",
-            "markdown_docs": markdown_docs,
-            "html_docs": html_docs
-        })
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+    ref = data.get("ref")
+    full = bool(data.get("full"))
+    error = _repo_error(owner, repo, ref)
+    if error:
+        return jsonify({"error": error}), 400
+    return _docs_response(
+        _site_name("repo_docs", owner, repo, ref or "HEAD"), lambda **options: generate_repo_docs(owner, repo, ref=ref, **options), full, data,
+        ("repo-docs", owner, repo, ref or "", full), "Repository documentation generated successfully!"
+    )
+
+def _local_source_path(path):
+    """
+    Resolve a requested path inside LOCAL_SOURCE_ROOT. Raises PermissionError if local paths are
+    disabled or the path leaves the root.
+    """
+    if not LOCAL_SOURCE_ROOT:
+        raise PermissionError("Local paths are disabled; set LOCAL_SOURCE_ROOT or upload an archive")
+    root = os.path.realpath(LOCAL_SOURCE_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise PermissionError("Path is outside LOCAL_SOURCE_ROOT")
+    return resolved
+
+def _globs(data, name):
+    values = data.getlist(name) if hasattr(data, "getlist") else data.get(name) or []
+    return [values] if isinstance(values, str) else list(values)
+
+@main_bp.route("/generate-local-docs", methods=["POST"])
+def generate_local_docs_route():
+    """
+    Generate documentation for a local directory or tar/zip archive without calling GitHub.
+    Send JSON with a "path" inside LOCAL_SOURCE_ROOT, or upload an archive as the multipart file
+    "archive" (other options then go in form fields). "include" and "exclude" take .gitignore-style
+    globs; "full" and "async" work as for /generate-repo-docs.
+    The docs are written to /docs/local_docs/<path>/, or /docs/local_docs/uploads/<archive name>/.
+    """
+    upload = request.files.get("archive")
+    data = request.form if upload else request.get_json(silent=True) or {}
+    include = _globs(data, "include") or None
+    exclude = _globs(data, "exclude") or None
+    full = _flag(data.get("full"))
+    cleanup = None
+
+    if upload:
+        fd, source = tempfile.mkstemp(prefix="local-docs-", suffix=os.path.basename(upload.filename or ""))
+        os.close(fd)
+        upload.save(source)
+        cleanup = lambda: os.remove(source)
+        name = _site_name("local_docs", "uploads", upload.filename or "archive")
+    else:
+        try:
+            source = _local_source_path(data.get("path") or "")
+        except PermissionError as e:
+            return jsonify({"error": str(e)}), 403
+        if not os.path.exists(source):
+            return jsonify({"error": "Path not found"}), 404
+        name = _site_name("local_docs", *os.path.relpath(source, os.path.realpath(LOCAL_SOURCE_ROOT)).split(os.sep))
+
+    return _docs_response(
+        name,
+        lambda **options: generate_local_docs(source, include=include, exclude=exclude, **options),
+        full, data, ("local-docs", source, tuple(include or ()), tuple(exclude or ()), full),
+        "Local documentation generated successfully!", cleanup=cleanup
+    )
+
+@main_bp.route("/docs/<path:filename>", methods=["GET"])
+def docs_route(filename):
+    """
+    Serve a generated documentation file, such as repo_docs/octo/demo/HEAD/index.html.
+    """
+    return send_from_directory(docs_path(), filename)
+
+@main_bp.route("/jobs/<job_id>", methods=["GET"])
+def job_status_route(job_id):
+    """
+    Report the phase, progress and ETA of a background job.
+    """
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    status = job.to_dict()
+    status["artifact_urls"] = {
+        name: url_for("main.job_artifact_route", job_id=job_id, name=name) for name in status["artifacts"]
+    }
+    return jsonify(status)
+
+@main_bp.route("/jobs/<job_id>/artifacts/<name>", methods=["GET"])
+def job_artifact_route(job_id, name):
+    """
+    Download a file produced by a finished job.
+    """
+    job = get_job_manager().get(job_id)
+    if job is None or name not in job.artifacts:
+        return jsonify({"error": "Artifact not found"}), 404
+    return send_file(job.artifacts[name], as_attachment=True, download_name=name)
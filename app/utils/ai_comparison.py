@@ -1,46 +1,135 @@
+import contextvars
 import os
-from openai import OpenAI
-from anthropic import Anthropic
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dotenv import load_dotenv
+from .llm_client import deadline, track_usage
 
-def compare_ai_tools(code):
+load_dotenv()
+
+# Seconds each provider gets before its result is left out; override one with e.g. COMPARISON_TIMEOUT_CLAUDE=30
+COMPARISON_TIMEOUT = float(os.getenv("COMPARISON_TIMEOUT", "60"))
+COMPARISON_MAX_TOKENS = int(os.getenv("COMPARISON_MAX_TOKENS", "1024"))
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-sonnet-4-5")
+
+ERROR_LABELS = {"deepseek": "DeepSeek", "openai_gpt": "OpenAI GPT", "claude": "Claude"}
+
+
+def _comparison_prompt(code):
+    return f"Generate documentation for the following Python code:\n{code}"
+
+def deepseek_provider(code, timeout):
     """
-    Compare DeepSeek with OpenAI GPT and Claude for generating documentation.
-    Handles errors gracefully and returns meaningful error messages.
+    Document code with the DeepSeek pipeline used by /generate-docs.
+    Its DeepSeek calls stop at the timeout, so a run past the comparison deadline doesn't keep spending API budget.
+    """
+    from .docstring_generator import generate_markdown_docs
+    with track_usage() as usage, deadline(timeout):
+        text = generate_markdown_docs(code)
+    report = usage.to_dict()
+    return {"text": text, "prompt_tokens": report["prompt_tokens"], "completion_tokens": report["completion_tokens"]}
+
+def openai_provider(code, timeout):
+    """
+    Document code with OpenAI. The SDK is imported on first use so it stays an optional dependency.
+    """
+    from openai import OpenAI
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=timeout, max_retries=0)
+    response = client.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=[{"role": "user", "content": _comparison_prompt(code)}],
+        max_tokens=COMPARISON_MAX_TOKENS
+    )
+    return {
+        "text": response.choices[0].message.content.strip(),
+        "prompt_tokens": response.usage.prompt_tokens,
+        "completion_tokens": response.usage.completion_tokens
+    }
+
+def anthropic_provider(code, timeout):
+    """
+    Document code with Claude. The SDK is imported on first use so it stays an optional dependency.
     """
-    results = {
-        "deepseek": None,
-        "openai_gpt": None,
-        "claude": None,
-        "errors": {}
+    from anthropic import Anthropic
+    client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), timeout=timeout, max_retries=0)
+    response = client.messages.create(
+        model=ANTHROPIC_MODEL,
+        max_tokens=COMPARISON_MAX_TOKENS,
+        messages=[{"role": "user", "content": _comparison_prompt(code)}]
+    )
+    return {
+        "text": "".join(getattr(block, "text", "") for block in response.content).strip(),
+        "prompt_tokens": response.usage.input_tokens,
+        "completion_tokens": response.usage.output_tokens
     }
 
-    # Generate documentation with DeepSeek
-    try:
-        from .docstring_generator import generate_markdown_docs
-        results["deepseek"] = generate_markdown_docs(code)
-    except Exception as e:
-        results["errors"]["deepseek"] = f"DeepSeek Error: {str(e)}"
-
-    # Generate documentation with OpenAI GPT
-    try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        gpt_response = client.completions.create(
-            model="gpt-3.5-turbo",
-            prompt=f"Generate documentation for the following Python code:\n{code}"
-        )
-        results["openai_gpt"] = gpt_response.choices[0].text.strip()
-    except Exception as e:
-        results["errors"]["openai_gpt"] = f"OpenAI GPT Error: {str(e)}"
-
-    # Generate documentation with Claude
-    try:
-        client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-        claude_response = client.completions.create(
-            model="claude-2",
-            prompt=f"Generate documentation for the following Python code:\n{code}"
-        )
-        results["claude"] = claude_response.choices[0].text.strip()
-    except Exception as e:
-        results["errors"]["claude"] = f"Claude Error: {str(e)}"
-
-    return results
\ No newline at end of file
+# Provider name -> provider(code, timeout) returning {"text", "prompt_tokens", "completion_tokens"}
+PROVIDERS = {
+    "deepseek": deepseek_provider,
+    "openai_gpt": openai_provider,
+    "claude": anthropic_provider
+}
+
+
+def provider_timeout(name):
+    return float(os.getenv(f"COMPARISON_TIMEOUT_{name.upper()}", str(COMPARISON_TIMEOUT)))
+
+def _measure(provider, code, timeout):
+    start = time.monotonic()
+    result = provider(code, timeout)
+    return result, time.monotonic() - start
+
+def compare_ai_tools(code, providers=None, timeouts=None):
+    """
+    Compare DeepSeek with OpenAI GPT and Claude for generating documentation.
+
+    All providers run at once, each under its own deadline (see provider_timeout);
+    results that arrive after the deadline are left out. Errors are reported per
+    provider, and "metrics" records each provider's status, latency, token counts
+    and output size.
+
+    Args:
+        code (str): Python code to document.
+        providers (dict): Provider name -> callable, defaults to PROVIDERS (pass stubs in tests).
+        timeouts (dict): Optional per-provider deadlines in seconds.
+    """
+    providers = providers if providers is not None else PROVIDERS
+    timeouts = timeouts or {}
+    results = {name: None for name in providers}
+    results["errors"] = {}
+    results["metrics"] = {}
+
+    # Don't wait for providers that overran their deadline: their threads finish in the background
+    executor = ThreadPoolExecutor(max_workers=max(len(providers), 1), thread_name_prefix="compare")
+    start = time.monotonic()
+    deadlines = {}
+    futures = {}
+    for name, provider in providers.items():
+        timeout = timeouts.get(name) or provider_timeout(name)
+        deadlines[name] = start + timeout
+        futures[name] = executor.submit(contextvars.copy_context().run, _measure, provider, code, timeout)
+    executor.shutdown(wait=False)
+
+    # Wait on the earliest deadlines first so a slow provider doesn't hold up the others' checks
+    for name in sorted(futures, key=deadlines.get):
+        try:
+            result, latency = futures[name].result(timeout=max(deadlines[name] - time.monotonic(), 0))
+        except FutureTimeoutError:
+            results["errors"][name] = f"{ERROR_LABELS.get(name, name)} Error: no response within {deadlines[name] - start:g}s"
+            results["metrics"][name] = {"status": "timeout", "latency_ms": None}
+            continue
+        except Exception as e:
+            results["errors"][name] = f"{ERROR_LABELS.get(name, name)} Error: {str(e)}"
+            results["metrics"][name] = {"status": "error", "latency_ms": round((time.monotonic() - start) * 1000)}
+            continue
+        results[name] = result["text"]
+        results["metrics"][name] = {
+            "status": "ok",
+            "latency_ms": round(latency * 1000),
+            "prompt_tokens": result.get("prompt_tokens"),
+            "completion_tokens": result.get("completion_tokens"),
+            "output_chars": len(result["text"])
+        }
+
+    return results
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import deque
+from dotenv import load_dotenv
+from .metrics import LLM_CIRCUIT_REJECTIONS, LLM_CIRCUIT_STATE
+
+load_dotenv()
+
+# Share of failed (or slow) calls among the recent ones that opens the circuit
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+LLM_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_CALL_SECONDS", "30"))
+LLM_BREAKER_SLOW_CALL_RATE = float(os.getenv("LLM_BREAKER_SLOW_CALL_RATE", "0.8"))
+# Number of recent calls the rates are computed over, and the fewest needed to judge
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+# Seconds the circuit stays open before letting probe calls through
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+LLM_BREAKER_HALF_OPEN_PROBES = int(os.getenv("LLM_BREAKER_HALF_OPEN_PROBES", "2"))
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a call while the circuit is open.
+    """
+
+    def __init__(self, retry_in):
+        super().__init__(f"circuit open, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while an upstream service is failing or too slow.
+
+    Closed: calls go through, and the outcome and duration of the last `window` calls are kept.
+    Once at least `min_calls` are recorded and the failure rate reaches `failure_rate`, or the
+    share of calls slower than `slow_call_seconds` reaches `slow_call_rate`, the circuit opens.
+    Open: calls raise CircuitOpenError for `open_seconds`.
+    Half-open: up to `half_open_probes` calls go through. The circuit closes when all of them
+    succeed in time, and opens again on the first one that doesn't.
+    """
+
+    def __init__(self, failure_rate=LLM_BREAKER_FAILURE_RATE, slow_call_seconds=LLM_BREAKER_SLOW_CALL_SECONDS,
+                 slow_call_rate=LLM_BREAKER_SLOW_CALL_RATE, window=LLM_BREAKER_WINDOW, min_calls=LLM_BREAKER_MIN_CALLS,
+                 open_seconds=LLM_BREAKER_OPEN_SECONDS, half_open_probes=LLM_BREAKER_HALF_OPEN_PROBES):
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(half_open_probes, 1)
+        self.state = CLOSED
+        self.times_opened = 0
+        self.rejected = 0
+        self._calls = deque(maxlen=window)  # (failed, slow) of recent calls
+        self._opened_at = None
+        self._probes_started = 0
+        self._probes_passed = 0
+        self._lock = threading.Lock()
+        LLM_CIRCUIT_STATE.set(STATE_VALUES[CLOSED])
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError if a call may not be made now; otherwise let it through.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                retry_in = self._opened_at + self.open_seconds - time.monotonic()
+                if retry_in > 0:
+                    self._reject()
+                    raise CircuitOpenError(retry_in)
+                self._set_state(HALF_OPEN)
+                self._probes_started = self._probes_passed = 0
+            if self.state == HALF_OPEN:
+                if self._probes_started >= self.half_open_probes:
+                    self._reject()
+                    raise CircuitOpenError(0)
+                self._probes_started += 1
+
+    def record(self, success, duration):
+        """
+        Record the outcome of a call let through by before_call.
+        """
+        failed = not success
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._open()
+                else:
+                    self._probes_passed += 1
+                    if self._probes_passed >= self.half_open_probes:
+                        self._calls.clear()
+                        self._set_state(CLOSED)
+                return
+            if self.state == OPEN:
+                # A call started before the circuit opened; it no longer counts
+                return
+            self._calls.append((failed, slow))
+            if len(self._calls) < self.min_calls:
+                return
+            failures = sum(1 for failed, _ in self._calls if failed) / len(self._calls)
+            slow_calls = sum(1 for _, slow in self._calls if slow) / len(self._calls)
+            if failures >= self.failure_rate or slow_calls >= self.slow_call_rate:
+                self._open()
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._calls)
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(self._opened_at + self.open_seconds - time.monotonic(), 0), 1)
+            return {
+                "state": self.state,
+                "recent_calls": calls,
+                "failure_rate": round(sum(1 for failed, _ in self._calls if failed) / calls, 3) if calls else 0.0,
+                "slow_call_rate": round(sum(1 for _, slow in self._calls if slow) / calls, 3) if calls else 0.0,
+                "times_opened": self.times_opened,
+                "rejected_calls": self.rejected,
+                "retry_in_seconds": retry_in
+            }
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+        self._calls.clear()
+        self._set_state(OPEN)
+
+    def _reject(self):
+        self.rejected += 1
+        LLM_CIRCUIT_REJECTIONS.inc()
+
+    def _set_state(self, state):
+        self.state = state
+        LLM_CIRCUIT_STATE.set(STATE_VALUES[state])
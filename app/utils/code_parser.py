@@ -1,25 +1,236 @@
 import ast
+import copy
+import hashlib
+import os
+import textwrap
+import threading
+from collections import OrderedDict
+from .metrics import record_cache_lookup, stage
 
-def parse_code(code):
+# Number of parsed sources whose symbol index is kept in memory
+SYMBOL_INDEX_CACHE_SIZE = int(os.getenv("SYMBOL_INDEX_CACHE_SIZE", "256"))
+
+FUNCTION_KINDS = ("function", "async_function")
+METHOD_KINDS = ("method", "async_method")
+
+
+class Symbol:
+    """
+    Compact record of one function, method or class found in a source file.
+    """
+    __slots__ = ("qualname", "name", "kind", "parent", "lineno", "end_lineno",
+                 "source", "docstring", "fingerprint", "shape", "signature", "methods")
+
+    def __init__(self, qualname, name, kind, parent, lineno, end_lineno, source, docstring,
+                 fingerprint, shape=None, signature=None, methods=None):
+        self.qualname = qualname
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.lineno = lineno
+        self.end_lineno = end_lineno
+        self.source = source
+        self.docstring = docstring
+        self.fingerprint = fingerprint
+        self.shape = shape
+        self.signature = signature
+        self.methods = methods
+
+    def metadata(self):
+        """
+        Return the JSON-serializable metadata served by /parse-file.
+        """
+        data = {
+            "name": self.name,
+            "qualname": self.qualname,
+            "kind": self.kind,
+            "lineno": self.lineno,
+            "end_lineno": self.end_lineno,
+            "docstring": self.docstring
+        }
+        if self.signature is not None:
+            data["args"] = self.signature["args"]
+            data["returns"] = self.signature["returns"]
+        if self.methods is not None:
+            data["methods"] = self.methods
+        return data
+
+
+class SymbolIndex:
+    """
+    All symbols of one source, in source order, built in a single pass over the AST.
+    """
+    __slots__ = ("digest", "symbols")
+
+    def __init__(self, digest, symbols):
+        self.digest = digest
+        self.symbols = symbols
+
+    @property
+    def functions(self):
+        """
+        Module-level functions (methods and nested functions are excluded).
+        """
+        return [symbol for symbol in self.symbols if symbol.kind in FUNCTION_KINDS and symbol.parent is None]
+
+    @property
+    def classes(self):
+        return [symbol for symbol in self.symbols if symbol.kind == "class"]
+
+    def methods_of(self, class_qualname):
+        return [symbol for symbol in self.symbols if symbol.kind in METHOD_KINDS and symbol.parent == class_qualname]
+
+
+class _SymbolVisitor(ast.NodeVisitor):
+    def __init__(self, lines):
+        self.lines = lines
+        self.symbols = []
+        self.scope = []  # (qualname, is_class) of the enclosing definitions
+
+    def _segment(self, node):
+        # Whole lines from the first decorator to the end of the body, dedented so methods read naturally
+        start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+        return textwrap.dedent("".join(self.lines[start - 1:node.end_lineno]))
+
+    def _qualname(self, name):
+        if not self.scope:
+            return name
+        parent, is_class = self.scope[-1]
+        return f"{parent}.{name}" if is_class else f"{parent}.<locals>.{name}"
+
+    def _visit_function(self, node):
+        in_class = bool(self.scope) and self.scope[-1][1]
+        is_async = isinstance(node, ast.AsyncFunctionDef)
+        if in_class:
+            kind = "async_method" if is_async else "method"
+        else:
+            kind = "async_function" if is_async else "function"
+        qualname = self._qualname(node.name)
+        self.symbols.append(Symbol(
+            qualname, node.name, kind, self.scope[-1][0] if self.scope else None,
+            node.lineno, node.end_lineno, self._segment(node), ast.get_docstring(node),
+            fingerprint_node(node), shape_fingerprint(node), signature=extract_function_signature(node)
+        ))
+        self.scope.append((qualname, False))
+        self.generic_visit(node)
+        self.scope.pop()
+
+    visit_FunctionDef = _visit_function
+    visit_AsyncFunctionDef = _visit_function
+
+    def visit_ClassDef(self, node):
+        qualname = self._qualname(node.name)
+        methods = [
+            child.name for child in node.body
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))
+        ]
+        self.symbols.append(Symbol(
+            qualname, node.name, "class", self.scope[-1][0] if self.scope else None,
+            node.lineno, node.end_lineno, self._segment(node), ast.get_docstring(node),
+            fingerprint_node(node), shape_fingerprint(node), methods=methods
+        ))
+        self.scope.append((qualname, True))
+        self.generic_visit(node)
+        self.scope.pop()
+
+
+def fingerprint_node(node):
+    """
+    Hash the normalized AST of a node: formatting, comments and line numbers don't affect it.
+    """
+    return hashlib.sha256(ast.dump(node).encode("utf-8")).hexdigest()
+
+
+def shape_fingerprint(node):
+    """
+    Hash a definition with its own name and all docstrings blanked out, so copies of the
+    same code under another name (including recursive or self-references) hash alike.
+    Other identifiers are kept since they change what the code does.
+    """
+    node = copy.deepcopy(node)
+    name = node.name
+    for child in ast.walk(node):
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            if ast.get_docstring(child, clean=False) is not None:
+                child.body = child.body[1:]
+        elif isinstance(child, ast.Name) and child.id == name:
+            child.id = "_"
+    node.name = "_"
+    return hashlib.sha256(ast.dump(node).encode("utf-8")).hexdigest()
+
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+def build_symbol_index(code):
+    """
+    Parse code once and return its SymbolIndex, reusing the cached index for identical source.
+    Raises SyntaxError (or ValueError for null bytes) if the code can't be parsed.
+    """
+    digest = hashlib.sha256(code.encode("utf-8", "surrogatepass")).hexdigest()
+    with _index_cache_lock:
+        index = _index_cache.get(digest)
+        if index is not None:
+            _index_cache.move_to_end(digest)
+            record_cache_lookup("symbol_index", True)
+            return index
+    record_cache_lookup("symbol_index", False)
+
+    with stage("parse"):
+        index = index_source(code, digest)
+    cache_symbol_index(index)
+    return index
+
+def index_source(code, digest=None):
+    """
+    Parse code into a SymbolIndex without touching the cache, locks or metrics, so it is
+    safe to call in worker processes. Raises like `build_symbol_index`.
+    """
+    digest = digest or hashlib.sha256(code.encode("utf-8", "surrogatepass")).hexdigest()
     tree = ast.parse(code)
-    functions = [node for node in ast.walk(tree) if isinstance(node, ast.FunctionDef)]
-    classes = [node for node in ast.walk(tree) if isinstance(node, ast.ClassDef)]
-    return {"functions": functions, "classes": classes}
+    visitor = _SymbolVisitor(code.splitlines(keepends=True))
+    visitor.visit(tree)
+    return SymbolIndex(digest, visitor.symbols)
+
+def cache_symbol_index(index):
+    """
+    Add an index built elsewhere (e.g. in a worker process) to the cache used by `build_symbol_index`.
+    """
+    with _index_cache_lock:
+        _index_cache[index.digest] = index
+        _index_cache.move_to_end(index.digest)
+        while len(_index_cache) > SYMBOL_INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+
+def parse_code(code):
+    index = build_symbol_index(code)
+    return {"functions": index.functions, "classes": index.classes}
 
 def extract_functions_and_classes(code):
     """
     Extract functions and classes from Python code using AST.
+    Returns the AST nodes in one walk; prefer `build_symbol_index` for cached, source-carrying records.
     """
     tree = ast.parse(code)
-    functions = [node for node in ast.walk(tree) if isinstance(node, ast.FunctionDef)]
-    classes = [node for node in ast.walk(tree) if isinstance(node, ast.ClassDef)]
+    functions, classes = [], []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            functions.append(node)
+        elif isinstance(node, ast.ClassDef):
+            classes.append(node)
     return functions, classes
 
 def extract_function_signature(func_node):
     """
     Extract function signature (name, args, returns).
     """
-    args = [arg.arg for arg in func_node.args.args]
+    arguments = func_node.args
+    args = [arg.arg for arg in arguments.posonlyargs + arguments.args]
+    if arguments.vararg:
+        args.append(f"*{arguments.vararg.arg}")
+    args.extend(arg.arg for arg in arguments.kwonlyargs)
+    if arguments.kwarg:
+        args.append(f"**{arguments.kwarg.arg}")
     returns = ast.unparse(func_node.returns) if func_node.returns else None
     return {
         "name": func_node.name,
@@ -31,10 +242,13 @@ def extract_class_metadata(class_node):
     """
     Extract class metadata (name, methods, docstring).
     """
-    methods = [node.name for node in ast.walk(class_node) if isinstance(node, ast.FunctionDef)]
+    methods = [
+        node.name for node in class_node.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    ]
     docstring = ast.get_docstring(class_node)
     return {
         "name": class_node.name,
         "methods": methods,
         "docstring": docstring
-    }
\ No newline at end of file
+    }
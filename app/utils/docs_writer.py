@@ -0,0 +1,269 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from .metrics import stage
+from .snapshot_store import atomic_write
+
+try:
+    import fcntl
+except ImportError:  # Windows: runs are only serialized within one process
+    fcntl = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Folder generated documentation is saved to (the project's docs/ folder by default)
+DOCS_DIR = os.path.abspath(os.getenv("DOCS_DIR", os.path.join(os.path.dirname(__file__), "..", "..", "docs")))
+# Markdown hash of every rendered HTML page in a folder, so unchanged pages aren't rendered again
+HTML_CACHE_FILE = ".html_cache.json"
+# Held by the run writing a docs site, so two runs never write (or sweep) the same folder at once
+SITE_LOCK_FILE = ".lock"
+
+_SYMBOL_HEADING = re.compile(r"^#### `([^`]+)`$", re.MULTILINE)
+_HEADING = re.compile(r"^(#+) (.+)$", re.MULTILINE)
+
+
+def docs_path(filename="", directory=None):
+    """
+    Return the absolute path of a file in the docs folder, or of the folder itself.
+    """
+    return os.path.join(directory or DOCS_DIR, filename)
+
+
+def render_html(markdown_text):
+    """
+    Convert Markdown to HTML. Headings get ids so pages can link to each symbol.
+    """
+    import markdown
+    with stage("render"):
+        return markdown.markdown(markdown_text, extensions=["toc"])
+
+
+def save_html_docs(markdown_text, filename, directory=None):
+    """
+    Render Markdown to an HTML file in the docs folder, unless the file was already rendered
+    from the same Markdown. Returns True if the page was rendered.
+    """
+    cache = HtmlCache(directory or DOCS_DIR)
+    rendered = cache.render(markdown_text, filename)
+    cache.save()
+    return rendered
+
+
+class HtmlCache:
+    """
+    Renders the HTML pages of one docs folder, skipping pages whose Markdown hasn't changed.
+    The hashes are kept in HTML_CACHE_FILE; call `save` once the pages are written.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, HTML_CACHE_FILE)
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.hashes = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.hashes = {}
+        self.rendered = 0
+        self.reused = 0
+
+    def render(self, markdown_text, filename):
+        """
+        Write the HTML for `filename` (relative to the folder) unless it's up to date. Returns True if rendered.
+        """
+        digest = hashlib.sha256(markdown_text.encode("utf-8")).hexdigest()
+        path = os.path.join(self.directory, filename)
+        if self.hashes.get(filename) == digest and os.path.exists(path):
+            self.reused += 1
+            return False
+        atomic_write(path, render_html(markdown_text))
+        self.hashes[filename] = digest
+        self.rendered += 1
+        return True
+
+    def forget(self, filename):
+        self.hashes.pop(filename, None)
+
+    def save(self):
+        atomic_write(self.path, json.dumps(self.hashes, indent=2, sort_keys=True))
+
+
+class MarkdownBuffer:
+    """
+    Collects generated Markdown in memory; the default output of `generate_markdown_docs`.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._hash = hashlib.sha256()
+
+    def write(self, text):
+        self._parts.append(text)
+        self._hash.update(text.encode("utf-8"))
+
+    def write_module(self, path, markdown_text):
+        self.write(markdown_text)
+
+    def hexdigest(self):
+        """
+        SHA-256 of everything written, which is the hash of `getvalue()`.
+        """
+        return self._hash.hexdigest()
+
+    def getvalue(self):
+        return "".join(self._parts)
+
+
+class DocsSite:
+    """
+    Writes documentation as a folder of pages while it is generated.
+
+    Layout under `<directory>/<name>`:
+        index.md, index.html   title, links to every module page, and any trailing notes
+        modules/<path>.md      one page per source file, written as soon as the file is documented
+        modules/<path>.html    rendered only when the page's Markdown changed since the last run
+        search.json            every documented symbol with the URL of its heading
+
+    Every file is written atomically. Pages of modules that are no longer documented are removed on `close`,
+    so a site root must have one writer at a time: give each source its own root and hold `lock()` for the run.
+    """
+
+    def __init__(self, name, directory=None):
+        self.root = os.path.join(directory or DOCS_DIR, name)
+        self.outputs = {}  # index.md and search.json as written by `close`
+        self._cache = HtmlCache(self.root)
+        self._head = []  # index text written before the first module
+        self._tail = []  # index text written after it
+        self._pages = []  # (source path, page path without extension)
+        self._symbols = []
+        self._hash = hashlib.sha256()
+
+    def write(self, text):
+        """
+        Add text to the index page.
+        """
+        (self._tail if self._pages else self._head).append(text)
+        self._hash.update(text.encode("utf-8"))
+
+    def write_module(self, path, markdown_text):
+        """
+        Save the page of one source file and render its HTML if it changed.
+        """
+        page = _page_name(path, {page for _, page in self._pages})
+        atomic_write(os.path.join(self.root, f"{page}.md"), markdown_text)
+        self._cache.render(markdown_text, f"{page}.html")
+        self._pages.append((path, page))
+        self._hash.update(markdown_text.encode("utf-8"))
+        anchors = _heading_anchors(markdown_text)
+        for match in _SYMBOL_HEADING.finditer(markdown_text):
+            self._symbols.append({
+                "name": match.group(1),
+                "module": path,
+                "url": f"{page}.html#{anchors.get(match.start(), '')}"
+            })
+
+    def path(self, filename):
+        return os.path.join(self.root, filename)
+
+    @contextmanager
+    def lock(self):
+        """
+        Hold the site's writer lock, waiting for any other run on the same root (in this or another
+        worker process) to finish. The HTML cache is reloaded once the lock is held.
+        """
+        with _root_lock(self.root):
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.path(SITE_LOCK_FILE), "a") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                self._cache = HtmlCache(self.root)
+                yield self
+
+    def hexdigest(self):
+        """
+        SHA-256 of everything written, in the order it was written.
+        """
+        return self._hash.hexdigest()
+
+    def close(self):
+        """
+        Write the index pages and the search manifest, remove stale module pages, and return a summary.
+        """
+        self.outputs = {
+            "index.md": self._index_markdown("md"),
+            "search.json": json.dumps({"modules": [path for path, _ in self._pages], "symbols": self._symbols})
+        }
+        with stage("save"):
+            for filename, text in self.outputs.items():
+                atomic_write(self.path(filename), text)
+            self._cache.render(self._index_markdown("html"), "index.html")
+            removed = self._remove_stale_pages()
+            self._cache.save()
+        summary = {
+            "pages": len(self._pages),
+            "rendered": self._cache.rendered,
+            "reused_html": self._cache.reused,
+            "removed": removed
+        }
+        logger.info("Documentation saved to %s: %s", self.root, summary)
+        return summary
+
+    def _index_markdown(self, extension):
+        links = "".join(f"- [`{path}`]({page}.{extension})\n" for path, page in self._pages)
+        modules = f"## Modules\n\n{links}\n" if links else ""
+        return "".join(self._head) + modules + "".join(self._tail)
+
+    def _remove_stale_pages(self):
+        current = {f"{page}.{extension}" for _, page in self._pages for extension in ("md", "html")}
+        removed = 0
+        for folder, _, files in os.walk(os.path.join(self.root, "modules")):
+            for file in files:
+                filename = os.path.relpath(os.path.join(folder, file), self.root).replace(os.sep, "/")
+                if filename not in current:
+                    os.remove(os.path.join(folder, file))
+                    self._cache.forget(filename)
+                    removed += filename.endswith(".md")
+        return removed
+
+
+_root_locks = {}
+_root_locks_lock = threading.Lock()
+
+def _root_lock(root):
+    """
+    Thread lock of one site root; the file lock alone doesn't serialize threads where fcntl is missing.
+    """
+    with _root_locks_lock:
+        return _root_locks.setdefault(os.path.abspath(root), threading.Lock())
+
+
+def _page_name(path, taken):
+    """
+    Return the page path (without extension) of a source file: modules/ followed by the file's
+    path without its extension, using only safe characters and never leaving the folder.
+    """
+    parts = [re.sub(r"[^A-Za-z0-9_.-]", "_", part) for part in re.split(r"[\\/]+", path) if part not in ("", ".", "..")]
+    name = "modules/" + "/".join(parts or ["module"])
+    name = name[:-3] if name.endswith(".py") else name
+    page, suffix = name, 1
+    while page in taken:
+        suffix += 1
+        page = f"{name}_{suffix}"
+    return page
+
+
+def _heading_anchors(markdown_text):
+    """
+    Map the offset of each heading to the id the Markdown renderer gives it.
+    """
+    from markdown.extensions.toc import slugify, unique
+    ids, anchors = set(), {}
+    for match in _HEADING.finditer(markdown_text):
+        anchors[match.start()] = unique(slugify(match.group(2).replace("`", ""), "-"), ids)
+    return anchors
@@ -1,18 +1,48 @@
 import os
-import requests
-from .code_parser import extract_functions_and_classes, extract_function_signature, extract_class_metadata
+import re
+import logging
+import json
+import hashlib
+import contextvars
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .code_parser import build_symbol_index
 from dotenv import load_dotenv
-from .query_handler import explain_code
-from .github_api import fetch_and_process_repo
+from .query_handler import explain_code, explain_code_budget, explain_symbols, symbols_code_budget
+from .llm_client import LLMError, get_llm_client
+from .llm_scheduler import BULK, INTERACTIVE
+from .prompt_builder import MAX_OUTPUT_TOKENS, PROMPT_TOKEN_BUDGET, chunk_code, estimate_tokens, fit_code, output_budget
+from .github_api import iter_repo_files
+from .local_source import iter_local_files
+from .metrics import stage
+from .docs_writer import MarkdownBuffer, docs_path, render_html
+from .snapshot_store import atomic_write
 
 load_dotenv()
 
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+logger = logging.getLogger(__name__)
 
-def generate_docstring(code_snippet, context=None):
+# Maximum number of DeepSeek calls in flight while generating Markdown docs
+DOCS_MAX_WORKERS = int(os.getenv("DOCS_MAX_WORKERS", "8"))
+# Ask for each symbol's explanation and example in one call, packing small symbols of a file together
+DOCS_BATCH_PROMPTS = os.getenv("DOCS_BATCH_PROMPTS", "1").lower() not in ("0", "false", "no")
+# Estimated tokens of source code packed into one combined request
+DOCS_BATCH_TOKEN_BUDGET = int(os.getenv("DOCS_BATCH_TOKEN_BUDGET", "1500"))
+# Symbols per combined request, so their answers fit the model's output limit
+DOCS_BATCH_MAX_SYMBOLS = int(os.getenv("DOCS_BATCH_MAX_SYMBOLS", "0")) or max(1, MAX_OUTPUT_TOKENS // output_budget("doc_batch"))
+
+# Fenced blocks and inline code in an answer's Markdown
+_CODE_SPAN = re.compile(r"```.*?```|`[^`\n]+`", re.DOTALL)
+
+def generate_docstring(code_snippet, context=None, use_cache=True, priority=INTERACTIVE):
     """
     Generate a docstring for a given code snippet using DeepSeek.
+    Pass use_cache=False to skip the completion cache lookup and refresh the cached answer.
+    Code over the prompt budget is reduced to signatures plus the method bodies that fit.
     """
+    code_snippet, _ = fit_code(code_snippet or "", PROMPT_TOKEN_BUDGET)
     prompt = f"""
     Generate a docstring for the following Python code. Follow PEP-257 standards and include:
     - A one-line summary.
@@ -28,33 +58,17 @@ def generate_docstring(code_snippet, context=None):
     {context if context else "No additional context provided."}
     """
 
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "deepseek-chat",  # Specify the model
-        "prompt": prompt,
-        "max_tokens": 200,
-        "temperature": 0.7
-    }
-    response = requests.post(
-        "https://api.deepseek.com/beta/completions",
-        headers=headers,
-        json=data
+    return get_llm_client().complete(
+        prompt, max_tokens=output_budget("docstring"), use_cache=use_cache, call_type="docstring", priority=priority
     )
-    if response.status_code == 200:
-        return response.json()["choices"][0]["text"].strip()
-    else:
-        # Print the response details for debugging
-        print(f"API Response: {response.status_code}, {response.text}")
-        raise Exception(f"Failed to generate docstring: {response.status_code}")
 
 
-def improve_docstring(existing_docstring, context=None):
+def improve_docstring(existing_docstring, context=None, use_cache=True, priority=INTERACTIVE):
     """
     Improve an existing docstring using DeepSeek.
+    Pass use_cache=False to skip the completion cache lookup and refresh the cached answer.
     """
+    existing_docstring = (existing_docstring or "")[:PROMPT_TOKEN_BUDGET * 4]
     prompt = f"""
     Improve the following docstring for clarity, readability, and completeness. Convert passive voice to active voice where applicable.
 
@@ -65,118 +79,509 @@ def improve_docstring(existing_docstring, context=None):
     {context if context else "No additional context provided."}
     """
 
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "deepseek-chat",  # Specify the model
-        "prompt": prompt,
-        "max_tokens": 200,
-        "temperature": 0.7
-    }
-    response = requests.post(
-        "https://api.deepseek.com/beta/completions",  # Use the beta endpoint
-        headers=headers,
-        json=data
+    return get_llm_client().complete(
+        prompt, max_tokens=output_budget("improve_docstring"), use_cache=use_cache, call_type="improve_docstring",
+        priority=priority
     )
-    if response.status_code == 200:
-        return response.json()["choices"][0]["text"].strip()
-    else:
-        # Print the response details for debugging
-        print(f"API Response: {response.status_code}, {response.text}")
-        raise Exception(f"Failed to improve docstring: {response.status_code}")    
 
 
-def generate_markdown_docs(code):
+def find_docstring_targets(code, force=False):
+    """
+    Find the functions, methods and classes of a file to write docstrings for.
+    Symbols that already have a docstring are skipped unless force is set; functions
+    nested inside other functions are never included.
+    Raises SyntaxError (or ValueError) if the code can't be parsed.
+    """
+    index = build_symbol_index(code)
+    function_scopes = {symbol.qualname for symbol in index.symbols if symbol.kind != "class"}
+    return [
+        {
+            "name": symbol.qualname,
+            "kind": symbol.kind,
+            "lineno": symbol.lineno,
+            "code": symbol.source,
+            "docstring": symbol.docstring
+        }
+        for symbol in index.symbols
+        if symbol.parent not in function_scopes and (force or not symbol.docstring)
+    ]
+
+
+def run_docstring_batch(fn, items, field, max_workers=None):
+    """
+    Apply fn(item) to every item on a bounded thread pool.
+
+    Returns one result per item, in order: its index, the item's "name" and "lineno" (when
+    present) and either fn's return value under `field` or an "error", so one failure doesn't
+    fail the batch.
+    """
+    def run(item):
+        outcome = {key: item[key] for key in ("name", "lineno") if key in item}
+        try:
+            outcome[field] = fn(item)
+        except Exception as e:
+            outcome["error"] = str(e)
+        return outcome
+
+    with ThreadPoolExecutor(max_workers=max_workers or DOCS_MAX_WORKERS) as executor:
+        # Copy the caller's context into each task so token usage is tracked across threads
+        futures = [executor.submit(contextvars.copy_context().run, run, item) for item in items]
+        return [dict(future.result(), index=position) for position, future in enumerate(futures)]
+
+
+def generate_markdown_docs(code, max_workers=None, use_cache=True, skipped=None, manifest=None, progress=None, batched=None,
+                           writer=None):
     """
     Generate enhanced Markdown documentation from Python code or a directory containing Python files.
+
+    The DeepSeek calls for every symbol run concurrently on a bounded thread pool,
+    while the sections are still written in source order. Multi-file input is
+    streamed one file at a time: each file is parsed on its own, gets its own
+    section, and a file that fails to parse is listed under "Skipped files".
+
+    When a docs manifest (see `load_docs_manifest`) is passed, symbols whose
+    fingerprint hasn't changed reuse their recorded section and only new or
+    changed symbols are sent to DeepSeek. The manifest is updated in place.
+
+    Symbols with the same shape (see `shape_fingerprint`) are sent to DeepSeek once;
+    later copies reuse the answers with their own name filled in wherever it appears as code.
+
+    A class too large for one prompt is explained from its signatures and the method
+    bodies that fit, and the remaining methods are asked about in follow-up calls.
+
+    In batched mode the explanation and example of a symbol are requested together
+    as JSON, and consecutive symbols of a file share one request up to
+    DOCS_BATCH_TOKEN_BUDGET; a symbol missing from the answer is asked about separately.
+
+    Sections go to `writer` as soon as they are rendered: `write(text)` for document-level
+    text and `write_module(path, markdown)` for each file of a multi-file run. Pass a
+    `DocsSite` to stream a repository's docs to disk as one page per module.
     
     Args:
-        code_or_directory (str): Either a string of Python code or a path to a directory containing .py files.
+        code_or_directory: A string of Python code, a path to a directory containing .py files,
+            or an iterable of (path, source) pairs such as `iter_repo_files`.
+        max_workers (int): Maximum number of DeepSeek calls in flight. Defaults to DOCS_MAX_WORKERS.
+        use_cache (bool): Whether to serve answers from the completion cache.
+        skipped (list): Optional list of (path, reason) pairs already skipped upstream; parse failures are appended.
+        manifest (dict): Optional docs manifest to reuse unchanged sections from and record this run in.
+        progress (callable): Optional progress(files_processed=..., symbols_processed=...) callback.
+        batched (bool): Use combined multi-symbol prompts. Defaults to DOCS_BATCH_PROMPTS.
+        writer: Optional output such as a `DocsSite`. Defaults to an in-memory `MarkdownBuffer`.
     
     Returns:
-        str: Generated Markdown documentation.
-    """
-    docs = "# API Documentation\n\n"
-
-    print(code)
-
-    # If the input is a directory, find and process all .py files
-    if os.path.isdir(code):
-        print(f"Processing directory: {code}")
-        all_code = ""
-        for root, _, files in os.walk(code):
-            for file in files:
-                if file.endswith(".py"):
-                    filepath = os.path.join(root, file)
-                    print(f"Processing file: {filepath}")
-                    with open(filepath, "r") as f:
-                        code = f.read()
-                        all_code += f"# File: {filepath}\n\n{code}\n\n"
-        code = all_code
+        str: Generated Markdown documentation, or None when a writer is passed.
+    """
+    docs = writer or MarkdownBuffer()
+    docs.write("# API Documentation\n\n")
+    max_workers = max_workers or DOCS_MAX_WORKERS
+    run = {
+        "previous": manifest["symbols"] if manifest else {},
+        "current": {},
+        "use_cache": use_cache,
+        "batched": DOCS_BATCH_PROMPTS if batched is None else batched,
+        "reused": 0,
+        "generated": 0,
+        "deduplicated": 0,
+        "shapes": {},
+        "files": 0,
+        "progress": progress
+    }
+
+    if isinstance(code, str) and not os.path.isdir(code):
+        # A single code snippet keeps the flat Functions/Classes layout
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            docs.write(_render_symbol_docs(_queue_symbol_docs(executor, code, run), run, heading_level=2))
+        _finish_manifest(manifest, run, docs.hexdigest())
+        logger.info("Markdown documentation generated: %s", _run_stats(run))
+        return None if writer else docs.getvalue()
+
+    skipped = skipped if skipped is not None else []
+    if isinstance(code, str):
+        logger.info("Processing directory: %s", code)
+        code = iter_directory_files(code, on_error=lambda path, error: skipped.append((path, error)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Keep a bounded window of queued questions so memory doesn't grow with the repository
+        window = max_workers * 4
+        pending = deque()
+        in_flight = 0
+        for path, source in code:
+            logger.debug("Processing file: %s", path)
+            run["files"] += 1
+            _report_progress(run)
+            try:
+                queued = _queue_symbol_docs(executor, source, run, path)
+            except (SyntaxError, ValueError) as e:
+                logger.warning("Skipping %s: %s", path, e)
+                skipped.append((path, f"{type(e).__name__}: {str(e)}"))
+                continue
+            if not queued["functions"] and not queued["classes"]:
+                continue
+            pending.append((path, queued))
+            in_flight += queued["questions"]
+            while in_flight > window:
+                done_path, done = pending.popleft()
+                docs.write_module(done_path, _render_file_docs(done_path, done, run))
+                in_flight -= done["questions"]
+        while pending:
+            done_path, done = pending.popleft()
+            docs.write_module(done_path, _render_file_docs(done_path, done, run))
+
+    if skipped:
+        docs.write("## Skipped files\n\n" + "".join(f"- `{path}`: {reason}\n" for path, reason in skipped) + "\n")
+
+    _finish_manifest(manifest, run, docs.hexdigest())
+    logger.info("Markdown documentation generated: %s", _run_stats(run))
+    return None if writer else docs.getvalue()
+
+def iter_directory_files(directory, on_error=None):
+    """
+    Yield (path, source) for every .py file under a directory that .gitignore doesn't exclude, one file at a time.
+    Files are read and parsed on a process pool (see `iter_local_files`); paths include `directory`.
+    """
+    for path, source in iter_local_files(
+        directory, on_error=(lambda path, error: on_error(os.path.join(directory, path), error)) if on_error else None
+    ):
+        yield os.path.join(directory, path), source
+
+def _report_progress(run):
+    if run["progress"] is not None:
+        run["progress"](files_processed=run["files"], symbols_processed=run["reused"] + run["generated"])
+
+def _symbol_key(symbol, path=None):
+    """
+    Manifest key of a documented symbol: its qualified name, prefixed by the file path in multi-file runs.
+    """
+    return f"{path}::{symbol.qualname}" if path else symbol.qualname
+
+def _queue_symbol_docs(executor, code, run, path=None):
+    """
+    Index one piece of code and submit the DeepSeek questions for its functions and classes.
+    Symbols whose fingerprint matches the previous manifest reuse the recorded section instead.
+    `questions` counts the DeepSeek requests submitted.
+    Raises SyntaxError (or ValueError) if the code can't be parsed.
+    """
+    index = build_symbol_index(code)
+    functions, classes = index.functions, index.classes
+    logger.debug("Found %d functions and %d classes.", len(functions), len(classes))
+    queued = {"functions": [], "classes": [], "questions": 0}
+    to_generate = []
+    for kind, symbols in (("function", functions), ("class", classes)):
+        for symbol in symbols:
+            key = _symbol_key(symbol, path)
+            previous = run["previous"].get(key)
+            entry = [symbol, key, None]
+            original = run["shapes"].get(symbol.shape)
+            if previous and previous["fingerprint"] == symbol.fingerprint:
+                entry[2] = previous["body"]
+            elif original is not None:
+                entry[2] = _duplicate_answers(original, symbol.name)
+                run["deduplicated"] += 1
+            else:
+                # Only the name and the answers are kept for the rest of the run, not the symbol
+                shape = run["shapes"][symbol.shape] = [symbol.name, None]
+                to_generate.append((symbol, kind, entry, shape))
+            queued["functions" if kind == "function" else "classes"].append(entry)
+
+    if run["batched"]:
+        for pack in _pack_symbols(to_generate):
+            answers = executor.submit(
+                contextvars.copy_context().run, explain_symbols,
+                [(kind, symbol.name, symbol.source) for symbol, kind, _, _ in pack], use_cache=run["use_cache"],
+                priority=BULK
+            )
+            picked = _submit_fallback_questions(executor, answers, pack, run["use_cache"])
+            budget = symbols_code_budget([symbol.source for symbol, _, _, _ in pack])
+            for symbol, kind, entry, shape in pack:
+                overflow = _submit_overflow_questions(executor, symbol, budget, run["use_cache"])
+                entry[2] = shape[1] = _answer_once(_with_overflow(picked[symbol.name], overflow))
+                queued["questions"] += len(overflow)
+            queued["questions"] += 1
     else:
-        # If the input is a string of code, use it directly
-        code = code
+        for symbol, kind, entry, shape in to_generate:
+            budget = explain_code_budget(_explanation_question(kind, symbol.name))
+            overflow = _submit_overflow_questions(executor, symbol, budget, run["use_cache"])
+            entry[2] = shape[1] = _answer_once(_with_overflow(
+                _submit_symbol_questions(executor, symbol.source, kind, symbol.name, run["use_cache"]), overflow
+            ))
+            queued["questions"] += 2 + len(overflow)
+    return queued
+
+def _submit_overflow_questions(executor, symbol, budget, use_cache=True):
+    """
+    Submit one follow-up question per chunk of methods whose bodies don't fit the `budget` the
+    class's code gets in its main prompt (see `chunk_code`). Each chunk fits its own follow-up
+    prompt. Returns their futures; none for functions and for classes that fit.
+    """
+    if symbol.kind != "class":
+        return []
+    question = f"These methods of the class `{symbol.name}` didn't fit in the main request. What do they do?"
+    _, _, chunks = chunk_code(symbol.source, budget, chunk_budget=explain_code_budget(question))
+    return [
+        executor.submit(
+            contextvars.copy_context().run, explain_code, chunk, question,
+            use_cache=use_cache, call_type="doc_explanation", priority=BULK
+        )
+        for chunk in chunks
+    ]
+
+def _with_overflow(answers, overflow):
+    """
+    Append the answers of follow-up method questions to a symbol's explanation.
+    """
+    if not overflow:
+        return answers
+
+    def resolve():
+        explanation, example = answers()
+        more = "\n\n".join(future.result() for future in overflow)
+        return f"{explanation}\n\n**More methods:** {more}", example
+
+    return resolve
+
+def _pack_symbols(to_generate, budget=None, max_symbols=None):
+    """
+    Group symbols in source order into packs whose combined source fits the batch token budget,
+    with at most DOCS_BATCH_MAX_SYMBOLS symbols each. A symbol larger than the budget gets a pack of its own.
+    """
+    budget = budget or DOCS_BATCH_TOKEN_BUDGET
+    max_symbols = max_symbols or DOCS_BATCH_MAX_SYMBOLS
+    packs = []
+    pack, names, used = [], set(), 0
+    for item in sorted(to_generate, key=lambda item: item[0].lineno):
+        symbol = item[0]
+        cost = estimate_tokens(symbol.source)
+        # Answers are keyed by name, so a redefined name starts a new pack
+        if pack and (used + cost > budget or symbol.name in names or len(pack) >= max_symbols):
+            packs.append(pack)
+            pack, names, used = [], set(), 0
+        pack.append(item)
+        names.add(symbol.name)
+        used += cost
+    if pack:
+        packs.append(pack)
+    return packs
+
+def _answer_once(answers):
+    """
+    Wrap a function returning a symbol's answers so it runs once. Afterwards only the answers (or
+    the error) are kept, not the symbol source and futures the function refers to.
+    """
+    state = {"answers": answers}
 
-    # Extract functions and classes from the code
-    functions, classes = extract_functions_and_classes(code)
-    print(f"Found {len(functions)} functions and {len(classes)} classes.")
+    def resolve():
+        if "answers" in state:
+            try:
+                state["value"] = state.pop("answers")()
+            except Exception as e:
+                state["error"] = e
+        if "error" in state:
+            raise state["error"]
+        return state["value"]
+
+    return resolve
+
+def _submit_fallback_questions(executor, answers, pack, use_cache=True):
+    """
+    Once a pack's combined answer arrives, submit the two separate questions (see
+    `_submit_symbol_questions`) for each symbol it failed to answer, so they run on the executor
+    like every other question. Returns name -> function giving that symbol's (explanation, example).
+    """
+    # Done callbacks run outside the caller's context, so submit from a copy of it
+    context = contextvars.copy_context()
+    ready = threading.Event()
+    picked = {}
+
+    def pick(_):
+        try:
+            try:
+                combined = answers.result()
+            except (ValueError, LLMError) as e:
+                logger.warning("No combined answer for %s: %s", ", ".join(item[0].name for item in pack), e)
+                combined = {}
+            for symbol, kind, _, _ in pack:
+                answer = combined.get(symbol.name)
+                if answer and answer["explanation"]:
+                    picked[symbol.name] = lambda answer=answer: (answer["explanation"], answer["example"])
+                else:
+                    picked[symbol.name] = context.copy().run(
+                        _submit_symbol_questions, executor, symbol.source, kind, symbol.name, use_cache
+                    )
+        except Exception as e:
+            for symbol, _, _, _ in pack:
+                picked.setdefault(symbol.name, functools.partial(_raise, e))
+        finally:
+            ready.set()
+
+    def waiter(name):
+        def resolve():
+            ready.wait()
+            return picked[name]()
+        return resolve
+
+    answers.add_done_callback(pick)
+    return {symbol.name: waiter(symbol.name) for symbol, _, _, _ in pack}
+
+def _raise(error):
+    raise error
+
+def _duplicate_answers(original, name):
+    """
+    Return a function giving the answers of an identically shaped symbol, with its name replaced by `name`.
+    `original` is the run's [name, answers] record of the first symbol of that shape. The name is
+    only replaced in code: inside code spans of the explanation, and in the example.
+    """
+    pattern = re.compile(rf"\b{re.escape(original[0])}\b")
+
+    def rename(code):
+        return pattern.sub(lambda match: name, code)
+
+    def resolve():
+        explanation, example = original[1]()
+        return _CODE_SPAN.sub(lambda span: rename(span.group(0)), explanation), rename(example)
+
+    return resolve
+
+def _render_file_docs(path, queued, run):
+    """
+    Render the section for one file of a multi-file run.
+    """
+    return f"## `{path}`\n\n" + _render_symbol_docs(queued, run, heading_level=3)
+
+def _render_symbol_docs(queued, run, heading_level):
+    """
+    Render queued function and class documentation, waiting for each answer in source order.
+    """
+    section = "#" * heading_level
+    heading = "#" * (heading_level + 1)
+    docs = []
 
     # Add function documentation
-    docs += "## Functions\n\n"
-    for func in functions:
-        signature = extract_function_signature(func)
-        print(f"Processing function: {signature['name']}")
-        docs += f"### `{signature['name']}`\n"
-        docs += f"**Arguments:** `{', '.join(signature['args'])}`\n\n"
-        docs += f"**Returns:** `{signature['returns']}`\n\n"
-
-        # Generate AI explanation for the function
-        explanation = explain_code(func, f"What does the function `{signature['name']}` do?")
-        docs += f"**Explanation:** {explanation}\n\n"
-
-        # Generate AI example usage for the function
-        example = explain_code(func, f"Provide an example usage for the function `{signature['name']}`.")
-        docs += f"**Example Usage:**\n```python\n{example}\n```\n\n"
+    docs.append(f"{section} Functions\n\n")
+    for func, key, answers in queued["functions"]:
+        logger.debug("Processing function: %s", func.name)
+        details = (
+            f"**Arguments:** `{', '.join(func.signature['args'])}`\n\n"
+            f"**Returns:** `{func.signature['returns']}`\n\n"
+        )
+        docs.append(f"{heading} `{func.name}`\n" + _symbol_body(func, key, details, answers, run))
 
     # Add class documentation
-    docs += "## Classes\n\n"
-    for cls in classes:
-        metadata = extract_class_metadata(cls)
-        print(f"Processing class: {metadata['name']}")
-        docs += f"### `{metadata['name']}`\n"
-        docs += f"**Methods:** `{', '.join(metadata['methods'])}`\n\n"
-        docs += f"**Docstring:** {metadata['docstring']}\n\n"
+    docs.append(f"{section} Classes\n\n")
+    for cls, key, answers in queued["classes"]:
+        logger.debug("Processing class: %s", cls.name)
+        details = (
+            f"**Methods:** `{', '.join(cls.methods)}`\n\n"
+            f"**Docstring:** {cls.docstring}\n\n"
+        )
+        docs.append(f"{heading} `{cls.name}`\n" + _symbol_body(cls, key, details, answers, run))
+    return "".join(docs)
+
+def _symbol_body(symbol, key, details, answers, run):
+    """
+    Return the section body (everything below the heading) for one symbol and record it in the run.
+    `answers` is either a reused body from the manifest or a function returning the DeepSeek answers.
+    """
+    if isinstance(answers, str):
+        body = answers
+        run["reused"] += 1
+    else:
+        answers_text, ok = _format_symbol_answers(symbol.name, answers)
+        body = details + answers_text
+        run["generated"] += 1
+        if not ok:
+            # Leave failed symbols out of the manifest so the next run retries them
+            _report_progress(run)
+            return body
+    run["current"][key] = {"fingerprint": symbol.fingerprint, "kind": symbol.kind, "body": body}
+    _report_progress(run)
+    return body
+
+def _submit_symbol_questions(executor, source, kind, name, use_cache=True):
+    """
+    Submit the explanation and example usage questions for one symbol.
+    Returns a function that waits for both answers.
+    """
+    # Run each call in a copy of the caller's context so token usage is tracked across threads
+    explanation = executor.submit(
+        contextvars.copy_context().run, explain_code, source, _explanation_question(kind, name),
+        use_cache=use_cache, call_type="doc_explanation", priority=BULK
+    )
+    example = executor.submit(
+        contextvars.copy_context().run, explain_code, source, f"Provide an example usage for the {kind} `{name}`.",
+        use_cache=use_cache, call_type="doc_example", priority=BULK
+    )
+    return lambda: (explanation.result(), example.result())
+
+def _explanation_question(kind, name):
+    return f"What does the {kind} `{name}` do?"
+
+def _format_symbol_answers(name, answers):
+    """
+    Render the AI explanation and example for one symbol, or the error that prevented them.
+    Returns (markdown, ok).
+    """
+    try:
+        explanation_text, example_text = answers()
+    except Exception as e:
+        logger.warning("Failed to document %s: %s", name, e)
+        return f"**Error:** Failed to generate documentation for `{name}`: {str(e)}\n\n", False
+    return (
+        f"**Explanation:** {explanation_text}\n\n"
+        f"**Example Usage:**\n```python\n{example_text}\n```\n\n"
+    ), True
+
+def _finish_manifest(manifest, run, document_hash):
+    if manifest is None:
+        return
+    manifest["symbols"] = run["current"]
+    manifest["document"] = document_hash
+    manifest["last_run"] = _run_stats(run)
+
+def _run_stats(run):
+    """
+    Symbol counts of a run: reused from the manifest, generated, and generated from an identically shaped symbol.
+    """
+    return {
+        "reused": run["reused"],
+        "generated": run["generated"],
+        "deduplicated": run["deduplicated"],
+        "dedupe_ratio": round(run["deduplicated"] / run["generated"], 3) if run["generated"] else 0.0
+    }
 
-        # Generate AI explanation for the class
-        explanation = explain_code(cls, f"What does the class `{metadata['name']}` do?")
-        docs += f"**Explanation:** {explanation}\n\n"
+def _manifest_filename(filename):
+    return f"{os.path.splitext(filename)[0]}.manifest.json"
 
-        # Generate AI example usage for the class
-        example = explain_code(cls, f"Provide an example usage for the class `{metadata['name']}`.")
-        docs += f"**Example Usage:**\n```python\n{example}\n```\n\n"
+def load_docs_manifest(filename):
+    """
+    Load the manifest saved next to a generated document (e.g. docs/docs.manifest.json for docs.md).
+    Returns an empty manifest if none has been saved yet.
+    """
+    try:
+        with open(docs_path(_manifest_filename(filename)), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"version": 1, "document": None, "symbols": {}}
 
-    print("Markdown documentation generated successfully.")
-    return docs
+def save_docs_manifest(manifest, filename):
+    """
+    Save the manifest for a generated document in the /docs folder.
+    """
+    save_docs(json.dumps(manifest, indent=2), _manifest_filename(filename))
 
 def generate_html_docs(markdown_docs):
     """
     Convert Markdown documentation to HTML.
     """
-    import markdown
-    return markdown.markdown(markdown_docs)
+    return render_html(markdown_docs)
 
 def save_docs(docs, filename):
     """
-    Save documentation to a file in the /docs folder.
-    If the /docs folder doesn't exist, create it.
+    Save documentation to a file in the docs folder (DOCS_DIR), creating the folder if needed.
+    The file is replaced atomically, so readers never see a partly written document.
     """
-    # Ensure the /docs folder exists
-    os.makedirs("docs", exist_ok=True)
-    # Save the file in the /docs folder
-    with open(f"docs/{filename}", "w") as f:
-        f.write(docs)
+    with stage("save"):
+        atomic_write(docs_path(filename), docs)
 
 def push_to_github(docs, repo_name, branch="gh-pages"):
     """
@@ -186,19 +591,60 @@ def push_to_github(docs, repo_name, branch="gh-pages"):
     # Save docs to a temporary file in the /docs folder
     save_docs(docs, "index.html")
     # Push the /docs folder to GitHub Pages
-    subprocess.run(["git", "add", "docs/"])
+    subprocess.run(["git", "add", docs_path()])
     subprocess.run(["git", "commit", "-m", "Update documentation"])
     subprocess.run(["git", "push", "origin", branch])
 
 
-def detect_outdated_docs(code, docs):
+def detect_outdated_docs(code, docs=None, manifest=None):
     """
-    Detect outdated documentation by comparing code and docs.
+    Detect outdated documentation by comparing the code's symbols with what the docs cover.
+
+    With a manifest that describes `docs` (or when `docs` is omitted), symbols are compared
+    by normalized-AST fingerprint, so added, removed and changed symbols are all reported.
+    Without one, the symbol headings found in `docs` are compared with the code, which
+    catches added and removed symbols only. No DeepSeek calls are made.
+
+    Returns:
+        dict: `outdated`, `message` and the sorted `added`, `removed` and `changed` symbol keys.
     """
-    current_docs = generate_markdown_docs(code)
-    if current_docs != docs:
-        return "Documentation is outdated. Please regenerate."
-    return "Documentation is up-to-date."
+    if isinstance(code, str) and not os.path.isdir(code):
+        files = [(None, code)]
+    else:
+        files = iter_directory_files(code) if isinstance(code, str) else code
+
+    current = {}
+    for path, source in files:
+        try:
+            index = build_symbol_index(source)
+        except (SyntaxError, ValueError):
+            if path is None:
+                raise
+            continue
+        for symbol in index.functions + index.classes:
+            current[_symbol_key(symbol, path)] = symbol
+
+    document_hash = hashlib.sha256(docs.encode("utf-8")).hexdigest() if docs is not None else None
+    if manifest and manifest.get("symbols") and (docs is None or manifest.get("document") == document_hash):
+        recorded = manifest["symbols"]
+        added = [key for key in current if key not in recorded]
+        removed = [key for key in recorded if key not in current]
+        changed = [key for key in current if key in recorded and recorded[key]["fingerprint"] != current[key].fingerprint]
+    else:
+        documented = set(re.findall(r"^#+ `([^`]+)`$", docs or "", re.MULTILINE))
+        added = [key for key, symbol in current.items() if symbol.name not in documented]
+        names = {symbol.name for symbol in current.values()}
+        removed = [name for name in documented if name not in names and not name.endswith(".py")]
+        changed = []
+
+    outdated = bool(added or removed or changed)
+    return {
+        "outdated": outdated,
+        "message": "Documentation is outdated. Please regenerate." if outdated else "Documentation is up-to-date.",
+        "added": sorted(added),
+        "removed": sorted(removed),
+        "changed": sorted(changed)
+    }
 
 def tag_documentation_version(version):
     """
@@ -208,9 +654,32 @@ def tag_documentation_version(version):
     subprocess.run(["git", "tag", f"v{version}"])
     subprocess.run(["git", "push", "origin", f"v{version}"])
 
-def generate_repo_docs(owner, repo):
+def generate_repo_docs(owner, repo, ref=None, manifest=None, progress=None, writer=None):
     """
-    Generate documentation for an entire repository.
+    Generate documentation for an entire repository at `ref` (the default branch when omitted).
+    Pass the repo docs manifest to only regenerate symbols that changed since the last run.
+    `progress` also receives files_total=... once the repository has been listed.
+    With a `writer` (such as a `DocsSite`) the docs are streamed to it and None is returned.
     """
-    code = fetch_and_process_repo(owner, repo)
-    return generate_markdown_docs(code)
\ No newline at end of file
+    skipped = []
+    files = iter_repo_files(
+        owner, repo, ref=ref,
+        on_error=lambda path, error: skipped.append((path, str(error))),
+        on_listed=(lambda total: progress(files_total=total)) if progress else None
+    )
+    return generate_markdown_docs(files, skipped=skipped, manifest=manifest, progress=progress, writer=writer)
+
+def generate_local_docs(source, include=None, exclude=None, manifest=None, progress=None, writer=None):
+    """
+    Generate documentation for a local directory or a tar/zip archive without any GitHub calls.
+    `include` and `exclude` are .gitignore-style globs (by default every .py file), and the
+    source's own .gitignore files are honored. Files are parsed on a process pool.
+    Takes the same manifest, progress and writer arguments as `generate_repo_docs`.
+    """
+    skipped = []
+    files = iter_local_files(
+        source, include=include, exclude=exclude,
+        on_error=lambda path, error: skipped.append((path, error)),
+        on_listed=(lambda total: progress(files_total=total)) if progress else None
+    )
+    return generate_markdown_docs(files, skipped=skipped, manifest=manifest, progress=progress, writer=writer)
\ No newline at end of file
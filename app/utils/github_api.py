@@ -1,32 +1,322 @@
 import os
+import re
+import json
+import hashlib
+import logging
+import contextvars
+import posixpath
+import threading
 import requests
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from .metrics import record_cache_lookup, record_github_rate_limit, stage
+from .shared_storage import SharedState
+from .snapshot_store import get_snapshot_store
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 GITHUB_ACCESS_TOKEN = os.getenv("GITHUB_ACCESS_TOKEN")
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_RAW_URL = os.getenv("GITHUB_RAW_URL", "https://raw.githubusercontent.com")
+# Number of files downloaded concurrently during repository ingestion
+GITHUB_MAX_WORKERS = int(os.getenv("GITHUB_MAX_WORKERS", "8"))
+GITHUB_TIMEOUT = float(os.getenv("GITHUB_TIMEOUT", "30"))
+
+# Start spacing out API requests once less than this share of the rate-limit window is left
+GITHUB_THROTTLE_THRESHOLD = float(os.getenv("GITHUB_THROTTLE_THRESHOLD", "0.5"))
+GITHUB_MAX_RETRIES = int(os.getenv("GITHUB_MAX_RETRIES", "5"))
+# First wait after a secondary rate limit without Retry-After (doubles on each retry)
+GITHUB_SECONDARY_BACKOFF = float(os.getenv("GITHUB_SECONDARY_BACKOFF", "60"))
+# Longest single wait for a rate limit to reset before giving up
+GITHUB_MAX_WAIT = float(os.getenv("GITHUB_MAX_WAIT", "3600"))
+
+
+class GitHubClient:
+    """
+    The one HTTP client for GitHub, shared by every request, job and download worker.
+
+    It keeps the X-RateLimit-Remaining/-Reset budget reported by the API and paces
+    requests ahead of time: once less than `throttle_threshold` of the window is left,
+    calls are spread evenly over the time until the reset, and when the budget is gone
+    every caller waits for the reset, after which the pace starts over from the new budget.
+    The budget and the next request slot live in `state` (the SharedState file by default),
+    so every worker process on the host spends one budget per token. Primary and secondary rate-limit responses
+    (403/429) are retried after Retry-After, the reset time, or an exponential backoff,
+    and a secondary limit pauses all callers, not just the one that hit it. Raw file
+    downloads don't count against the API budget and aren't paced.
+    """
+
+    def __init__(self, token=GITHUB_ACCESS_TOKEN, pool_size=GITHUB_MAX_WORKERS, timeout=GITHUB_TIMEOUT,
+                 throttle_threshold=GITHUB_THROTTLE_THRESHOLD, max_retries=GITHUB_MAX_RETRIES,
+                 secondary_backoff=GITHUB_SECONDARY_BACKOFF, max_wait=GITHUB_MAX_WAIT, state=None):
+        self.token = token
+        self.timeout = timeout
+        self.throttle_threshold = throttle_threshold
+        self.max_retries = max_retries
+        self.secondary_backoff = secondary_backoff
+        self.max_wait = max_wait
+        # Keep-alive session with enough pooled connections for the download workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.state = state if state is not None else SharedState()
+        # Budgets are per token, so clients with different tokens pace separately
+        self._state_key = "github:" + (hashlib.sha256(token.encode()).hexdigest()[:16] if token else "anonymous")
+
+    @property
+    def budget(self):
+        """
+        {"limit", "remaining", "reset"} from the latest API response of any worker, less the requests started since.
+        """
+        return (self.state.get(self._state_key) or {}).get("budget")
+
+    def headers(self, accept=None):
+        headers = {"Authorization": f"token {self.token}"} if self.token else {}
+        if accept:
+            headers["Accept"] = accept
+        return headers
+
+    def get(self, url, headers=None, params=None):
+        """
+        GET a GitHub URL, pacing API calls to the rate-limit budget and retrying rate-limit responses.
+        Other error responses are returned to the caller.
+        """
+        paced = not url.startswith(GITHUB_RAW_URL)
+        attempt = 0
+        while True:
+            if paced:
+                self._wait_for_slot()
+            response = self.session.get(url, headers=headers, params=params, timeout=self.timeout)
+            if paced:
+                self._update_budget(response)
+            delay = self._rate_limit_delay(response, attempt)
+            if delay is None:
+                return response
+            if attempt >= self.max_retries or delay > self.max_wait:
+                raise Exception(f"GitHub rate limit exceeded: {response.status_code}, retry in {delay:.0f}s")
+            logger.warning("GitHub rate limit hit (%s); retrying in %.1f seconds.", response.status_code, delay)
+            response.close()
+            self._pause(delay)
+            attempt += 1
+
+    def _wait_for_slot(self):
+        """
+        Reserve the next request slot and sleep until it comes up.
+        """
+        now = time.time()
+        slot = self.state.update(self._state_key, lambda state: self._reserve(state, now))
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _reserve(self, state, now):
+        """
+        Take the next request slot from the pacing state at wall-clock time `now`. Returns (new state, slot).
+        """
+        state = state or {"budget": None, "next_slot": 0.0}
+        budget = state["budget"]
+        if budget and budget["reset"] is not None and budget["reset"] <= now:
+            # The window has reset and the whole budget is back; the next response reports it
+            budget = None
+        slot = max(now, state["next_slot"])
+        if budget and budget["reset"] is not None and budget["remaining"] <= 0:
+            # Used up: every caller waits for the reset itself, not for one another
+            slot = max(slot, min(budget["reset"] + 1, now + self.max_wait))
+            return {"budget": None, "next_slot": slot}, slot
+        next_slot = slot + self._interval(budget, now)
+        if budget:
+            # Count the request now so concurrent callers see the reduced budget
+            budget = dict(budget, remaining=budget["remaining"] - 1)
+        return {"budget": budget, "next_slot": next_slot}, slot
+
+    def _interval(self, budget, now):
+        """
+        Seconds to leave between requests: none while the budget is comfortable, and an even share
+        of the time left until the reset once it runs low.
+        """
+        if not budget or budget["reset"] is None or budget["remaining"] <= 0:
+            return 0.0
+        if budget["limit"] and budget["remaining"] / budget["limit"] >= self.throttle_threshold:
+            return 0.0
+        return max(budget["reset"] - now, 0) / budget["remaining"]
 
-def fetch_repo_contents(owner, repo, path=""):
+    def _update_budget(self, response):
+        record_github_rate_limit(response)
+        # Only the core budget paces requests; other resources (search, graphql) have their own windows
+        if response.headers.get("X-RateLimit-Resource", "core") != "core":
+            return
+        try:
+            budget = {
+                "limit": int(response.headers.get("X-RateLimit-Limit", 0)),
+                "remaining": int(response.headers["X-RateLimit-Remaining"]),
+                "reset": float(response.headers["X-RateLimit-Reset"]) if "X-RateLimit-Reset" in response.headers else None
+            }
+        except (KeyError, ValueError):
+            return
+        self.state.update(self._state_key, lambda state: (dict(state or {"next_slot": 0.0}, budget=budget), None))
+
+    def _rate_limit_delay(self, response, attempt):
+        """
+        Return how long to wait before retrying a rate-limited response, or None if it isn't one.
+        """
+        if response.status_code not in (403, 429):
+            return None
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return max(float(retry_after), 0)
+            except ValueError:
+                pass
+        if response.headers.get("X-RateLimit-Remaining") == "0" and response.headers.get("X-RateLimit-Reset"):
+            return max(float(response.headers["X-RateLimit-Reset"]) - time.time(), 0) + 1
+        if response.status_code == 429 or "rate limit" in response.text.lower():
+            # Secondary rate limit without a hint: back off exponentially
+            return self.secondary_backoff * 2 ** attempt
+        return None
+
+    def _pause(self, delay):
+        """
+        Hold back every API caller, in every worker process, for `delay` seconds, then sleep through it.
+        """
+        until = time.time() + delay
+        self.state.update(self._state_key, lambda state: (
+            dict(state or {"budget": None}, next_slot=max((state or {}).get("next_slot", 0.0), until)), None
+        ))
+        time.sleep(delay)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_github_client():
+    """
+    Return the process-wide GitHub client, creating it on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GitHubClient()
+        return _client
+
+def set_github_client(client):
+    """
+    Replace the process-wide GitHub client (used by tests to shorten its waits).
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+def _conditional_get(url, accept=None):
+    """
+    GET a GitHub API URL with If-None-Match, reusing the stored body on 304 Not Modified.
+    Unchanged lookups answered with 304 don't count against the rate limit.
+    """
+    store = get_snapshot_store()
+    etag, cached_body = store.get_etag(url)
+    client = get_github_client()
+    headers = client.headers(accept)
+    if etag:
+        headers["If-None-Match"] = etag
+    response = client.get(url, headers=headers)
+    if etag:
+        record_cache_lookup("github_etag", response.status_code == 304)
+    if response.status_code == 304 and cached_body is not None:
+        return 200, cached_body
+    if response.status_code == 200 and response.headers.get("ETag"):
+        store.set_etag(url, response.headers["ETag"], response.text)
+    return response.status_code, response.text
+
+def resolve_ref(owner, repo, ref=None):
+    """
+    Resolve a branch, tag or commit (the default branch when ref is None) to a commit SHA.
+    """
+    if ref and re.fullmatch(r"[0-9a-f]{40}", ref):
+        # Already a full commit SHA
+        return ref
+    if not ref:
+        status, body = _conditional_get(f"{GITHUB_API_URL}/repos/{owner}/{repo}")
+        if status != 200:
+            raise Exception(f"Failed to fetch repository metadata: {status}")
+        ref = json.loads(body)["default_branch"]
+    # The sha media type returns just the commit SHA instead of the full commit payload
+    status, body = _conditional_get(
+        f"{GITHUB_API_URL}/repos/{owner}/{repo}/commits/{quote(ref, safe='')}",
+        accept="application/vnd.github.sha"
+    )
+    if status != 200:
+        raise Exception(f"Failed to resolve ref {ref}: {status}")
+    return body.strip()
+
+def _fetch_tree(owner, repo, tree_sha, recursive):
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/git/trees/{tree_sha}"
+    params = {"recursive": "1"} if recursive else None
+    client = get_github_client()
+    response = client.get(url, headers=client.headers(), params=params)
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch repository tree: {response.status_code}")
+    return response.json()
+
+def list_repo_tree(owner, repo, commit_sha):
+    """
+    List every file in a commit with one recursive git-trees request.
+    Falls back to walking subtrees when GitHub truncates a very large tree.
+    """
+    tree = _fetch_tree(owner, repo, commit_sha, recursive=True)
+    entries = tree["tree"]
+    if tree.get("truncated"):
+        entries = []
+        pending = [("", commit_sha)]
+        while pending:
+            prefix, tree_sha = pending.pop()
+            for entry in _fetch_tree(owner, repo, tree_sha, recursive=False)["tree"]:
+                entry = dict(entry, path=f"{prefix}{entry['path']}")
+                if entry["type"] == "tree":
+                    pending.append((f"{entry['path']}/", entry["sha"]))
+                else:
+                    entries.append(entry)
+    return [
+        {
+            "name": posixpath.basename(entry["path"]),
+            "path": entry["path"],
+            "type": "file",
+            "sha": entry["sha"],
+            "size": entry.get("size"),
+            "download_url": f"{GITHUB_RAW_URL}/{owner}/{repo}/{commit_sha}/{quote(entry['path'])}"
+        }
+        for entry in entries if entry["type"] == "blob"
+    ]
+
+def list_snapshot_files(owner, repo, commit_sha):
+    """
+    List the files of a commit from the snapshot store, fetching and recording the tree on first sight.
+    """
+    store = get_snapshot_store()
+    files = store.load_snapshot(owner, repo, commit_sha)
+    record_cache_lookup("snapshot", files is not None)
+    if files is None:
+        with stage("github_list"):
+            files = list_repo_tree(owner, repo, commit_sha)
+        store.save_snapshot(owner, repo, commit_sha, files)
+    return files
+
+def fetch_repo_contents(owner, repo, path="", ref=None):
     """
     Fetch the contents of a GitHub repository recursively.
+    Only files under `path` are returned; `ref` defaults to the default branch.
     """
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
-    headers = {"Authorization": f"token {GITHUB_ACCESS_TOKEN}"}
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        contents = response.json()
-        all_contents = []
-        for item in contents:
-            if item["type"] == "dir":
-                # Recursively fetch contents of the directory
-                all_contents.extend(fetch_repo_contents(owner, repo, item["path"]))
-            else:
-                all_contents.append(item)
-        return all_contents
-    else:
-        raise Exception(f"Failed to fetch repository contents: {response.status_code}")
+    commit_sha = resolve_ref(owner, repo, ref)
+    files = list_snapshot_files(owner, repo, commit_sha)
+    if path:
+        prefix = path.strip("/") + "/"
+        files = [file for file in files if file["path"].startswith(prefix)]
+    return files
 
 def filter_python_files(contents):
     """
@@ -38,8 +328,9 @@ def download_file_contents(download_url):
     """
     Download the raw content of a file from GitHub.
     """
-    headers = {"Authorization": f"token {GITHUB_ACCESS_TOKEN}"}
-    response = requests.get(download_url, headers=headers)
+    client = get_github_client()
+    with stage("download"):
+        response = client.get(download_url, headers=client.headers())
     if response.status_code == 200:
         return response.text
     else:
@@ -49,34 +340,68 @@ def make_github_request(url):
     """
     Make a GitHub API request with rate limit handling.
     """
-    headers = {"Authorization": f"token {GITHUB_ACCESS_TOKEN}"}
-    while True:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        elif response.status_code == 403 and "rate limit" in response.text:
-            reset_time = int(response.headers["X-RateLimit-Reset"])
-            sleep_time = max(reset_time - time.time(), 0) + 1  # Add 1 second buffer
-            print(f"Rate limit exceeded. Sleeping for {sleep_time} seconds.")
-            time.sleep(sleep_time)
-        else:
-            raise Exception(f"Failed to make request: {response.status_code}")
-        
-def fetch_and_process_repo(owner, repo):
-    """
-    Fetch and process all Python files in a repository.
-    """
-    print(f"Fetching repository contents for {owner}/{repo}...")
-    contents = fetch_repo_contents(owner, repo)
-    python_files = [file for file in contents if file["name"].endswith(".py")]
-    all_code = ""
-    for file in python_files:
+    client = get_github_client()
+    response = client.get(url, headers=client.headers())
+    if response.status_code == 200:
+        return response.json()
+    raise Exception(f"Failed to make request: {response.status_code}")
+
+def iter_snapshot_files(files, max_workers=None):
+    """
+    Yield (file, code, error) for `files` in order, downloading only blobs missing from the snapshot store.
+    At most a small window of files is held in memory at once; exactly one of code/error is None.
+    """
+    store = get_snapshot_store()
+    workers = max_workers or GITHUB_MAX_WORKERS
+
+    def load(file):
+        cached = store.has_blob(file["sha"])
+        record_cache_lookup("snapshot_blob", cached)
+        if cached:
+            return file, store.read_blob(file["sha"]), None
         try:
-            print(f"Processing file: {file['path']}")
             code = download_file_contents(file["download_url"])
-            print(f"Code from {file['path']}:\n{code}\n")  # Debug: Print the fetched code
-            all_code += f"# File: {file['path']}\n\n{code}\n\n"
         except Exception as e:
-            print(f"Failed to process {file['path']}: {str(e)}")
-    print("Repository processing complete.")
-    return all_code
\ No newline at end of file
+            return file, None, e
+        store.write_blob(file["sha"], code)
+        return file, code, None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for file in files:
+            # Run in a copy of the caller's context so download spans join the request's trace
+            pending.append(executor.submit(contextvars.copy_context().run, load, file))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def iter_repo_files(owner, repo, ref=None, max_workers=None, on_error=None, on_listed=None):
+    """
+    Yield (path, source) for every Python file in a repository, one file at a time.
+    Files that fail to download are skipped and passed to on_error(path, error);
+    on_listed(count) is called once the Python files have been listed.
+    """
+    logger.info("Fetching repository contents for %s/%s", owner, repo)
+    commit_sha = resolve_ref(owner, repo, ref)
+    python_files = filter_python_files(list_snapshot_files(owner, repo, commit_sha))
+    if on_listed is not None:
+        on_listed(len(python_files))
+    for file, code, error in iter_snapshot_files(python_files, max_workers):
+        if error is not None:
+            logger.warning("Failed to process %s: %s", file["path"], error)
+            if on_error is not None:
+                on_error(file["path"], error)
+            continue
+        yield file["path"], code
+    logger.info("Repository processing complete: %s/%s", owner, repo)
+
+def fetch_and_process_repo(owner, repo, ref=None, max_workers=None):
+    """
+    Fetch and process all Python files in a repository into one string.
+    Prefer `iter_repo_files`, which streams the files instead of holding them all in memory.
+    """
+    return "".join(
+        f"# File: {path}\n\n{code}\n\n"
+        for path, code in iter_repo_files(owner, repo, ref=ref, max_workers=max_workers)
+    )
@@ -0,0 +1,244 @@
+import os
+import json
+import hashlib
+import logging
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from .shared_storage import SharedState, process_alive
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Number of background jobs that run at once
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Seconds a finished job (and its artifacts) stays available
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "86400"))
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(".cache", "jobs"))
+
+
+class Job:
+    """
+    State of one background job, updated by the worker and read by the status endpoint.
+    Every update is also written to the job's directory, so worker processes that didn't
+    run the job can still report its status and serve its artifacts.
+    """
+
+    def __init__(self, key, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.phase = "queued"
+        self.files_total = None
+        self.files_processed = 0
+        self.symbols_processed = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.result = None
+        self.artifacts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        return os.path.join(JOBS_DIR, self.id)
+
+    def update(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+        self.save()
+
+    def add_artifact(self, name, content):
+        """
+        Save an artifact file for this job so it can be downloaded later.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.abspath(os.path.join(self.directory, name))
+        with open(path, "w") as f:
+            f.write(content)
+        with self._lock:
+            self.artifacts[name] = path
+        self.save()
+
+    def eta(self):
+        """
+        Estimate the seconds left from the file throughput so far, or None if unknown.
+        """
+        if self.status != "running" or not self.files_total or not self.files_processed or not self.started_at:
+            return None
+        elapsed = time.time() - self.started_at
+        remaining = max(self.files_total - self.files_processed, 0)
+        return round(elapsed / self.files_processed * remaining, 1)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "phase": self.phase,
+                "files_total": self.files_total,
+                "files_processed": self.files_processed,
+                "symbols_processed": self.symbols_processed,
+                "eta_seconds": self.eta(),
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "error": self.error,
+                "result": self.result,
+                "artifacts": sorted(self.artifacts)
+            }
+
+    def save(self):
+        """
+        Write the job's state to status.json in its directory (atomically, for concurrent readers).
+        """
+        with self._lock:
+            state = {name: getattr(self, name) for name in _SAVED_FIELDS}
+            state["artifacts"] = dict(self.artifacts)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "status.json")
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(state, f, default=str)
+            os.replace(temp_path, path)
+        except (OSError, TypeError) as e:
+            logger.warning("Could not save the status of job %s: %s", self.id, e)
+
+    @classmethod
+    def load(cls, job_id):
+        """
+        Read a job saved by any worker process, or return None if there is no such job.
+        """
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(JOBS_DIR, job_id, "status.json")) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job = cls(None, job_id=job_id)
+        for name, value in state.items():
+            setattr(job, name, value)
+        return job
+
+
+_SAVED_FIELDS = (
+    "status", "phase", "files_total", "files_processed", "symbols_processed",
+    "created_at", "started_at", "finished_at", "error", "result"
+)
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded worker pool. Submitting a key that is already queued or
+    running returns the existing job instead of starting a second run, whichever
+    worker process on the host started it: active keys are claimed in `state`
+    (the SharedState file by default). A claim whose process has died is ignored.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, retention=JOB_RETENTION, state=None):
+        self.retention = retention
+        self.state = state if state is not None else SharedState()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._active = {}  # key -> job id of queued or running jobs
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn):
+        """
+        Queue fn(job) under key. Returns (job, created).
+        """
+        with self._lock:
+            self._expire()
+            active_id = self._active.get(key)
+            if active_id is not None:
+                return self._jobs[active_id], False
+            job = Job(key)
+            # Saved before claiming, so a worker that finds the claim can always load the job
+            job.save()
+            other_id = self.state.update(_claim_key(key), lambda claim: self._claim(claim, job.id))
+            other = Job.load(other_id) if other_id is not None else None
+            if other is not None:
+                shutil.rmtree(job.directory, ignore_errors=True)
+                return other, False
+            self._jobs[job.id] = job
+            self._active[key] = job.id
+        self._executor.submit(self._run, job, fn)
+        return job, True
+
+    def _claim(self, claim, job_id):
+        """
+        Claim a job key for job_id unless a live process holds it with a queued or running job.
+        Returns (claim, id of the other job or None).
+        """
+        if claim and process_alive(claim["pid"]):
+            other = Job.load(claim["job_id"])
+            if other is not None and other.status in ("queued", "running"):
+                return claim, claim["job_id"]
+        return {"job_id": job_id, "pid": os.getpid()}, None
+
+    def _release(self, job):
+        self.state.update(_claim_key(job.key), lambda claim: (
+            None if claim and claim["job_id"] == job.id else claim, None
+        ))
+
+    def get(self, job_id):
+        """
+        Return a job of this process, or one started by another worker process.
+        Jobs from other processes are read from disk and expire after the same retention.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        job = Job.load(job_id)
+        if job is None or (job.finished_at is not None and job.finished_at < time.time() - self.retention):
+            return None
+        return job
+
+    def _run(self, job, fn):
+        job.update(status="running", phase="starting", started_at=time.time())
+        try:
+            result = fn(job)
+            job.update(status="succeeded", phase="done", result=result)
+        except Exception as e:
+            logger.exception("Job %s failed: %s", job.id, e)
+            job.update(status="failed", phase="failed", error=str(e))
+        finally:
+            job.update(finished_at=time.time())
+            with self._lock:
+                if self._active.get(job.key) == job.id:
+                    del self._active[job.key]
+            self._release(job)
+
+    def _expire(self):
+        cutoff = time.time() - self.retention
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del self._jobs[job_id]
+                shutil.rmtree(job.directory, ignore_errors=True)
+
+
+def _claim_key(key):
+    return "job:" + hashlib.sha256(json.dumps(key, default=str).encode("utf-8")).hexdigest()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_job_manager():
+    """
+    Return the process-wide job manager, creating it on first use.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from dotenv import load_dotenv
+from .metrics import record_cache_lookup
+
+load_dotenv()
+
+# Shared tier location: a SQLite file (shared by the worker processes of one host), a redis:// URL
+# (shared across hosts, needs the redis package), or an empty string to keep the cache in memory only
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm_cache.sqlite"))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "1024"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+LLM_CACHE_MAX_AGE = int(os.getenv("LLM_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+
+# Run disk eviction once every this many writes instead of on every insert
+EVICTION_INTERVAL = 100
+# Namespace of the cache's keys when the shared tier is Redis
+REDIS_PREFIX = "llm-cache:"
+
+
+def make_cache_key(model, prompt, max_tokens, temperature):
+    """
+    Hash the parameters that determine a completion into a cache key.
+    """
+    payload = json.dumps([model, prompt, max_tokens, temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache for LLM completions: an in-memory LRU in front of a SQLite table (or Redis).
+    Entries expire after max_age seconds, and the SQLite tier keeps at most max_entries rows;
+    Redis expires entries itself and relies on its maxmemory policy for size.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, memory_entries=LLM_CACHE_MEMORY_ENTRIES,
+                 max_entries=LLM_CACHE_MAX_ENTRIES, max_age=LLM_CACHE_MAX_AGE):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._redis = None
+        if self.path and self.path.startswith(("redis://", "rediss://")):
+            import redis
+            self._redis = redis.Redis.from_url(self.path)
+        elif self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                # Let worker processes read while another one writes
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS completions ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at)")
+            self._evict()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        """
+        Return the cached completion for key, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.max_age:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    record_cache_lookup("llm", True)
+                    return value
+                del self._memory[key]
+
+        if self._redis is not None:
+            data = self._redis.get(REDIS_PREFIX + key)
+            if data is not None:
+                value, created_at = json.loads(data)
+                with self._lock:
+                    self._remember(key, value, created_at)
+                    self.hits += 1
+                record_cache_lookup("llm", True)
+                return value
+        elif self.path:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute(
+                    "SELECT value, created_at FROM completions WHERE key = ? AND created_at >= ?",
+                    (key, now - self.max_age)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            if row is not None:
+                with self._lock:
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                record_cache_lookup("llm", True)
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        record_cache_lookup("llm", False)
+        return None
+
+    def set(self, key, value):
+        """
+        Store a completion in both tiers.
+        """
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._writes += 1
+            evict = self._writes % EVICTION_INTERVAL == 0
+        if self._redis is not None:
+            self._redis.set(REDIS_PREFIX + key, json.dumps([value, now]), ex=self.max_age)
+        elif self.path:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO completions (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+            if evict:
+                self._evict()
+
+    def get_or_create(self, payload, create, bypass=False):
+        """
+        Return the cached completion for a request payload, calling create() on a miss.
+
+        With bypass=True the lookup is skipped and the fresh completion replaces the cached one.
+        """
+        key = make_cache_key(payload["model"], payload["prompt"], payload["max_tokens"], payload["temperature"])
+        if not bypass:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+        value = create()
+        self.set(key, value)
+        return value
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        """
+        Drop expired rows, then the least recently used rows beyond max_entries.
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM completions WHERE created_at < ?", (time.time() - self.max_age,))
+            conn.execute(
+                "DELETE FROM completions WHERE key IN ("
+                "SELECT key FROM completions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        """
+        Remove every entry from both tiers and reset the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            self.hits = 0
+            self.misses = 0
+        if self._redis is not None:
+            for redis_key in self._redis.scan_iter(match=REDIS_PREFIX + "*"):
+                self._redis.delete(redis_key)
+        elif self.path:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("DELETE FROM completions")
+
+    def stats(self):
+        """
+        Return hit/miss counters and the current size of each tier.
+        """
+        with self._lock:
+            hits, misses, memory_size = self.hits, self.misses, len(self._memory)
+        disk_size = 0
+        if self._redis is not None:
+            disk_size = sum(1 for _ in self._redis.scan_iter(match=REDIS_PREFIX + "*"))
+        elif self.path:
+            with closing(self._connect()) as conn:
+                disk_size = conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": memory_size,
+            "disk_entries": disk_size
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """
+    Return the process-wide LLM cache, creating it on first use.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+def set_llm_cache(cache):
+    """
+    Replace the process-wide LLM cache (used by tests to point it at a temporary path).
+    """
+    global _cache
+    with _cache_lock:
+        _cache = cache
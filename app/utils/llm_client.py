@@ -0,0 +1,457 @@
+import os
+import json
+import logging
+import random
+import threading
+import time
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from .circuit_breaker import CLOSED, CircuitBreaker, CircuitOpenError
+from .llm_cache import get_llm_cache, make_cache_key
+from .llm_scheduler import INTERACTIVE, LLM_MAX_CONCURRENCY, get_llm_scheduler
+from .metrics import LLM_HEDGES, LLM_REQUESTS, LLM_TOKENS, record_stage, stage
+from .prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+# Point DEEPSEEK_API_BASE at a local stub server to run without the real API
+DEEPSEEK_API_BASE = os.getenv("DEEPSEEK_API_BASE", "https://api.deepseek.com/beta")
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+# Send a duplicate of a slow interactive request once it passes the recent p95 latency
+LLM_HEDGE_REQUESTS = os.getenv("LLM_HEDGE_REQUESTS", "0").lower() in ("1", "true", "yes")
+# Never hedge sooner than this many seconds, and keep at most this many duplicates in flight
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_MAX_IN_FLIGHT = int(os.getenv("LLM_HEDGE_MAX_IN_FLIGHT", "4"))
+# Size the connection pool to the DeepSeek requests the scheduler lets run at once, plus hedges
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", str(LLM_MAX_CONCURRENCY + LLM_HEDGE_MAX_IN_FLIGHT)))
+# Completed requests needed before the p95 is trusted enough to hedge on
+HEDGE_MIN_SAMPLES = 20
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """
+    Raised when a DeepSeek completion fails after all retries.
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UsageTracker:
+    """
+    Prompt and completion token counts of the DeepSeek calls made while tracking, per call type.
+    Counts come from the API's usage field, or are estimated when it is missing.
+    """
+
+    def __init__(self):
+        self.by_call_type = {}
+        self._lock = threading.Lock()
+
+    def record(self, call_type, prompt_tokens, completion_tokens, cached=False):
+        with self._lock:
+            entry = self.by_call_type.setdefault(
+                call_type, {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            )
+            entry["calls"] += 1
+            if cached:
+                entry["cached_calls"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+
+    def to_dict(self):
+        with self._lock:
+            by_call_type = {call_type: dict(entry) for call_type, entry in self.by_call_type.items()}
+        return {
+            "calls": sum(entry["calls"] for entry in by_call_type.values()),
+            "cached_calls": sum(entry["cached_calls"] for entry in by_call_type.values()),
+            "prompt_tokens": sum(entry["prompt_tokens"] for entry in by_call_type.values()),
+            "completion_tokens": sum(entry["completion_tokens"] for entry in by_call_type.values()),
+            "by_call_type": by_call_type
+        }
+
+
+_usage = ContextVar("llm_usage", default=None)
+_deadline = ContextVar("llm_deadline", default=None)
+
+@contextmanager
+def track_usage():
+    """
+    Collect token usage of every DeepSeek call made in this context.
+    Worker threads see the tracker when their task runs in a copy of the submitting context.
+    """
+    tracker = UsageTracker()
+    token = _usage.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _usage.reset(token)
+
+@contextmanager
+def deadline(seconds):
+    """
+    Stop the DeepSeek calls made in this context (and in threads that copy it) after `seconds`:
+    requests in flight time out at the deadline, and later calls raise LLMError instead of being sent.
+    Cached completions are still served.
+    """
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def _time_left():
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+def _record_usage(call_type, prompt, usage, completion_text, cached=False):
+    """
+    Count a finished call in the metrics and in the active usage tracker, if any.
+    """
+    tracker = _usage.get()
+    if cached:
+        LLM_REQUESTS.inc(call_type=call_type, outcome="cached")
+        if tracker is not None:
+            tracker.record(call_type, 0, 0, cached=True)
+        return
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens", estimate_tokens(prompt))
+    completion_tokens = usage.get("completion_tokens", estimate_tokens(completion_text) if completion_text else 0)
+    LLM_REQUESTS.inc(call_type=call_type, outcome="ok")
+    LLM_TOKENS.inc(prompt_tokens, call_type=call_type, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, call_type=call_type, kind="completion")
+    if tracker is not None:
+        tracker.record(call_type, prompt_tokens, completion_tokens)
+
+
+def _total_tokens(prompt, usage, completion_text):
+    """
+    Prompt plus completion tokens of a call, from the usage field or estimated.
+    """
+    usage = usage or {}
+    return (usage.get("prompt_tokens", estimate_tokens(prompt))
+            + usage.get("completion_tokens", estimate_tokens(completion_text) if completion_text else 0))
+
+
+class LLMClient:
+    """
+    DeepSeek completions client sharing one pooled keep-alive session across threads.
+    Retries 429/5xx responses and connection errors with jittered exponential backoff,
+    honoring Retry-After when the server sends it.
+
+    Every attempt goes through a circuit breaker, so calls fail fast while DeepSeek is
+    erroring or too slow. With hedging on, an interactive request still running after the
+    recent p95 latency gets a duplicate, and whichever answers first is used.
+    """
+
+    def __init__(self, api_key=DEEPSEEK_API_KEY, base_url=DEEPSEEK_API_BASE, model=DEEPSEEK_MODEL,
+                 pool_size=LLM_POOL_SIZE, connect_timeout=LLM_CONNECT_TIMEOUT, read_timeout=LLM_READ_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX,
+                 breaker=None, hedge=LLM_HEDGE_REQUESTS, hedge_min_delay=LLM_HEDGE_MIN_DELAY,
+                 hedge_max_in_flight=LLM_HEDGE_MAX_IN_FLIGHT):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_in_flight = hedge_max_in_flight
+        self.hedge_counts = {"sent": 0, "hedge_won": 0, "primary_won": 0}
+        self._hedges_in_flight = 0
+        self._hedge_pool = None
+        self._latencies = deque(maxlen=200)  # seconds taken by recent successful requests
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    @property
+    def completions_url(self):
+        return f"{self.base_url}/completions"
+
+    def complete(self, prompt, max_tokens=200, temperature=0.7, use_cache=True, call_type="completion",
+                 priority=INTERACTIVE):
+        """
+        Return the completion text for a prompt, serving repeated prompts from the LLM cache.
+        Token usage is recorded under call_type for the active track_usage() context.
+        Requests that reach DeepSeek wait for a scheduler slot in the given priority class.
+        """
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        fetched = {}
+
+        def create():
+            with get_llm_scheduler().slot(estimate_tokens(prompt) + max_tokens, priority) as grant:
+                fetched["text"], fetched["usage"] = self._post(payload, hedge=priority == INTERACTIVE)
+                grant.settle(_total_tokens(prompt, fetched["usage"], fetched["text"]))
+            return fetched["text"]
+
+        try:
+            text = get_llm_cache().get_or_create(payload, create, bypass=not use_cache)
+        except LLMError:
+            LLM_REQUESTS.inc(call_type=call_type, outcome="error")
+            raise
+        _record_usage(call_type, prompt, fetched.get("usage"), text, cached="text" not in fetched)
+        return text
+
+    def stream(self, prompt, max_tokens=200, temperature=0.7, use_cache=True, call_type="completion",
+               priority=INTERACTIVE):
+        """
+        Yield completion text fragments as DeepSeek streams them.
+
+        A cached completion is yielded in one piece. Closing the generator (for example
+        when the HTTP client disconnects) closes the upstream connection and stops generation.
+        The stream holds a scheduler slot in the given priority class until it ends.
+        """
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        cache = get_llm_cache()
+        key = make_cache_key(payload["model"], payload["prompt"], payload["max_tokens"], payload["temperature"])
+        if use_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                _record_usage(call_type, prompt, None, cached, cached=True)
+                yield cached
+                return
+
+        with get_llm_scheduler().slot(estimate_tokens(prompt) + max_tokens, priority) as grant:
+            start = time.perf_counter()
+            try:
+                response = self._send(dict(payload, stream=True), stream=True)
+            except LLMError:
+                LLM_REQUESTS.inc(call_type=call_type, outcome="error")
+                raise
+            fragments = []
+            usage = None
+            completed = False
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        completed = True
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    if not chunk.get("choices"):
+                        continue
+                    text = chunk["choices"][0].get("text") or ""
+                    if text:
+                        # Drop the leading whitespace the non-streaming path strips
+                        if not fragments:
+                            text = text.lstrip()
+                            if not text:
+                                continue
+                        fragments.append(text)
+                        yield text
+            finally:
+                response.close()
+                record_stage("llm", time.perf_counter() - start)
+                _record_usage(call_type, prompt, usage, "".join(fragments))
+                grant.settle(_total_tokens(prompt, usage, "".join(fragments)))
+            # Only cache streams that ran to completion
+            if completed:
+                cache.set(key, "".join(fragments).strip())
+
+    def _post(self, payload, hedge=False):
+        """
+        Return (text, usage) for a non-streaming completion request, hedging it if asked and enabled.
+        """
+        with stage("llm"):
+            response = self._hedged_send(payload) if hedge and self.hedge else self._send(payload)
+            data = response.json()
+        return data["choices"][0]["text"].strip(), data.get("usage")
+
+    def stats(self):
+        """
+        Report the circuit breaker state and how often hedged requests won.
+        """
+        with self._lock:
+            counts = dict(self.hedge_counts)
+        delay = self._hedge_delay()
+        return {
+            "circuit": self.breaker.stats(),
+            "hedging": dict(
+                counts, enabled=self.hedge,
+                delay_seconds=round(delay, 3) if delay is not None else None,
+                win_rate=round(counts["hedge_won"] / counts["sent"], 3) if counts["sent"] else None
+            )
+        }
+
+    def _hedge_delay(self):
+        """
+        Seconds after which a request gets a duplicate: the p95 of recent latencies, or None until enough are known.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(latencies[int(len(latencies) * 0.95) - 1], self.hedge_min_delay)
+
+    def _hedged_send(self, payload):
+        """
+        Send a request, and a duplicate if it is still running after the hedge delay; return the first 200 response.
+        Duplicates aren't sent while the circuit isn't closed or too many are already in flight.
+        """
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._send(payload)
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+        primary = self._hedge_pool.submit(contextvars.copy_context().run, self._send, payload)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        with self._lock:
+            allowed = self._hedges_in_flight < self.hedge_max_in_flight and self.breaker.state == CLOSED
+            if allowed:
+                self._hedges_in_flight += 1
+                self.hedge_counts["sent"] += 1
+        if not allowed:
+            return primary.result()
+        LLM_HEDGES.inc(outcome="sent")
+        hedge = self._hedge_pool.submit(contextvars.copy_context().run, self._send, payload)
+        hedge.add_done_callback(self._hedge_finished)
+        error = None
+        for future in as_completed([primary, hedge]):
+            try:
+                response = future.result()
+            except LLMError as e:
+                error = e
+                continue
+            outcome = "hedge_won" if future is hedge else "primary_won"
+            with self._lock:
+                self.hedge_counts[outcome] += 1
+            LLM_HEDGES.inc(outcome=outcome)
+            # Release the slower request's connection whenever it finishes
+            (primary if future is hedge else hedge).add_done_callback(_close_response)
+            return response
+        raise error
+
+    def _hedge_finished(self, future):
+        with self._lock:
+            self._hedges_in_flight -= 1
+
+    def _send(self, payload, stream=False):
+        """
+        POST a completion request, retrying retryable failures; returns the 200 response.
+        """
+        attempt = 0
+        while True:
+            left = _time_left()
+            if left is not None and left <= 0:
+                raise LLMError("DeepSeek request failed: deadline exceeded", 504)
+            timeout = self.timeout if left is None else tuple(min(part, left) for part in self.timeout)
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError as e:
+                raise LLMError(f"DeepSeek request failed: {str(e)}", 503) from e
+            response = None
+            sent = time.monotonic()
+            try:
+                response = self.session.post(self.completions_url, json=payload, timeout=timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.breaker.record(False, time.monotonic() - sent)
+                if attempt >= self.max_retries:
+                    raise LLMError(f"DeepSeek request failed: {str(e)}") from e
+            except Exception:
+                self.breaker.record(False, time.monotonic() - sent)
+                raise
+            else:
+                duration = time.monotonic() - sent
+                # Client errors (400, 401...) say nothing about DeepSeek's health
+                self.breaker.record(response.status_code not in RETRYABLE_STATUS_CODES, duration)
+                if response.status_code == 200:
+                    if not stream:
+                        with self._lock:
+                            self._latencies.append(duration)
+                    return response
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                    logger.warning("DeepSeek request failed: %s %s", response.status_code, response.text[:500])
+                    raise LLMError(f"DeepSeek request failed: {response.status_code}", response.status_code)
+                response.close()
+            delay = self._retry_delay(attempt, response)
+            left = _time_left()
+            if left is not None and delay >= left:
+                # The retry couldn't be sent before the deadline, so give up now rather than sleep past it
+                raise LLMError("DeepSeek request failed: deadline exceeded", 504)
+            time.sleep(delay)
+            attempt += 1
+
+    def _retry_delay(self, attempt, response=None):
+        """
+        Use the server's Retry-After when present, otherwise full-jitter exponential backoff.
+        """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return max(float(retry_after), 0)
+            except ValueError:
+                try:
+                    return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_llm_client():
+    """
+    Return the process-wide DeepSeek client, creating it on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient()
+        return _client
+
+def set_llm_client(client):
+    """
+    Replace the process-wide DeepSeek client (used by tests to target a stub server).
+    """
+    global _client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from .metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT
+
+load_dotenv()
+
+# DeepSeek requests in flight at once across the whole process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Slots only interactive calls may use, so bulk work can never take every slot
+LLM_INTERACTIVE_RESERVED = int(os.getenv("LLM_INTERACTIVE_RESERVED", "2"))
+# Prompt plus completion tokens sent per rolling minute; 0 means no limit
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+
+# Priority classes, highest first
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+_caller = ContextVar("llm_caller", default="anonymous")
+
+def set_caller(name):
+    """
+    Name the client that LLM calls made from the current context are scheduled for.
+    """
+    _caller.set(name or "anonymous")
+
+@contextmanager
+def caller(name):
+    """
+    Schedule the LLM calls made inside the block for client `name`.
+    """
+    token = _caller.set(name or "anonymous")
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+class Grant:
+    """
+    A granted scheduler slot. Call `settle` with the tokens actually used to correct the
+    estimate that was counted against the tokens-per-minute budget.
+    """
+
+    __slots__ = ("priority", "client", "tokens", "enqueued_at", "granted", "_scheduler", "_spent")
+
+    def __init__(self, scheduler, priority, client, tokens):
+        self.priority = priority
+        self.client = client
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self._scheduler = scheduler
+        self._spent = None  # [time, tokens] entry in the scheduler's budget window
+
+    def settle(self, tokens):
+        self._scheduler._settle(self, tokens)
+
+
+class LLMScheduler:
+    """
+    Process-wide admission control for DeepSeek calls.
+
+    Calls wait for a slot under a global concurrency limit and a rolling tokens-per-minute
+    budget. Waiting interactive calls always go before bulk ones, and `reserved_interactive`
+    slots are kept free of bulk calls so a large documentation run can't hold every slot.
+    Within a priority class, clients take turns (round robin), so one client's queue of
+    calls doesn't delay everyone else's.
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 reserved_interactive=LLM_INTERACTIVE_RESERVED):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.tokens_per_minute = tokens_per_minute
+        self.reserved_interactive = min(max(reserved_interactive, 0), self.max_concurrency - 1)
+        self.in_flight = 0
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}  # client -> deque of grants
+        self._spent = deque()  # [time, tokens] of the calls admitted in the last minute
+        self._spent_tokens = 0
+        self._waits = {priority: {"calls": 0, "total": 0.0, "max": 0.0} for priority in PRIORITIES}
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self, tokens, priority=INTERACTIVE, client=None):
+        """
+        Block until a call estimated at `tokens` may run, and hold its slot for the block.
+        `client` defaults to the caller set for the current context.
+        """
+        if priority not in self._queues:
+            raise ValueError(f"Unknown LLM priority: {priority}")
+        grant = self._acquire(Grant(self, priority, client or _caller.get(), tokens))
+        try:
+            yield grant
+        finally:
+            self._release()
+
+    def stats(self):
+        """
+        Report slots in use, queue depth per priority, tokens spent in the last minute and wait times.
+        """
+        with self._condition:
+            self._expire_spent(time.monotonic())
+            return {
+                "max_concurrency": self.max_concurrency,
+                "reserved_interactive": self.reserved_interactive,
+                "tokens_per_minute": self.tokens_per_minute,
+                "in_flight": self.in_flight,
+                "tokens_last_minute": self._spent_tokens,
+                "queued": {priority: self._depth(priority) for priority in PRIORITIES},
+                "waits": {
+                    priority: {
+                        "calls": waits["calls"],
+                        "mean_seconds": round(waits["total"] / waits["calls"], 4) if waits["calls"] else 0.0,
+                        "max_seconds": round(waits["max"], 4)
+                    }
+                    for priority, waits in self._waits.items()
+                }
+            }
+
+    def _acquire(self, grant):
+        with self._condition:
+            self._queues[grant.priority].setdefault(grant.client, deque()).append(grant)
+            LLM_QUEUE_DEPTH.set(self._depth(grant.priority), priority=grant.priority)
+            try:
+                while not grant.granted:
+                    timeout = self._dispatch()
+                    if not grant.granted:
+                        self._condition.wait(timeout)
+            except BaseException:
+                if grant.granted:
+                    self._release_locked()
+                else:
+                    self._remove(grant)
+                raise
+            wait = time.monotonic() - grant.enqueued_at
+            waits = self._waits[grant.priority]
+            waits["calls"] += 1
+            waits["total"] += wait
+            waits["max"] = max(waits["max"], wait)
+        LLM_QUEUE_WAIT.observe(wait, priority=grant.priority)
+        return grant
+
+    def _release(self):
+        with self._condition:
+            self._release_locked()
+
+    def _release_locked(self):
+        self.in_flight -= 1
+        self._dispatch()
+        self._condition.notify_all()
+
+    def _dispatch(self):
+        """
+        Grant waiting calls in priority and round-robin order while there is capacity.
+        Returns how long to wait for the token budget to free up, or None to wait for a release.
+        """
+        while True:
+            grant = self._next()
+            if grant is None:
+                return None
+            limit = self.max_concurrency if grant.priority == INTERACTIVE else self.max_concurrency - self.reserved_interactive
+            if self.in_flight >= limit:
+                return None
+            delay = self._budget_delay(grant.tokens)
+            if delay:
+                return delay
+            self._pop(grant)
+            grant.granted = True
+            grant._spent = [time.monotonic(), grant.tokens]
+            self._spent.append(grant._spent)
+            self._spent_tokens += grant.tokens
+            self.in_flight += 1
+            self._condition.notify_all()
+
+    def _next(self):
+        """
+        Return the next call in line: the first client's oldest call in the highest non-empty priority class.
+        """
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            if queue:
+                return next(iter(queue.values()))[0]
+        return None
+
+    def _pop(self, grant):
+        queue = self._queues[grant.priority]
+        calls = queue.pop(grant.client)
+        calls.popleft()
+        if calls:
+            # The client goes to the back of the line for its next call
+            queue[grant.client] = calls
+        LLM_QUEUE_DEPTH.set(self._depth(grant.priority), priority=grant.priority)
+
+    def _remove(self, grant):
+        queue = self._queues[grant.priority]
+        calls = queue.get(grant.client)
+        if calls and grant in calls:
+            calls.remove(grant)
+            if not calls:
+                del queue[grant.client]
+        LLM_QUEUE_DEPTH.set(self._depth(grant.priority), priority=grant.priority)
+        self._condition.notify_all()
+
+    def _depth(self, priority):
+        return sum(len(calls) for calls in self._queues[priority].values())
+
+    def _budget_delay(self, tokens):
+        """
+        Seconds until `tokens` more fit in the rolling minute, or 0 if they fit now.
+        A call larger than the whole budget runs once nothing else was spent in the window.
+        """
+        if not self.tokens_per_minute:
+            return 0
+        now = time.monotonic()
+        self._expire_spent(now)
+        if not self._spent or self._spent_tokens + tokens <= self.tokens_per_minute:
+            return 0
+        return max(self._spent[0][0] + 60 - now, 0.01)
+
+    def _expire_spent(self, now):
+        while self._spent and self._spent[0][0] <= now - 60:
+            self._spent_tokens -= self._spent.popleft()[1]
+
+    def _settle(self, grant, tokens):
+        with self._condition:
+            entry = grant._spent
+            if entry is None:
+                return
+            if any(spent is entry for spent in self._spent):
+                self._spent_tokens += tokens - entry[1]
+            entry[1] = tokens
+            self._dispatch()
+            self._condition.notify_all()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_llm_scheduler():
+    """
+    Return the process-wide LLM scheduler, creating it on first use.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
+
+def set_llm_scheduler(scheduler):
+    """
+    Replace the process-wide LLM scheduler (used by tests to shrink its limits).
+    """
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
@@ -0,0 +1,311 @@
+import logging
+import multiprocessing
+import os
+import posixpath
+import re
+import tarfile
+import zipfile
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from .code_parser import SYMBOL_INDEX_CACHE_SIZE, cache_symbol_index, index_source
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Worker processes that parse local files; 0 starts one per CPU core
+LOCAL_PARSE_WORKERS = int(os.getenv("LOCAL_PARSE_WORKERS", "0")) or os.cpu_count() or 1
+# Sources with fewer files than this are parsed in the current process, where a pool costs more than it saves
+LOCAL_PARSE_MIN_FILES = int(os.getenv("LOCAL_PARSE_MIN_FILES", "32"))
+# Larger files (usually generated or vendored code) are skipped
+LOCAL_MAX_FILE_BYTES = int(os.getenv("LOCAL_MAX_FILE_BYTES", str(1024 * 1024)))
+
+DEFAULT_INCLUDE = ("*.py",)
+# Files sent to a worker process per task
+PARSE_BATCH_SIZE = 8
+
+
+def _glob_regex(pattern):
+    """
+    Translate a .gitignore-style glob (without its leading "!", leading "/" or trailing "/") to a regex.
+    """
+    regex, i = [], 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            regex.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            regex.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            regex.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1:end]
+            regex.append("[" + ("^" + body[1:] if body[0] in "!^" else body).replace("\\", "\\\\") + "]")
+            i = end + 1
+        else:
+            regex.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile("".join(regex))
+
+
+class _Rule:
+    """
+    One .gitignore-style pattern, applying to paths under `base` (a posix path, "" for the top).
+    """
+    __slots__ = ("regex", "negate", "directory_only", "base")
+
+    def __init__(self, pattern, base=""):
+        self.negate = pattern.startswith("!")
+        pattern = pattern[1:] if self.negate else pattern
+        self.directory_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        # A pattern with a slash is relative to its base; one without matches a name at any depth
+        anchored = "/" in pattern
+        self.regex = _glob_regex(pattern.lstrip("/") if anchored else "**/" + pattern)
+        self.base = base
+
+    def matches(self, path, is_dir):
+        if self.directory_only and not is_dir:
+            return False
+        if self.base:
+            if not path.startswith(self.base + "/"):
+                return False
+            path = path[len(self.base) + 1:]
+        return self.regex.fullmatch(path) is not None
+
+
+def _last_match(rules, path, is_dir):
+    """
+    Whether the last rule matching the path excludes it (a "!" rule matching last re-includes it).
+    """
+    excluded = False
+    for rule in rules:
+        if rule.matches(path, is_dir):
+            excluded = not rule.negate
+    return excluded
+
+
+class PathFilter:
+    """
+    Decides which files of a local source are ingested: a file must match an include glob,
+    and neither the file nor a folder above it may match an exclude glob or a .gitignore rule.
+
+    Globs use .gitignore syntax: a pattern without a slash matches a name at any depth, `**`
+    matches any number of folders, a trailing slash matches folders only, and "!" re-includes.
+    .git folders are always skipped.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = [_Rule(pattern) for pattern in include or DEFAULT_INCLUDE]
+        self.exclude = [_Rule(pattern) for pattern in exclude or ()] + [_Rule(".git/")]
+        self.ignore = []
+
+    def add_gitignore(self, folder, text):
+        """
+        Add the rules of the .gitignore file found in `folder` (a posix path relative to the top, "" for the top).
+        """
+        for line in text.splitlines():
+            line = line.rstrip()
+            if line and not line.startswith("#"):
+                self.ignore.append(_Rule(line.replace("\\#", "#").replace("\\!", "!"), folder))
+
+    def skips_folder(self, path):
+        return _last_match(self.exclude, path, True) or _last_match(self.ignore, path, True)
+
+    def accepts(self, path, check_folders=True):
+        """
+        Whether a file is ingested. Pass check_folders=False when its folders were already checked.
+        """
+        if check_folders:
+            parts = path.split("/")[:-1]
+            if any(self.skips_folder("/".join(parts[:depth])) for depth in range(1, len(parts) + 1)):
+                return False
+        if not any(rule.matches(path, False) for rule in self.include):
+            return False
+        return not (_last_match(self.exclude, path, False) or _last_match(self.ignore, path, False))
+
+
+def _list_directory(directory, path_filter):
+    """
+    Yield (path, size, filename, read) for the accepted files under a directory, in path order.
+    Skipped folders are not walked at all.
+    """
+    for root, folders, files in os.walk(directory):
+        folder = os.path.relpath(root, directory).replace(os.sep, "/")
+        folder = "" if folder == "." else folder
+        if ".gitignore" in files:
+            with open(os.path.join(root, ".gitignore"), "r", encoding="utf-8", errors="replace") as f:
+                path_filter.add_gitignore(folder, f.read())
+        folders[:] = sorted(name for name in folders if not path_filter.skips_folder(posixpath.join(folder, name)))
+        for name in sorted(files):
+            path = posixpath.join(folder, name)
+            if path_filter.accepts(path, check_folders=False):
+                filename = os.path.join(root, name)
+                yield path, os.path.getsize(filename), filename, None
+
+
+def _member_name(name):
+    return name[2:] if name.startswith("./") else name
+
+
+def _strip_top_folder(names):
+    """
+    Return the prefix to drop from archive member names: the single top-level folder that
+    holds every member (as in GitHub tarballs), or "".
+    """
+    tops = {name.split("/", 1)[0] for name in names}
+    if len(tops) == 1 and all("/" in name for name in names):
+        return tops.pop() + "/"
+    return ""
+
+
+def _list_members(members, path_filter, size_of, read):
+    """
+    Yield (path, size, None, read) for the accepted members of an open archive.
+    Members are only read when `read()` is called, and never extracted to disk.
+    """
+    prefix = _strip_top_folder(list(members))
+    paths = {name[len(prefix):]: member for name, member in members.items()}
+    # Every .gitignore has to be known before any file is checked; shallow ones first
+    for path in sorted((path for path in paths if posixpath.basename(path) == ".gitignore"), key=lambda path: path.count("/")):
+        path_filter.add_gitignore(posixpath.dirname(path), read(paths[path]).decode("utf-8", errors="replace"))
+    # Archive order, so a compressed tarball is read front to back once
+    for path, member in paths.items():
+        if path_filter.accepts(path):
+            yield path, size_of(member), None, lambda member=member: read(member)
+
+
+@contextmanager
+def open_local_source(source, include=None, exclude=None):
+    """
+    List the files of a local directory, tar (optionally compressed) or zip archive that pass
+    the include/exclude globs and .gitignore rules. Yields (path, size, filename, read) tuples:
+    paths are relative posix paths, and a file is read either from `filename` (directories) or
+    by calling `read()` (archives, which stay open until the block ends).
+    An archive whose members all sit in one top-level folder has that folder stripped.
+    """
+    path_filter = PathFilter(include, exclude)
+    if os.path.isdir(source):
+        yield list(_list_directory(source, path_filter))
+    elif os.path.isfile(source) and zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as bundle:
+            members = {_member_name(info.filename): info for info in bundle.infolist() if not info.is_dir()}
+            yield list(_list_members(members, path_filter, lambda info: info.file_size, bundle.read))
+    elif os.path.isfile(source) and tarfile.is_tarfile(source):
+        with tarfile.open(source) as bundle:
+            members = {_member_name(member.name): member for member in bundle.getmembers() if member.isfile()}
+            yield list(_list_members(
+                members, path_filter, lambda member: member.size, lambda member: bundle.extractfile(member).read()
+            ))
+    else:
+        raise Exception(f"Not a directory or a tar/zip archive: {source}")
+
+
+def _parse_file(path, filename, data, error=None):
+    """
+    Read (unless `data` is given) and parse one file. Returns (path, code, index, error):
+    code is None if the file was rejected upfront (`error`) or couldn't be read, and index is
+    None if it couldn't be parsed. Runs in worker processes.
+    """
+    if error is not None:
+        return path, None, None, error
+    try:
+        if data is None:
+            with open(filename, "rb") as f:
+                data = f.read()
+    except OSError as e:
+        return path, None, None, f"{type(e).__name__}: {str(e)}"
+    code = data.decode("utf-8", errors="replace")
+    try:
+        return path, code, index_source(code), None
+    except (SyntaxError, ValueError) as e:
+        return path, code, None, f"{type(e).__name__}: {str(e)}"
+
+
+def _parse_batch(tasks):
+    return [_parse_file(*task) for task in tasks]
+
+
+def _pool_context():
+    # Forking a threaded web server can copy locks held by other threads; start clean workers instead
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def iter_local_indexes(source, include=None, exclude=None, max_workers=None, on_listed=None):
+    """
+    Yield (path, code, index, error) for every accepted file of a local directory or archive, in order.
+
+    Files are read whole and parsed into per-file symbol indexes on a process pool, so the
+    parse uses every core. Directory files are read by the workers themselves; archive
+    members are read here and sent along. Only a bounded window of files is parsed ahead of
+    the consumer. Files over LOCAL_MAX_FILE_BYTES or that can't be read get code None and an error.
+    on_listed(count) is called once the files have been listed.
+    """
+    with open_local_source(source, include, exclude) as entries:
+        if on_listed is not None:
+            on_listed(len(entries))
+        yield from _parse_entries(entries, max_workers or LOCAL_PARSE_WORKERS)
+
+
+def _parse_entries(entries, workers):
+    """
+    Parse listed files in order: in this process for small sources, on a process pool otherwise.
+    """
+    def task(entry):
+        path, size, filename, read = entry
+        if size > LOCAL_MAX_FILE_BYTES:
+            return path, filename, None, f"File is larger than {LOCAL_MAX_FILE_BYTES} bytes"
+        return path, filename, read() if read else None
+
+    if workers <= 1 or len(entries) < LOCAL_PARSE_MIN_FILES:
+        for entry in entries:
+            yield _parse_file(*task(entry))
+        return
+
+    # Stay well inside the symbol index cache, so files are still cached when the consumer reaches them
+    ahead_limit = max(SYMBOL_INDEX_CACHE_SIZE // 2, workers)
+    batch_size = max(1, min(PARSE_BATCH_SIZE, ahead_limit // (workers * 2)))
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context())
+    try:
+        pending = deque()
+        ahead = 0
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            pending.append(executor.submit(_parse_batch, [task(entry) for entry in batch]))
+            ahead += len(batch)
+            while ahead > ahead_limit:
+                results = pending.popleft().result()
+                ahead -= len(results)
+                yield from results
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_local_files(source, include=None, exclude=None, max_workers=None, on_error=None, on_listed=None):
+    """
+    Yield (path, source) for every accepted file of a local directory or archive, one file at a time.
+    The symbol indexes parsed by the worker processes are added to the parse cache, so documenting
+    the files doesn't parse them again. Files that can't be read are skipped and passed to
+    on_error(path, error); files that don't parse are still yielded.
+    """
+    logger.info("Reading local source %s", source)
+    for path, code, index, error in iter_local_indexes(source, include, exclude, max_workers, on_listed):
+        if code is None:
+            logger.warning("Skipping %s: %s", path, error)
+            if on_error is not None:
+                on_error(path, error)
+            continue
+        if index is not None:
+            cache_symbol_index(index)
+        yield path, code
@@ -0,0 +1,342 @@
+import copy
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from .shared_storage import SharedState, process_alive
+
+load_dotenv()
+
+# Record trace spans for every request, not only those sending an X-Trace header
+TRACE_REQUESTS = os.getenv("TRACE_REQUESTS", "0").lower() in ("1", "true", "yes")
+# Seconds between saves of this worker process's metrics to the shared state /metrics reads
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", "5"))
+
+# Shared state key of every worker's metric values, by pid ("retired" holds the totals of exited workers)
+WORKERS_KEY = "metrics:workers"
+
+# Histogram buckets in seconds, from cache hits to whole-repository runs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class _Metric:
+    """
+    Base of the in-process metric types: a name, help text and a value per label combination.
+    """
+    type = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def copy_values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def with_values(self, values):
+        """
+        Return a copy of the metric holding `values` (label values -> value) instead of its own.
+        """
+        clone = copy.copy(self)
+        clone._values = dict(values)
+        clone._lock = threading.Lock()
+        return clone
+
+    def combine(self, first, second):
+        """
+        Combine the values of one label combination from two worker processes.
+        """
+        return first + second
+
+    def samples(self):
+        """
+        Return (suffix, label names, label values, value) tuples for the exposition format.
+        """
+        with self._lock:
+            return [("", self.label_names, key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_label_text(names, values)} {value:g}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down. `aggregate` ("sum", "max" or "min") combines the values of
+    the worker processes; gauges of exited workers are dropped.
+    """
+    type = "gauge"
+
+    def __init__(self, name, help_text, labels=(), aggregate="sum"):
+        super().__init__(name, help_text, labels)
+        self.aggregate = aggregate
+
+    def combine(self, first, second):
+        return {"sum": first + second, "max": max(first, second), "min": min(first, second)}[self.aggregate]
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][position] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def copy_values(self):
+        with self._lock:
+            return {key: {"buckets": list(entry["buckets"]), "sum": entry["sum"], "count": entry["count"]}
+                    for key, entry in self._values.items()}
+
+    def combine(self, first, second):
+        return {
+            "buckets": [a + b for a, b in zip(first["buckets"], second["buckets"])],
+            "sum": first["sum"] + second["sum"],
+            "count": first["count"] + second["count"]
+        }
+
+    def samples(self):
+        values = self.copy_values()
+        samples = []
+        names = self.label_names + ("le",)
+        for key, entry in sorted(values.items()):
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                samples.append(("_bucket", names, key + (f"{bound:g}",), count))
+            samples.append(("_bucket", names, key + ("+Inf",), entry["count"]))
+            samples.append(("_sum", self.label_names, key, entry["sum"]))
+            samples.append(("_count", self.label_names, key, entry["count"]))
+        return samples
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests by route.", ("route", "method", "status")
+)
+STAGE_DURATION = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Time spent in each pipeline stage (github_list, download, parse, llm, render, save).", ("stage",)
+)
+LLM_REQUESTS = Counter(
+    "llm_requests_total", "DeepSeek completions by call type and outcome (ok, cached or error).", ("call_type", "outcome")
+)
+LLM_TOKENS = Counter("llm_tokens_total", "DeepSeek tokens by call type and kind (prompt or completion).", ("call_type", "kind"))
+GITHUB_RATE_LIMIT_REMAINING = Gauge(
+    "github_rate_limit_remaining", "Requests left in the current GitHub rate-limit window.", ("resource",), aggregate="min"
+)
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result (hit or miss).", ("cache", "result"))
+LLM_QUEUE_DEPTH = Gauge("llm_queue_depth", "DeepSeek calls waiting for a scheduler slot by priority.", ("priority",))
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds", "Time DeepSeek calls waited for a scheduler slot by priority.", ("priority",)
+)
+LLM_CIRCUIT_STATE = Gauge(
+    "llm_circuit_state", "DeepSeek circuit breaker state (0 closed, 1 half-open, 2 open) of the worst worker.", aggregate="max"
+)
+LLM_CIRCUIT_REJECTIONS = Counter("llm_circuit_rejections_total", "DeepSeek calls failed fast by the open circuit.")
+LLM_HEDGES = Counter(
+    "llm_hedged_requests_total", "Hedged DeepSeek requests by outcome (sent, hedge_won or primary_won).", ("outcome",)
+)
+ROUTE_COALESCED = Counter(
+    "route_requests_coalesced_total", "Route requests that shared the response of an identical request in flight."
+)
+
+REGISTRY = [
+    REQUEST_DURATION, STAGE_DURATION, LLM_REQUESTS, LLM_TOKENS, GITHUB_RATE_LIMIT_REMAINING, CACHE_LOOKUPS,
+    LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_CIRCUIT_STATE, LLM_CIRCUIT_REJECTIONS, LLM_HEDGES, ROUTE_COALESCED
+]
+
+
+def record_cache_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+def record_github_rate_limit(response):
+    """
+    Update the rate-limit gauge from a GitHub response's X-RateLimit headers, if present.
+    """
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    if remaining is not None:
+        try:
+            GITHUB_RATE_LIMIT_REMAINING.set(int(remaining), resource=response.headers.get("X-RateLimit-Resource", "core"))
+        except ValueError:
+            pass
+
+def render_metrics():
+    """
+    Render every metric, plus a hit-ratio gauge per cache, in the Prometheus text format.
+    Values are totals over the worker processes sharing the metrics state (see publish_metrics).
+    """
+    merged = _merge(publish_metrics(force=True).values())
+    metrics = [metric.with_values(merged.get(metric.name, {})) for metric in REGISTRY]
+    sections = [metric.render() for metric in metrics]
+    ratios = Gauge("cache_hit_ratio", "Share of cache lookups that were hits.", ("cache",))
+    lookups = {}
+    for _, _, (cache, result), value in metrics[REGISTRY.index(CACHE_LOOKUPS)].samples():
+        lookups.setdefault(cache, {"hit": 0, "miss": 0})[result] = value
+    for cache, counts in lookups.items():
+        total = counts["hit"] + counts["miss"]
+        ratios.set(counts["hit"] / total if total else 0.0, cache=cache)
+    sections.append(ratios.render())
+    return "\n".join(sections) + "\n"
+
+def publish_metrics(force=False):
+    """
+    Save this worker process's metric values to the metrics state, at most once per
+    METRICS_PUBLISH_INTERVAL unless forced. The totals of exited workers are kept under
+    "retired". Returns every worker's values, or None when it was too soon to publish.
+    """
+    now = time.monotonic()
+    with _publish_lock:
+        if not force and now - _published["at"] < METRICS_PUBLISH_INTERVAL:
+            return None
+        _published["at"] = now
+    snapshot = {metric.name: [[list(key), value] for key, value in metric.copy_values().items()] for metric in REGISTRY}
+    pid = str(os.getpid())
+
+    def publish(workers):
+        workers = dict(workers or {})
+        workers[pid] = snapshot
+        for other in [other for other in workers if other not in ("retired", pid)]:
+            if not process_alive(int(other)):
+                # Counts of an exited worker stay in the totals; its gauges no longer apply
+                retired = _merge([workers.get("retired") or {}, workers.pop(other)], kinds=("counter", "histogram"))
+                workers["retired"] = {name: [[list(key), value] for key, value in values.items()] for name, values in retired.items()}
+        return workers, workers
+
+    return get_metrics_state().update(WORKERS_KEY, publish)
+
+def _merge(snapshots, kinds=None):
+    """
+    Combine worker snapshots ({metric name: [[label values, value], ...]}) into
+    {metric name: {label values: value}}, optionally only for metrics of the given kinds.
+    """
+    metrics = {metric.name: metric for metric in REGISTRY}
+    merged = {}
+    for snapshot in snapshots:
+        for name, entries in snapshot.items():
+            metric = metrics.get(name)
+            if metric is None or (kinds and metric.type not in kinds):
+                continue
+            values = merged.setdefault(name, {})
+            for labels, value in entries:
+                key = tuple(labels)
+                values[key] = metric.combine(values[key], value) if key in values else value
+    return merged
+
+
+_published = {"at": float("-inf")}
+_publish_lock = threading.Lock()
+_state = None
+_state_lock = threading.Lock()
+
+def get_metrics_state():
+    """
+    Return the shared state the worker processes publish their metrics to, creating it on first use.
+    """
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = SharedState()
+        return _state
+
+def set_metrics_state(state):
+    """
+    Replace the metrics state (used by tests to keep it in memory).
+    """
+    global _state
+    with _state_lock:
+        _state = state
+
+
+_trace = ContextVar("trace_spans", default=None)
+
+def start_trace():
+    """
+    Start collecting spans for the current request; returns the span list.
+    Worker threads add to it when their task runs in a copy of the caller's context.
+    """
+    spans = []
+    _trace.set(spans)
+    return spans
+
+def stop_trace():
+    """
+    Stop collecting spans in the current context (requests share threads, so reset per request).
+    """
+    _trace.set(None)
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage into the stage histogram and, when tracing, the request's spans.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+def record_stage(name, duration):
+    """
+    Record a stage timing measured by the caller (for work that doesn't fit in a with block).
+    """
+    STAGE_DURATION.observe(duration, stage=name)
+    # Background jobs record stages without requests, so they publish here too
+    publish_metrics()
+    spans = _trace.get()
+    if spans is not None:
+        spans.append({"stage": name, "duration_ms": round(duration * 1000, 2), "thread": threading.current_thread().name})
+
+def server_timing(spans):
+    """
+    Summarize spans as a Server-Timing header value: total time and count per stage.
+    """
+    totals = {}
+    for span in spans:
+        entry = totals.setdefault(span["stage"], [0.0, 0])
+        entry[0] += span["duration_ms"]
+        entry[1] += 1
+    return ", ".join(f'{name};dur={total:.2f};desc="{count} spans"' for name, (total, count) in totals.items())
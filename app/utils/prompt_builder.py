@@ -0,0 +1,139 @@
+import ast
+import os
+import textwrap
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Estimated-token budget for the code placed in a single prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+# Largest max_tokens the model accepts for one completion
+MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", "8192"))
+
+# Completion budget per call type; override one with e.g. LLM_OUTPUT_TOKENS_DOC_EXAMPLE=400
+OUTPUT_TOKEN_BUDGETS = {
+    call_type: int(os.getenv(f"LLM_OUTPUT_TOKENS_{call_type.upper()}", str(default)))
+    for call_type, default in {
+        "explain": 200,
+        "chat": 200,
+        "doc_explanation": 200,
+        "doc_example": 300,
+        # Per symbol of a combined explanation + example request
+        "doc_batch": 450,
+        "docstring": 300,
+        "improve_docstring": 300
+    }.items()
+}
+
+
+def estimate_tokens(text):
+    """
+    Rough token count for budgeting prompts (about four characters per token for code).
+    """
+    return len(text) // 4 + 1
+
+
+def output_budget(call_type):
+    """
+    Return the max_tokens to request for a call type.
+    """
+    return OUTPUT_TOKEN_BUDGETS.get(call_type, 200)
+
+
+def _stub_body(node):
+    """
+    Replace a function body with its docstring (if any) followed by `...`.
+    """
+    stub = [ast.Expr(ast.Constant(...))]
+    if ast.get_docstring(node) is not None:
+        stub.insert(0, node.body[0])
+    return stub
+
+
+def fit_code(source, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Shrink source code to fit an estimated-token budget.
+
+    Returns (text, mode), where mode is:
+        "full"        the source fits unchanged
+        "partial"     classes are chunked by method: every signature is kept and
+                      method bodies are included in source order while they fit
+        "signatures"  only signatures and docstrings are kept
+        "truncated"   the source couldn't be parsed or its signatures alone don't
+                      fit, so it was cut at the budget
+
+    Use `chunk_code` to also get the method bodies that were left out.
+    """
+    text, mode, _ = chunk_code(source, budget)
+    return text, mode
+
+
+def chunk_code(source, budget=PROMPT_TOKEN_BUDGET, chunk_budget=None):
+    """
+    Like `fit_code`, but return (text, mode, chunks): the functions and methods whose bodies
+    were left out of `text`, in full and grouped in source order into follow-up chunks that
+    each fit `chunk_budget` (by default the budget). A single function larger than it is cut at it.
+    """
+    if estimate_tokens(source) <= budget:
+        return source, "full", []
+    try:
+        tree = ast.parse(textwrap.dedent(source))
+    except (SyntaxError, ValueError):
+        return source[:budget * 4], "truncated", []
+
+    # Module-level functions and the methods of (possibly nested) classes; nested functions stay in their parent's body
+    functions = []
+    pending = [(tree, 0)]
+    while pending:
+        parent, depth = pending.pop(0)
+        for child in parent.body:
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                functions.append((child, depth))
+            elif isinstance(child, ast.ClassDef):
+                pending.append((child, depth + 1))
+
+    bodies = {}
+    for func, _ in functions:
+        bodies[id(func)] = func.body
+        func.body = _stub_body(func)
+    skeleton = ast.unparse(tree)
+    used = estimate_tokens(skeleton)
+    if used > budget:
+        return skeleton[:budget * 4], "truncated", []
+
+    restored = 0
+    omitted = []
+    for func, depth in sorted(functions, key=lambda item: item[0].lineno):
+        indent = 4 * (depth + 1)
+        extra = _body_cost(bodies[id(func)], indent) - _body_cost(func.body, indent)
+        if used + extra <= budget:
+            func.body = bodies[id(func)]
+            used += extra
+            restored += 1
+        else:
+            omitted.append(func)
+    text = ast.unparse(tree)
+
+    chunk_budget = chunk_budget or budget
+    chunks, chunk, chunk_used = [], [], 0
+    for func in omitted:
+        func.body = bodies[id(func)]
+        code = ast.unparse(func)
+        cost = estimate_tokens(code)
+        if chunk and chunk_used + cost > chunk_budget:
+            chunks.append("\n\n".join(chunk))
+            chunk, chunk_used = [], 0
+        chunk.append(code[:chunk_budget * 4])
+        chunk_used += min(cost, chunk_budget)
+    if chunk:
+        chunks.append("\n\n".join(chunk))
+    return text, "partial" if restored else "signatures", chunks
+
+
+def _body_cost(body, indent):
+    """
+    Estimated tokens of a function body as it appears in unparsed code, indentation included.
+    """
+    text = "\n".join(ast.unparse(statement) for statement in body)
+    return (len(text) + indent * (text.count("\n") + 1)) // 4
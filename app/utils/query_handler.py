@@ -1,16 +1,18 @@
-import requests
-from dotenv import load_dotenv
 import os
+import json
+from .llm_client import get_llm_client
+from .llm_scheduler import BULK, INTERACTIVE
+from .prompt_builder import MAX_OUTPUT_TOKENS, PROMPT_TOKEN_BUDGET, estimate_tokens, fit_code, output_budget
 
-load_dotenv()
+# Upper bound for the answer length a caller may request
+EXPLAIN_MAX_TOKENS = int(os.getenv("EXPLAIN_MAX_TOKENS", "1024"))
 
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-
-def explain_code(code_snippet, query):
+def build_explain_prompt(code_snippet, query):
     """
-    Use DeepSeek LLM to explain code based on a natural language query.
+    Build the explanation prompt, shrinking the code to what fits the prompt token budget.
     """
-    prompt = f"""
+    code_snippet, _ = fit_code(code_snippet or "", explain_code_budget(query))
+    return f"""
     The user has provided the following Python code:
     {code_snippet}
 
@@ -19,22 +21,86 @@ def explain_code(code_snippet, query):
     Provide a clear and concise explanation of what the code does, focusing on the user's query.
     """
 
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "deepseek-chat",
-        "prompt": prompt,
-        "max_tokens": 200,
-        "temperature": 0.7
-    }
-    response = requests.post(
-        "https://api.deepseek.com/beta/completions",
-        headers=headers,
-        json=data
+def explain_code_budget(query):
+    """
+    Estimated tokens of code that fit the explanation prompt for `query` (see build_explain_prompt).
+    """
+    # Leave room for the query and the instructions around the code
+    return PROMPT_TOKEN_BUDGET - estimate_tokens(query or "") - 64
+
+def explain_code(code_snippet, query, use_cache=True, max_tokens=None, call_type="explain", priority=INTERACTIVE):
+    """
+    Use DeepSeek LLM to explain code based on a natural language query.
+    Pass use_cache=False to skip the completion cache lookup and refresh the cached answer.
+    max_tokens defaults to the output budget of call_type; pass priority=BULK for background work.
+    """
+    prompt = build_explain_prompt(code_snippet, query)
+
+    return get_llm_client().complete(
+        prompt, max_tokens=max_tokens or output_budget(call_type), use_cache=use_cache, call_type=call_type,
+        priority=priority
+    )
+
+def stream_explanation(code_snippet, query, use_cache=True, max_tokens=None, call_type="explain", priority=INTERACTIVE):
+    """
+    Like explain_code, but yield the explanation in fragments as DeepSeek generates it.
+    """
+    prompt = build_explain_prompt(code_snippet, query)
+
+    return get_llm_client().stream(
+        prompt, max_tokens=max_tokens or output_budget(call_type), use_cache=use_cache, call_type=call_type,
+        priority=priority
     )
-    if response.status_code == 200:
-        return response.json()["choices"][0]["text"].strip()
-    else:
-        raise Exception(f"Failed to generate explanation: {response.status_code}")
\ No newline at end of file
+
+
+def symbols_code_budget(sources):
+    """
+    Estimated tokens of code each of `sources` gets in a combined prompt (see build_symbols_prompt).
+    """
+    # Leave room for the headings and the instructions around the code
+    budget = PROMPT_TOKEN_BUDGET - 128
+    if sum(estimate_tokens(source) for source in sources) > budget:
+        budget = max(1, budget // max(1, len(sources)))
+    return budget
+
+def build_symbols_prompt(symbols):
+    """
+    Build one prompt asking for the explanation and example usage of several symbols.
+    `symbols` is a list of (kind, name, source) tuples; the answer is requested as JSON keyed by name.
+    When the sources don't fit the prompt token budget together, each is shrunk to its share.
+    """
+    budget = symbols_code_budget([source for _, _, source in symbols])
+    sections = "\n".join(f"### {kind} `{name}`\n{fit_code(source, budget)[0]}\n" for kind, name, source in symbols)
+    return f"""
+    Document each of the following Python symbols.
+
+    {sections}
+    Respond with only a JSON object that maps each symbol name to an object with two string fields:
+    "explanation": a clear and concise explanation of what the symbol does, and
+    "example": a short Python example of its usage, without Markdown fences.
+    """
+
+def explain_symbols(symbols, use_cache=True, max_tokens=None, priority=BULK):
+    """
+    Ask for the explanation and example usage of several symbols in a single DeepSeek call.
+    Returns {name: {"explanation": ..., "example": ...}} for the symbols the model answered.
+    Raises ValueError if the response isn't a JSON object.
+    max_tokens defaults to the "doc_batch" output budget per symbol, capped at MAX_OUTPUT_TOKENS.
+    """
+    prompt = build_symbols_prompt(symbols)
+    text = get_llm_client().complete(
+        prompt, max_tokens=min(max_tokens or output_budget("doc_batch") * len(symbols), MAX_OUTPUT_TOKENS),
+        use_cache=use_cache, call_type="doc_batch", priority=priority
+    )
+    # Tolerate Markdown fences or prose around the JSON object
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("DeepSeek response is not a JSON object")
+    answers = json.loads(text[start:end + 1])
+    if not isinstance(answers, dict):
+        raise ValueError("DeepSeek response is not a JSON object")
+    return {
+        name: {"explanation": str(answer.get("explanation", "")), "example": str(answer.get("example", ""))}
+        for name, answer in answers.items()
+        if isinstance(answer, dict)
+    }
@@ -0,0 +1,346 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+from dotenv import load_dotenv
+from .metrics import ROUTE_COALESCED, record_cache_lookup
+from .shared_storage import process_alive
+
+load_dotenv()
+
+# Seconds a successful route response is served from the cache; 0 only coalesces concurrent requests
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", "60"))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "1024"))
+# Larger responses are shared with concurrent requests but not kept
+ROUTE_CACHE_MAX_BODY_BYTES = int(os.getenv("ROUTE_CACHE_MAX_BODY_BYTES", str(1024 * 1024)))
+# SQLite file shared by the worker processes of one host; empty keeps the cache and coalescing per process
+ROUTE_CACHE_PATH = os.getenv("ROUTE_CACHE_PATH", os.path.join(".cache", "route_cache.sqlite"))
+
+# Seconds between checks on a response another worker process is computing
+POLL_INTERVAL = 0.05
+# Seconds a stored response stays readable by the requests that waited for it, after it expires
+WAITER_GRACE = 60
+# Run disk eviction once every this many writes instead of on every insert
+EVICTION_INTERVAL = 100
+
+
+def make_request_key(route, body):
+    """
+    Hash a route and its JSON body into a key; key order and whitespace in the body don't matter.
+    """
+    payload = json.dumps([route, body], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CachedResponse:
+    """
+    A finished response as bytes, with the strong ETag of its body. `has_usage` marks a JSON
+    body whose per-request "usage" field was taken out before sharing it.
+    """
+    __slots__ = ("status", "body", "mimetype", "etag", "expires_at", "has_usage")
+
+    def __init__(self, status, body, mimetype, expires_at=0.0, has_usage=False):
+        self.status = status
+        self.body = body
+        self.mimetype = mimetype
+        self.has_usage = has_usage
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.expires_at = expires_at
+
+
+class _Flight:
+    __slots__ = ("done", "response", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class ResponseCache:
+    """
+    Single-flight and TTL cache for route responses.
+
+    The first request for a key runs the computation; identical requests arriving while it
+    runs wait for it and share its response instead of repeating the work. Successful (200)
+    responses are then kept for `ttl` seconds, up to `max_entries` (least recently used first
+    out). Error responses are shared with the waiting requests but never kept.
+
+    With a `path`, responses are kept in that SQLite file and computations are claimed in it,
+    so the worker processes of a host share both. Requests waiting in another process get the
+    response through the file; if it isn't kept there (an error, or a body over `max_body_bytes`)
+    or its process died, they compute it themselves. Without a path, both are per process.
+    """
+
+    def __init__(self, ttl=ROUTE_CACHE_TTL, max_entries=ROUTE_CACHE_MAX_ENTRIES, max_body_bytes=ROUTE_CACHE_MAX_BODY_BYTES,
+                 path=ROUTE_CACHE_PATH):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_body_bytes = max_body_bytes
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._writes = 0
+        self._lock = threading.Lock()
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, flight TEXT NOT NULL, status INTEGER NOT NULL, body BLOB NOT NULL, "
+                    "mimetype TEXT, has_usage INTEGER NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+                conn.execute("CREATE TABLE IF NOT EXISTS flights (key TEXT PRIMARY KEY, flight TEXT NOT NULL, pid INTEGER NOT NULL)")
+
+    def _connect(self):
+        # Autocommit mode, so the explicit BEGIN IMMEDIATE below controls the transaction
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def fetch(self, key, compute):
+        """
+        Return (response, outcome) for key: outcome is "hit" for a cached response, "coalesced"
+        when another request's computation was shared, and "miss" when `compute()` ran here.
+        `compute` returns a CachedResponse; an exception it raises is raised for every request
+        of this process waiting for it too.
+        """
+        entry = self._get(key) if self.path else None
+        with self._lock:
+            if not self.path:
+                entry = self._entries.get(key)
+                if entry is not None and entry.expires_at <= time.monotonic():
+                    del self._entries[key]
+                    entry = None
+                elif entry is not None:
+                    self._entries.move_to_end(key)
+            if entry is not None:
+                self.hits += 1
+                record_cache_lookup("route_response", True)
+                return entry, "hit"
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            ROUTE_COALESCED.inc()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.response, "coalesced"
+
+        try:
+            response, outcome = self._lead(key, compute)
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            flight.response = response
+            return response, outcome
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _lead(self, key, compute):
+        """
+        Compute the response for this process's requests, unless another process is already
+        computing it or has just stored it.
+        """
+        flight = uuid.uuid4().hex
+        while self.path:
+            claim = self._claim(key, flight)
+            if claim is None:
+                break
+            if isinstance(claim, CachedResponse):
+                with self._lock:
+                    self.hits += 1
+                record_cache_lookup("route_response", True)
+                return claim, "hit"
+            response = self._wait_for(key, claim)
+            if response is not None:
+                with self._lock:
+                    self.coalesced += 1
+                ROUTE_COALESCED.inc()
+                return response, "coalesced"
+
+        with self._lock:
+            self.misses += 1
+        record_cache_lookup("route_response", False)
+        try:
+            response = compute()
+        except BaseException:
+            self._release(key, flight)
+            raise
+        self._store(key, response, flight)
+        return response, "miss"
+
+    def _claim(self, key, flight):
+        """
+        Claim the computation of key in the shared file. Returns None once claimed, the fresh
+        response if another process stored one meanwhile, or the flight id of a live process
+        computing it.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT status, body, mimetype, has_usage, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+                other = conn.execute("SELECT flight, pid FROM flights WHERE key = ?", (key,)).fetchone()
+                if row is None and not (other and process_alive(other[1])):
+                    conn.execute("INSERT OR REPLACE INTO flights (key, flight, pid) VALUES (?, ?, ?)", (key, flight, os.getpid()))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if row is not None:
+            return _response(row)
+        return other[0] if other and process_alive(other[1]) else None
+
+    def _wait_for(self, key, flight):
+        """
+        Wait for another process's computation of key. Returns its response, or None if it
+        wasn't stored or the process died.
+        """
+        while True:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT status, body, mimetype, has_usage, expires_at FROM responses WHERE key = ? AND flight = ?",
+                    (key, flight)
+                ).fetchone()
+                other = conn.execute("SELECT pid FROM flights WHERE key = ? AND flight = ?", (key, flight)).fetchone()
+            if row is not None:
+                return _response(row)
+            if other is None or not process_alive(other[0]):
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def _release(self, key, flight):
+        if self.path:
+            with closing(self._connect()) as conn:
+                conn.execute("DELETE FROM flights WHERE key = ? AND flight = ?", (key, flight))
+
+    def _get(self, key):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT status, body, mimetype, has_usage, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return _response(row) if row is not None else None
+
+    def _store(self, key, response, flight):
+        keep = response.status == 200 and len(response.body) <= self.max_body_bytes
+        if not self.path:
+            if not keep or self.ttl <= 0:
+                return
+            response.expires_at = time.monotonic() + self.ttl
+            with self._lock:
+                self._entries[key] = response
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return
+
+        now = time.time()
+        response.expires_at = now + max(self.ttl, 0)
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if keep:
+                    # With a zero TTL the row only serves the requests that waited for it
+                    conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, flight, status, body, mimetype, has_usage, expires_at, accessed_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, flight, response.status, response.body, response.mimetype, int(response.has_usage),
+                         response.expires_at, now)
+                    )
+                conn.execute("DELETE FROM flights WHERE key = ? AND flight = ?", (key, flight))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % EVICTION_INTERVAL == 0
+        if evict:
+            self._evict()
+
+    def _evict(self):
+        """
+        Drop rows expired for longer than WAITER_GRACE, then the least recently used rows beyond max_entries.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time() - WAITER_GRACE,))
+            conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self):
+        entries = len(self._entries)
+        if self.path:
+            with closing(self._connect()) as conn:
+                entries = conn.execute("SELECT COUNT(*) FROM responses WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+        with self._lock:
+            return {
+                "entries": entries,
+                "in_flight": len(self._flights),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "ttl_seconds": self.ttl
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            with closing(self._connect()) as conn:
+                conn.execute("DELETE FROM responses")
+
+
+def _response(row):
+    status, body, mimetype, has_usage, expires_at = row
+    return CachedResponse(status, bytes(body), mimetype, expires_at=expires_at, has_usage=bool(has_usage))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """
+    Return the process-wide route response cache, creating it on first use.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+def set_response_cache(cache):
+    """
+    Replace the process-wide route response cache (used by tests to change its TTL).
+    """
+    global _cache
+    with _cache_lock:
+        _cache = cache
@@ -0,0 +1,179 @@
+import keyword
+import math
+import os
+import re
+from collections import Counter
+from dotenv import load_dotenv
+from .code_parser import build_symbol_index
+from .github_api import iter_repo_files, resolve_ref
+from .prompt_builder import estimate_tokens
+from .snapshot_store import get_snapshot_store
+
+load_dotenv()
+
+# Prompt budget (estimated tokens) for retrieved code context
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "3000"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Identifier tokens from a symbol's own name count this many times
+NAME_WEIGHT = 3
+
+STOPWORDS = set(keyword.kwlist) | {
+    "a", "an", "and", "are", "as", "be", "by", "can", "code", "do", "does", "for", "from", "how",
+    "i", "in", "is", "it", "me", "of", "on", "or", "self", "cls", "that", "the", "this", "to",
+    "what", "when", "where", "which", "who", "why", "with", "you", "none", "true", "false"
+}
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_WORD_PARTS = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text):
+    """
+    Split text into lowercase identifier tokens: snake_case and CamelCase names are broken
+    into their words, and compound identifiers are also kept whole.
+    """
+    tokens = []
+    for identifier in _IDENTIFIER.findall(text):
+        parts = [part.lower() for piece in identifier.split("_") for part in _WORD_PARTS.findall(piece)]
+        tokens.extend(part for part in parts if len(part) > 1)
+        if len(parts) > 1:
+            tokens.append(identifier.lower())
+    return [token for token in tokens if token not in STOPWORDS]
+
+
+class RetrievalIndex:
+    """
+    BM25 index over the functions, methods and classes of a set of files.
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.average_length = (sum(doc["length"] for doc in documents) / len(documents)) if documents else 0
+        self.postings = {}
+        for doc_id, doc in enumerate(documents):
+            for term, frequency in doc["tf"].items():
+                self.postings.setdefault(term, []).append((doc_id, frequency))
+
+    @classmethod
+    def from_files(cls, files):
+        """
+        Build an index from (path, source) pairs; files that don't parse are skipped.
+        """
+        documents = []
+        for path, source in files:
+            try:
+                index = build_symbol_index(source)
+            except (SyntaxError, ValueError):
+                continue
+            function_scopes = {symbol.qualname for symbol in index.symbols if symbol.kind != "class"}
+            for symbol in index.symbols:
+                # Nested functions are already part of their enclosing function's source
+                if symbol.parent in function_scopes:
+                    continue
+                terms = tokenize(symbol.qualname) * NAME_WEIGHT + tokenize(symbol.source)
+                documents.append({
+                    "path": path,
+                    "qualname": symbol.qualname,
+                    "kind": symbol.kind,
+                    "lineno": symbol.lineno,
+                    "end_lineno": symbol.end_lineno,
+                    "source": symbol.source,
+                    "tf": dict(Counter(terms)),
+                    "length": len(terms)
+                })
+        return cls(documents)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["documents"])
+
+    def to_dict(self):
+        return {"version": 1, "documents": self.documents}
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+        """
+        Return up to k (score, document) pairs ranked by BM25 relevance to the query.
+        """
+        scores = Counter()
+        total = len(self.documents)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings:
+                length = self.documents[doc_id]["length"]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.average_length)
+                scores[doc_id] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return [(score, self.documents[doc_id]) for doc_id, score in scores.most_common(k)]
+
+    def select(self, query, token_budget=RETRIEVAL_TOKEN_BUDGET, k=RETRIEVAL_TOP_K):
+        """
+        Pick the most relevant symbols that fit in token_budget, skipping a symbol when
+        its enclosing class (or one of its methods) has already been picked.
+        """
+        selected = []
+        used = 0
+        for _, doc in self.search(query, k):
+            overlaps = any(
+                doc["path"] == other["path"] and (
+                    doc["qualname"].startswith(other["qualname"] + ".")
+                    or other["qualname"].startswith(doc["qualname"] + ".")
+                )
+                for other in selected
+            )
+            cost = estimate_tokens(doc["source"])
+            if overlaps or used + cost > token_budget:
+                continue
+            selected.append(doc)
+            used += cost
+        return selected
+
+
+def format_context(documents):
+    """
+    Join selected symbols into a prompt context, labelling where each one comes from.
+    """
+    sections = []
+    for doc in documents:
+        location = f"{doc['path']}:" if doc["path"] else "line "
+        sections.append(f"# {doc['qualname']} ({location}{doc['lineno']}-{doc['end_lineno']})\n{doc['source']}")
+    return "\n\n".join(sections)
+
+
+def get_repo_index(owner, repo, ref=None):
+    """
+    Return the retrieval index of a repository commit, building and saving it in the snapshot store once.
+    """
+    commit_sha = resolve_ref(owner, repo, ref)
+    store = get_snapshot_store()
+    data = store.load_artifact(owner, repo, commit_sha, "retrieval")
+    if data is not None:
+        return RetrievalIndex.from_dict(data)
+    index = RetrievalIndex.from_files(iter_repo_files(owner, repo, ref=commit_sha))
+    store.save_artifact(owner, repo, commit_sha, "retrieval", index.to_dict())
+    return index
+
+
+def retrieve_context(query, code=None, owner=None, repo=None, ref=None, token_budget=RETRIEVAL_TOKEN_BUDGET):
+    """
+    Return the code context to send with a question.
+
+    With owner/repo, the most relevant symbols of the repository are selected. A code payload
+    that already fits the budget is sent as is; a larger one is indexed and narrowed down the
+    same way, so the prompt size stays roughly constant as the code grows.
+    """
+    if owner and repo:
+        return format_context(get_repo_index(owner, repo, ref).select(query, token_budget))
+    code = code or ""
+    if estimate_tokens(code) <= token_budget:
+        return code
+    selected = RetrievalIndex.from_files([(None, code)]).select(query, token_budget)
+    if not selected:
+        # Nothing parseable or relevant: fall back to the start of the payload
+        return code[:token_budget * 4]
+    return format_context(selected)
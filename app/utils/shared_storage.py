@@ -0,0 +1,183 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from dotenv import load_dotenv
+from limits.storage import Storage
+
+load_dotenv()
+
+# Rate-limit counters shared by every worker process. The default SQLite file works for
+# workers on one host; use a redis:// URI (needs the redis package) across hosts.
+RATELIMIT_STORAGE_URI = os.getenv(
+    "RATELIMIT_STORAGE_URI", "sqlite:///" + os.path.abspath(os.path.join(".cache", "ratelimit.sqlite"))
+)
+# Small JSON values shared by the worker processes on one host, such as the GitHub rate-limit budget
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", os.path.abspath(os.path.join(".cache", "shared_state.sqlite")))
+
+
+def process_alive(pid):
+    """
+    Return whether a process with this pid is running on this host.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SQLiteStorage(Storage):
+    """
+    Rate-limit storage for `limits` (and Flask-Limiter) backed by a SQLite file, registered
+    for sqlite:///relative/path and sqlite:////absolute/path URIs.
+
+    Every increment runs in an IMMEDIATE transaction, so worker processes sharing the file
+    count against the same fixed-window limits.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self.path = uri.split("sqlite:///", 1)[1]
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters ("
+                "key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connect(self):
+        # Autocommit mode, so the explicit BEGIN IMMEDIATE below controls the transaction
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT value, expires_at FROM counters WHERE key = ?", (key,)).fetchone()
+                if row is None or row[1] <= now:
+                    value, expires_at = amount, now + expiry
+                else:
+                    value, expires_at = row[0] + amount, (now + expiry if elastic_expiry else row[1])
+                conn.execute(
+                    "INSERT OR REPLACE INTO counters (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        with self._writes_lock:
+            self._writes += 1
+            purge = self._writes % 1000 == 0
+        if purge:
+            self._purge()
+        return value
+
+    def get(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT value FROM counters WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT expires_at FROM counters WHERE key = ?", (key,)).fetchone()
+        return row[0] if row and row[0] > time.time() else time.time()
+
+    def check(self):
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("DELETE FROM counters").rowcount
+
+    def clear(self, key):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM counters WHERE key = ?", (key,))
+
+    def _purge(self):
+        """
+        Drop expired counters so the table doesn't grow with every client seen.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM counters WHERE expires_at <= ?", (time.time(),))
+
+
+class SharedState:
+    """
+    JSON values shared by every worker process on one host through a SQLite file.
+
+    `update` reads, changes and writes one value in a single IMMEDIATE transaction, so
+    concurrent updates from other processes are never lost. With path=None the values
+    are only shared by the threads of this process.
+    """
+
+    def __init__(self, path=SHARED_STATE_PATH):
+        self.path = path
+        self._values = {}
+        self._lock = threading.Lock()
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _connect(self):
+        # Autocommit mode, so the explicit BEGIN IMMEDIATE below controls the transaction
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def update(self, key, fn):
+        """
+        Call fn(value), with None for a key that isn't set, and store the first item of the
+        (new value, result) pair it returns. Returns the result.
+        """
+        # The thread lock keeps this process's threads from spinning on SQLite's busy handler
+        with self._lock:
+            if not self.path:
+                value, result = fn(self._values.get(key))
+                self._values[key] = value
+                return result
+            with closing(self._connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+                    value, result = fn(json.loads(row[0]) if row else None)
+                    conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            return result
+
+    def get(self, key):
+        with self._lock:
+            if not self.path:
+                return self._values.get(key)
+            with closing(self._connect()) as conn:
+                row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+            return json.loads(row[0]) if row else None
@@ -0,0 +1,154 @@
+import json
+import os
+import tempfile
+import threading
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows: ETag writes are only serialized within one process
+    fcntl = None
+
+load_dotenv()
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(".cache", "snapshots"))
+
+
+def atomic_write(path, text):
+    """
+    Write text to path via a temporary file so readers never see a partial file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class SnapshotStore:
+    """
+    Local store of fetched repositories.
+
+    Layout under `root`:
+        blobs/<sha[:2]>/<sha>                 file contents, deduplicated by git blob SHA
+        commits/<owner>/<repo>/<commit>.json  file listing of one commit
+        artifacts/<owner>/<repo>/<commit>/    derived data of one commit, such as the retrieval index
+        etags.json                            ETag and body of conditional GitHub lookups
+
+    etags.json is shared by every worker process using the store: writers merge their entry
+    into the current file under a file lock, and readers reload it when it changes.
+    """
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+        self._etags = None
+        self._etags_version = None  # mtime, size and inode of etags.json when it was loaded
+        self._lock = threading.Lock()
+
+    def _blob_path(self, sha):
+        return os.path.join(self.root, "blobs", sha[:2], sha)
+
+    def _snapshot_path(self, owner, repo, commit_sha):
+        return os.path.join(self.root, "commits", owner, repo, f"{commit_sha}.json")
+
+    def has_blob(self, sha):
+        return os.path.exists(self._blob_path(sha))
+
+    def read_blob(self, sha):
+        with open(self._blob_path(sha), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def write_blob(self, sha, text):
+        atomic_write(self._blob_path(sha), text)
+
+    def load_snapshot(self, owner, repo, commit_sha):
+        """
+        Return the file listing stored for a commit, or None if the commit hasn't been seen.
+        """
+        try:
+            with open(self._snapshot_path(owner, repo, commit_sha), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_snapshot(self, owner, repo, commit_sha, files):
+        atomic_write(self._snapshot_path(owner, repo, commit_sha), json.dumps(files))
+
+    def load_artifact(self, owner, repo, commit_sha, name):
+        """
+        Return derived JSON data saved for a commit, or None.
+        """
+        try:
+            with open(os.path.join(self.root, "artifacts", owner, repo, commit_sha, f"{name}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_artifact(self, owner, repo, commit_sha, name, data):
+        atomic_write(os.path.join(self.root, "artifacts", owner, repo, commit_sha, f"{name}.json"), json.dumps(data))
+
+    def get_etag(self, url):
+        """
+        Return the (etag, body) pair recorded for url, or (None, None).
+        """
+        with self._lock:
+            entry = self._load_etags().get(url)
+        return (entry["etag"], entry["body"]) if entry else (None, None)
+
+    def set_etag(self, url, etag, body):
+        path = os.path.join(self.root, "etags.json")
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(os.path.join(self.root, "etags.lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Merge into the entries other workers saved since this process last read the file
+            etags = dict(self._load_etags())
+            etags[url] = {"etag": etag, "body": body}
+            atomic_write(path, json.dumps(etags))
+            self._etags, self._etags_version = etags, _file_version(path)
+
+    def _load_etags(self):
+        path = os.path.join(self.root, "etags.json")
+        version = _file_version(path)
+        if self._etags is None or version != self._etags_version:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._etags = json.load(f)
+            except FileNotFoundError:
+                self._etags = {}
+            self._etags_version = version
+        return self._etags
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_snapshot_store():
+    """
+    Return the process-wide snapshot store, creating it on first use.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SnapshotStore()
+        return _store
+
+def set_snapshot_store(store):
+    """
+    Replace the process-wide snapshot store (used by tests to point it at a temporary directory).
+    """
+    global _store
+    with _store_lock:
+        _store = store
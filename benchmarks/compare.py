@@ -0,0 +1,73 @@
+"""
+Compare two benchmark result files and report regressions.
+
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+Exits with status 1 when any scenario's throughput dropped, or its p95 latency or peak
+memory grew, by more than the threshold (10% by default).
+"""
+import argparse
+import json
+import sys
+
+
+def _index(document):
+    return {(result["scenario"], result["size"]): result for result in document["results"]}
+
+
+def _change(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old
+
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    Return one row per scenario and size present in both documents, with the relative change of
+    throughput, p95 latency and peak memory, and the names of the ones that regressed.
+    """
+    rows = []
+    old_results = _index(baseline)
+    for key, new in _index(current).items():
+        old = old_results.get(key)
+        if old is None:
+            continue
+        changes = {
+            "throughput": _change(old["throughput"]["value"], new["throughput"]["value"]),
+            "p95_ms": _change(old["latency_ms"]["p95"], new["latency_ms"]["p95"]),
+            "peak_memory_mb": _change(old["peak_memory_mb"], new["peak_memory_mb"])
+        }
+        regressions = [
+            name for name, change in changes.items()
+            if change is not None and (change < -threshold if name == "throughput" else change > threshold)
+        ]
+        if new["errors"] > old["errors"]:
+            regressions.append("errors")
+        rows.append({"scenario": key[0], "size": key[1], "changes": changes, "regressions": regressions})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change that counts as a regression.")
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    print(f"{baseline['commit']} -> {current['commit']}")
+    rows = compare_results(baseline, current, args.threshold)
+    for row in rows:
+        changes = "  ".join(
+            f"{name} {change:+.1%}" if change is not None else f"{name} n/a" for name, change in row["changes"].items()
+        )
+        flag = f"  REGRESSED: {', '.join(row['regressions'])}" if row["regressions"] else ""
+        print(f"{row['scenario']:<32} size={row['size']:<5} {changes}{flag}")
+    return 1 if any(row["regressions"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
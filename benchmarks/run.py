@@ -0,0 +1,365 @@
+"""
+Benchmark the documentation pipeline and the main routes against local stub servers.
+
+    python -m benchmarks.run --sizes 10,50,200 --latency 0.05
+
+Starts stand-ins for the DeepSeek and GitHub APIs (see stub_servers.py), points the app
+at them, and runs every scenario on synthetic repositories of each size. Results are
+written as JSON to benchmarks/results/<commit>.json; compare two runs with
+`python -m benchmarks.compare`.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_servers import DeepSeekStub, GitHubStub
+from benchmarks.synthetic import make_repo
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+OWNER = "bench"
+
+
+def percentile(values, share):
+    """
+    Nearest-rank percentile of `values` (share between 0 and 1), or None if empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(share * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def latency_summary(durations):
+    """
+    Summarize durations in seconds as p50/p95/p99, mean and max in milliseconds.
+    """
+    milliseconds = [duration * 1000 for duration in durations]
+    summary = {name: percentile(milliseconds, share) for name, share in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+    summary["mean"] = sum(milliseconds) / len(milliseconds) if milliseconds else None
+    summary["max"] = max(milliseconds) if milliseconds else None
+    return {name: round(value, 2) if value is not None else None for name, value in summary.items()}
+
+
+def git_commit():
+    """
+    Return the short commit of the working tree, with "-dirty" if it has uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def configure_environment(deepseek, github, workdir):
+    """
+    Point the app at the stub servers and keep its caches and output in `workdir`.
+    Must run before the app is imported, since its modules read the environment on import.
+    """
+    os.environ.update({
+        "DEEPSEEK_API_KEY": "benchmark",
+        "DEEPSEEK_API_BASE": deepseek.base_url,
+        "GITHUB_API_URL": github.base_url,
+        "GITHUB_RAW_URL": github.raw_url,
+        "GITHUB_ACCESS_TOKEN": "benchmark",
+        "LLM_CACHE_PATH": "",
+        "SNAPSHOT_DIR": os.path.join(workdir, "snapshots"),
+        "JOBS_DIR": os.path.join(workdir, "jobs"),
+        "DOCS_DIR": os.path.join(workdir, "docs"),
+        "RATELIMIT_STORAGE_URI": "memory://",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING")
+    })
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def reset_state(workdir, *stubs):
+    """
+    Start from cold caches and fresh connection pools, and zero the stub call counts.
+    """
+    from app.utils.github_api import GitHubClient, set_github_client
+    from app.utils.llm_cache import LLMCache, set_llm_cache
+    from app.utils.llm_client import LLMClient, set_llm_client
+    from app.utils.metrics import set_metrics_state
+    from app.utils.response_cache import ResponseCache, set_response_cache
+    from app.utils.shared_storage import SharedState
+    from app.utils.snapshot_store import SnapshotStore, set_snapshot_store
+
+    set_llm_cache(LLMCache(path=None))
+    set_llm_client(LLMClient())
+    set_github_client(GitHubClient(state=SharedState(None)))
+    set_metrics_state(SharedState(None))
+    set_response_cache(ResponseCache(path=os.path.join(tempfile.mkdtemp(prefix="route-cache-", dir=workdir), "route_cache.sqlite")))
+    set_snapshot_store(SnapshotStore(tempfile.mkdtemp(prefix="snapshots-", dir=workdir)))
+    for stub in stubs:
+        stub.reset_counts()
+
+
+def measure(operations, concurrency=1):
+    """
+    Run the callables in `operations` on `concurrency` threads. Returns the wall time, each
+    operation's duration, the number that raised or returned False, and the peak of memory
+    allocated by Python while they ran.
+    """
+    def timed(operation):
+        start = time.perf_counter()
+        try:
+            ok = operation() is not False
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(timed, operations))
+    else:
+        outcomes = [timed(operation) for operation in operations]
+    wall_time = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "wall_time": wall_time,
+        "durations": [duration for duration, _ in outcomes],
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "peak_memory": peak
+    }
+
+
+def result_entry(scenario, size, measurement, units, unit_name, calls, **extra):
+    """
+    Build one result record; throughput is `units` processed per second of wall time.
+    """
+    wall_time = measurement["wall_time"]
+    return dict({
+        "scenario": scenario,
+        "size": size,
+        "operations": len(measurement["durations"]),
+        "errors": measurement["errors"],
+        "wall_time_s": round(wall_time, 3),
+        "throughput": {"value": round(units / wall_time, 2) if wall_time else None, "unit": unit_name},
+        "latency_ms": latency_summary(measurement["durations"]),
+        "peak_memory_mb": round(measurement["peak_memory"] / 2 ** 20, 2),
+        "calls": calls
+    }, **extra)
+
+
+def measure_cold_runs(operation, repeats, workdir, deepseek, github):
+    """
+    Measure `operation` `repeats` times, each from cold caches. Returns the combined
+    measurement and the stub call counts of the last run.
+    """
+    combined = {"wall_time": 0.0, "durations": [], "errors": 0, "peak_memory": 0}
+    calls = {}
+    for _ in range(repeats):
+        reset_state(workdir, deepseek, github)
+        measurement = measure([operation])
+        combined["wall_time"] += measurement["wall_time"]
+        combined["durations"] += measurement["durations"]
+        combined["errors"] += measurement["errors"]
+        combined["peak_memory"] = max(combined["peak_memory"], measurement["peak_memory"])
+        calls = {"deepseek": dict(deepseek.calls), "github": dict(github.calls)}
+    return combined, calls
+
+
+def bench_fetch_and_process_repo(size, repo, repeats, workdir, deepseek, github):
+    from app.utils.github_api import fetch_and_process_repo
+
+    python_files = sum(1 for path in repo if path.endswith(".py"))
+    # Every run starts with an empty snapshot store, so every file is downloaded
+    measurement, calls = measure_cold_runs(
+        lambda: fetch_and_process_repo(OWNER, f"repo-{size}"), repeats, workdir, deepseek, github
+    )
+    return result_entry(
+        "fetch_and_process_repo", size, measurement, python_files * repeats, "files/s", calls,
+        python_files=python_files
+    )
+
+
+def bench_generate_markdown_docs(size, repo, repeats, workdir, deepseek, github):
+    from app.utils.docstring_generator import generate_markdown_docs
+
+    files = [(path, code) for path, code in sorted(repo.items()) if path.endswith(".py")]
+    stats = {}
+
+    def run():
+        manifest = {"version": 1, "document": None, "symbols": {}}
+        generate_markdown_docs(files, manifest=manifest)
+        stats.update(manifest["last_run"])
+
+    measurement, calls = measure_cold_runs(run, repeats, workdir, deepseek, github)
+    return result_entry(
+        "generate_markdown_docs", size, measurement, stats.get("generated", 0) * repeats, "symbols/s", calls,
+        python_files=len(files), symbols=stats
+    )
+
+
+def bench_ingest_local(size, repo, repeats, workdir):
+    """
+    Time reading and parsing the repository from a local folder, in this process and on the parse pool.
+    No stub is called; small repositories stay in-process either way (see LOCAL_PARSE_MIN_FILES).
+    """
+    from app.utils.local_source import LOCAL_PARSE_WORKERS, iter_local_indexes
+
+    directory = os.path.join(workdir, f"local-{size}")
+    for path, code in repo.items():
+        os.makedirs(os.path.dirname(os.path.join(directory, path)), exist_ok=True)
+        with open(os.path.join(directory, path), "w") as f:
+            f.write(code)
+    python_files = sum(1 for path in repo if path.endswith(".py"))
+
+    results = []
+    for name, workers in (("serial", 1), ("pool", LOCAL_PARSE_WORKERS)):
+        def run(workers=workers):
+            return all(index is not None for _, _, index, _ in iter_local_indexes(directory, max_workers=workers))
+
+        measurement = measure([run] * repeats)
+        results.append(result_entry(
+            f"ingest_local:{name}", size, measurement, python_files * repeats, "files/s", {},
+            python_files=python_files, workers=workers
+        ))
+    return results
+
+
+def route_cases(size, repo):
+    """
+    Return (name, method, path, json body, concurrency) for the routes benchmarked at `size`.
+    A concurrency of None marks whole-repository routes, which run one at a time from cold caches.
+    """
+    module = next(code for path, code in sorted(repo.items()) if path.endswith("module_0.py"))
+    snippet = module.split("\nclass ", 1)[0]
+    repo_body = {"owner": OWNER, "repo": f"repo-{size}"}
+    return [
+        ("explain_code", "POST", "/explain-code", {"code": module, "query": "What does this module do?", "no_cache": True}, 8),
+        ("chatbot", "POST", "/chatbot", {"code": module, "input": "How is Model0 used?", "no_cache": True}, 8),
+        ("generate_docstring", "POST", "/generate-docstring", {"code": snippet, "no_cache": True}, 8),
+        ("generate_docs", "POST", "/generate-docs", {"code": module, "no_cache": True, "full": True}, 1),
+        ("fetch_repo", "POST", "/fetch-repo", repo_body, 8),
+        ("generate_repo_docs", "POST", "/generate-repo-docs", dict(repo_body, full=True), None),
+        ("metrics", "GET", "/metrics", None, 8)
+    ]
+
+
+def bench_routes(size, repo, requests_per_route, workdir, deepseek, github):
+    from app import create_app
+
+    app = create_app({"TESTING": True, "RATELIMIT_ENABLED": False, "RATELIMIT_STORAGE_URI": "memory://"})
+    results = []
+    for name, method, path, body, concurrency in route_cases(size, repo):
+        def request(method=method, path=path, body=body):
+            return app.test_client().open(path, method=method, json=body).status_code < 400
+
+        if concurrency is None:
+            # A few cold runs show the cost of a whole-repository route better than many warm ones
+            count = max(1, requests_per_route // 5)
+            measurement, calls = measure_cold_runs(request, count, workdir, deepseek, github)
+        else:
+            count = requests_per_route
+            reset_state(workdir, deepseek, github)
+            measurement = measure([request] * count, concurrency=concurrency)
+            calls = {"deepseek": dict(deepseek.calls), "github": dict(github.calls)}
+        results.append(result_entry(f"route:{name}", size, measurement, count, "requests/s", calls,
+                                    concurrency=concurrency or 1))
+    return results
+
+
+def run_benchmarks(sizes, repeats=3, requests_per_route=20, scenarios=None, stub_options=None, workdir=None):
+    """
+    Run the scenarios for every repository size and return the results document.
+    `scenarios` limits the run to names among "fetch_and_process_repo", "generate_markdown_docs",
+    "ingest_local" and "routes".
+    """
+    stub_options = stub_options or {}
+    scenarios = set(scenarios or ("fetch_and_process_repo", "generate_markdown_docs", "ingest_local", "routes"))
+    workdir = workdir or tempfile.mkdtemp(prefix="benchmark-")
+    repos = {size: make_repo(size) for size in sizes}
+    deepseek = DeepSeekStub(**stub_options.get("deepseek", {}))
+    github = GitHubStub(repos={f"{OWNER}/repo-{size}": repo for size, repo in repos.items()},
+                        **stub_options.get("github", {}))
+    with deepseek, github:
+        configure_environment(deepseek, github, workdir)
+        results = []
+        for size in sizes:
+            repo = repos[size]
+            if "fetch_and_process_repo" in scenarios:
+                results.append(bench_fetch_and_process_repo(size, repo, repeats, workdir, deepseek, github))
+            if "generate_markdown_docs" in scenarios:
+                results.append(bench_generate_markdown_docs(size, repo, repeats, workdir, deepseek, github))
+            if "ingest_local" in scenarios:
+                results += bench_ingest_local(size, repo, repeats, workdir)
+            if "routes" in scenarios:
+                results += bench_routes(size, repo, requests_per_route, workdir, deepseek, github)
+    return {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"sizes": list(sizes), "repeats": repeats, "requests_per_route": requests_per_route,
+                   "stubs": stub_options},
+        "results": results
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the documentation pipeline against local stub APIs.")
+    parser.add_argument("--sizes", default="10,50,200", help="Comma-separated numbers of Python modules per synthetic repository.")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of each pipeline scenario per size.")
+    parser.add_argument("--requests", type=int, default=20, help="Requests sent to each route per size.")
+    parser.add_argument("--scenarios", default="fetch_and_process_repo,generate_markdown_docs,ingest_local,routes")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean DeepSeek response latency in seconds.")
+    parser.add_argument("--github-latency", type=float, default=0.02, help="Mean GitHub response latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform latency jitter in seconds for both stubs.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of DeepSeek responses that fail with 500.")
+    parser.add_argument("--github-error-rate", type=float, default=0.0, help="Share of GitHub responses that fail with 502.")
+    parser.add_argument("--deepseek-rps", type=int, default=None, help="DeepSeek requests per second before 429s.")
+    parser.add_argument("--github-rate-limit", type=int, default=5000, help="GitHub API requests per rate-limit window.")
+    parser.add_argument("--output", default=None, help="Results file (default benchmarks/results/<commit>.json).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    stub_options = {
+        "deepseek": {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+                     "requests_per_second": args.deepseek_rps},
+        "github": {"latency": args.github_latency, "jitter": args.jitter, "error_rate": args.github_error_rate,
+                   "rate_limit": args.github_rate_limit}
+    }
+    output = os.path.abspath(args.output) if args.output else None
+    document = run_benchmarks(
+        sizes, repeats=args.repeats, requests_per_route=args.requests,
+        scenarios=[name for name in args.scenarios.split(",") if name], stub_options=stub_options
+    )
+    output = output or os.path.join(RESULTS_DIR, f"{document['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(document, f, indent=2)
+    for result in document["results"]:
+        print(
+            f"{result['scenario']:<32} size={result['size']:<5} "
+            f"{result['throughput']['value']} {result['throughput']['unit']:<11} "
+            f"p50={result['latency_ms']['p50']}ms p95={result['latency_ms']['p95']}ms "
+            f"p99={result['latency_ms']['p99']}ms peak={result['peak_memory_mb']}MB errors={result['errors']}"
+        )
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+
+class StubServer:
+    """
+    Base of the local stand-ins for external APIs: a threaded HTTP server on 127.0.0.1 with
+    configurable response latency (mean plus uniform jitter, in seconds) and error rate,
+    and per-endpoint call counts.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub._dispatch(self, "GET", None)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub._dispatch(self, "POST", json.loads(body) if body else None)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls.clear()
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def _delay(self):
+        with self._lock:
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return failed
+
+    def _dispatch(self, handler, method, body):
+        raise NotImplementedError
+
+    @staticmethod
+    def _send(handler, status, body="", headers=None, content_type="application/json"):
+        payload = body.encode() if isinstance(body, str) else body
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, str(value))
+        handler.send_header("Content-Length", str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+
+class DeepSeekStub(StubServer):
+    """
+    Stand-in for the DeepSeek completions API. Answers batched documentation prompts with a
+    JSON object for every symbol they name, and other prompts with a short completion.
+    `requests_per_second` caps the accepted request rate; requests over it get a 429 with
+    Retry-After, like the real API. Errors are answered with 500s, which the client retries.
+    """
+
+    SYMBOL_PATTERN = re.compile(r"^\s*### \w+ `([^`]+)`", re.MULTILINE)
+
+    def __init__(self, requests_per_second=None, completion_words=40, **options):
+        super().__init__(**options)
+        self.requests_per_second = requests_per_second
+        self.completion_words = completion_words
+        self._window = (0, 0)  # (second, requests accepted in it)
+
+    def _over_rate_limit(self):
+        if not self.requests_per_second:
+            return False
+        second = int(time.time())
+        with self._lock:
+            start, accepted = self._window
+            if start != second:
+                start, accepted = second, 0
+            if accepted >= self.requests_per_second:
+                return True
+            self._window = (start, accepted + 1)
+        return False
+
+    def _dispatch(self, handler, method, body):
+        if method != "POST" or not handler.path.rstrip("/").endswith("/completions"):
+            self._count("not_found")
+            self._send(handler, 404, "{}")
+            return
+        if self._over_rate_limit():
+            self._count("rate_limited")
+            self._send(handler, 429, '{"error": "rate limited"}', {"Retry-After": "1"})
+            return
+        if self._delay():
+            self._count("error")
+            self._send(handler, 500, '{"error": "stub failure"}')
+            return
+        names = self.SYMBOL_PATTERN.findall(body["prompt"])
+        if names:
+            self._count("completion_batch")
+            text = json.dumps({
+                name: {"explanation": self._words(f"{name} does"), "example": f"{name.rsplit('.', 1)[-1]}()"}
+                for name in names
+            })
+        else:
+            self._count("completion")
+            text = self._words("This code")
+        if body.get("stream"):
+            self._stream(handler, text)
+            return
+        usage = {"prompt_tokens": len(body["prompt"]) // 4, "completion_tokens": len(text) // 4}
+        self._send(handler, 200, json.dumps({"choices": [{"text": text}], "usage": usage}))
+
+    def _words(self, prefix):
+        return prefix + " " + " ".join("work" for _ in range(self.completion_words)) + "."
+
+    def _stream(self, handler, text):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        for position in range(0, len(text), 20):
+            chunk = {"choices": [{"text": text[position:position + 20]}]}
+            handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        handler.wfile.write(b"data: [DONE]\n\n")
+
+
+class GitHubStub(StubServer):
+    """
+    Stand-in for the GitHub REST API and raw file host. `repos` maps "owner/repo" to
+    {path: content}, served at one commit per repository on the "main" branch. API responses
+    carry X-RateLimit-* headers for a budget of `rate_limit` requests per `rate_limit_window`
+    seconds, and are refused with 403 once it is used up. Errors are answered with 502s.
+    Raw downloads are served from {base_url}/raw and don't count against the budget.
+    """
+
+    def __init__(self, repos=None, rate_limit=5000, rate_limit_window=3600, **options):
+        super().__init__(**options)
+        self.repos = {}
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self._budget = (0.0, 0)  # (reset time, requests used)
+        for name, files in (repos or {}).items():
+            self.add_repo(name, files)
+
+    @property
+    def raw_url(self):
+        return f"{self.base_url}/raw"
+
+    def add_repo(self, name, files):
+        commit = hashlib.sha1(json.dumps(files, sort_keys=True).encode()).hexdigest()
+        with self._lock:
+            self.repos[name] = {"files": dict(files), "commit": commit}
+
+    def reset_counts(self):
+        super().reset_counts()
+        with self._lock:
+            self._budget = (0.0, 0)
+
+    def _use_budget(self):
+        """
+        Count an API request; returns (allowed, rate-limit headers).
+        """
+        now = time.time()
+        with self._lock:
+            reset, used = self._budget
+            if now >= reset:
+                reset, used = now + self.rate_limit_window, 0
+            allowed = used < self.rate_limit
+            if allowed:
+                used += 1
+            self._budget = (reset, used)
+        headers = {
+            "X-RateLimit-Limit": self.rate_limit,
+            "X-RateLimit-Remaining": self.rate_limit - used,
+            "X-RateLimit-Reset": int(reset) + 1,
+            "X-RateLimit-Resource": "core"
+        }
+        return allowed, headers
+
+    def _dispatch(self, handler, method, body):
+        path = unquote(handler.path.split("?", 1)[0])
+        if path.startswith("/raw/"):
+            self._raw(handler, path[len("/raw/"):])
+            return
+        allowed, headers = self._use_budget()
+        if not allowed:
+            self._count("rate_limited")
+            self._send(handler, 403, '{"message": "API rate limit exceeded"}', headers)
+            return
+        if self._delay():
+            self._count("error")
+            self._send(handler, 502, '{"message": "stub failure"}', headers)
+            return
+        match = re.fullmatch(r"/repos/([^/]+/[^/]+)(/commits/[^/]+|/git/trees/[0-9a-f]+)?", path)
+        repo = self.repos.get(match.group(1)) if match else None
+        if repo is None:
+            self._count("not_found")
+            self._send(handler, 404, '{"message": "Not Found"}', headers)
+            return
+        suffix = match.group(2) or ""
+        if not suffix:
+            self._count("repo")
+            self._send(handler, 200, json.dumps({"default_branch": "main"}), headers)
+        elif suffix.startswith("/commits/"):
+            self._count("commit")
+            etag = f'"{repo["commit"]}"'
+            if handler.headers.get("If-None-Match") == etag:
+                self._send(handler, 304, "", headers)
+            else:
+                self._send(handler, 200, repo["commit"], dict(headers, ETag=etag), content_type="text/plain")
+        else:
+            self._count("tree")
+            tree = [
+                {"path": name, "type": "blob", "sha": hashlib.sha1(code.encode()).hexdigest(), "size": len(code)}
+                for name, code in repo["files"].items()
+            ]
+            self._send(handler, 200, json.dumps({"tree": tree, "truncated": False}), headers)
+
+    def _raw(self, handler, path):
+        owner, name, commit, file_path = (path.split("/", 3) + [""] * 4)[:4]
+        repo = self.repos.get(f"{owner}/{name}")
+        if self._delay():
+            self._count("error")
+            self._send(handler, 502, "stub failure", content_type="text/plain")
+            return
+        if repo is None or repo["commit"] != commit or file_path not in repo["files"]:
+            self._count("not_found")
+            self._send(handler, 404, "Not Found", content_type="text/plain")
+            return
+        self._count("raw")
+        self._send(handler, 200, repo["files"][file_path], content_type="text/plain")
@@ -0,0 +1,51 @@
+import random
+
+# Function bodies the generator picks from; {a}/{b} are argument names and {n} a constant
+_BODIES = [
+    "    total = {a}\n    for step in range({n}):\n        total += {b} * step\n    return total\n",
+    "    if {a} > {n}:\n        return {a} - {b}\n    return {b} + {n}\n",
+    "    values = [{a} * index for index in range({n})]\n    return sum(values) + {b}\n",
+    "    try:\n        return {a} / ({b} + {n})\n    except ZeroDivisionError:\n        return None\n",
+    "    result = {{}}\n    for key in range({n}):\n        result[key] = ({a}, {b})\n    return result\n",
+]
+
+
+def make_module(index, functions=3, methods=2, rng=None, duplicate_ratio=0.1):
+    """
+    Return the source of one synthetic module: `functions` functions and a class with
+    `methods` methods. About `duplicate_ratio` of the functions repeat an earlier one
+    under a new name, like the copy-pasted helpers of real repositories.
+    """
+    rng = rng or random.Random(index)
+    lines = [f'"""Synthetic module {index}."""\n', "import math\n\n"]
+    bodies = []
+    for position in range(functions):
+        if bodies and rng.random() < duplicate_ratio:
+            body = rng.choice(bodies)
+        else:
+            body = rng.choice(_BODIES).format(a="left", b="right", n=rng.randint(2, 10_000))
+            bodies.append(body)
+        lines.append(f"\ndef function_{index}_{position}(left, right):\n{body}\n")
+    lines.append(f"\nclass Model{index}:\n    def __init__(self, size):\n        self.size = size\n")
+    for position in range(methods):
+        body = rng.choice(_BODIES).format(a="self.size", b="value", n=rng.randint(2, 10_000))
+        body = "\n".join("    " + line if line else line for line in body.split("\n"))
+        lines.append(f"\n    def method_{position}(self, value):\n{body}")
+    return "".join(lines)
+
+
+def make_repo(files, functions=3, methods=2, seed=0, duplicate_ratio=0.1):
+    """
+    Return {path: source} for a synthetic package of `files` Python modules spread over a few
+    subpackages, plus the non-Python files a repository usually has.
+    """
+    rng = random.Random(seed)
+    repo = {"README.md": "# Synthetic repository\n", "setup.py": "from setuptools import setup\n\nsetup(name='synthetic')\n"}
+    for index in range(files):
+        package = f"pkg/sub{index % 4}"
+        # Distinct contents, so the files don't share a blob and each is downloaded exactly once
+        repo.setdefault(f"{package}/__init__.py", f'"""Subpackage {index % 4}."""\n')
+        repo[f"{package}/module_{index}.py"] = make_module(
+            index, functions=functions, methods=methods, rng=rng, duplicate_ratio=duplicate_ratio
+        )
+    return repo
@@ -0,0 +1,21 @@
+import multiprocessing
+import os
+
+# Serve on the platform's $PORT (Heroku-style) or 8000
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Worker processes share rate limits, caches and job state through the files under .cache/
+# (see RATELIMIT_STORAGE_URI, LLM_CACHE_PATH and JOBS_DIR), so throughput scales with workers
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+
+# Threaded workers keep serving while requests wait on DeepSeek or stream server-sent events
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# Long documentation requests run synchronously unless "async" is set
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.utils import github_api
+from app.utils.github_api import set_github_client
+from app.utils.llm_cache import LLMCache, set_llm_cache
+from app.utils.llm_client import LLMClient, set_llm_client
+from app.utils.metrics import set_metrics_state
+from app.utils.shared_storage import SharedState
+from app.utils.snapshot_store import SnapshotStore, set_snapshot_store
+
+@pytest.fixture(autouse=True)
+def metrics_state():
+    """
+    Publish worker metrics to an in-memory state instead of the working tree's .cache.
+    """
+    state = SharedState(None)
+    set_metrics_state(state)
+    yield state
+    set_metrics_state(None)
+
+@pytest.fixture
+def deepseek_stub():
+    """
+    Local stand-in for the DeepSeek completions API. Queue (status, headers) tuples in
+    `failures` to make the next requests fail before it answers normally. Streaming
+    requests get the completion split into `stream_chunks` server-sent events, and
+    `stream_aborted` is set if the client hangs up before the end. Set `responder` to a
+    function of the request body to answer with custom completion text.
+    """
+    state = {
+        "requests": [], "failures": [], "stream_chunks": None, "stream_delay": 0, "stream_aborted": False,
+        "responder": None
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            state["requests"].append(body)
+            if state["failures"]:
+                status, headers = state["failures"].pop(0)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            text = f" completion #{len(state['requests'])} "
+            if state["responder"]:
+                text = state["responder"](body)
+            if body.get("stream"):
+                self._stream(text)
+                return
+            usage = {"prompt_tokens": len(body["prompt"]) // 4, "completion_tokens": 3}
+            payload = json.dumps({"choices": [{"text": text}], "usage": usage}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _stream(self, text):
+            chunks = state["stream_chunks"] or [" completion", text[len(" completion"):]]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            try:
+                for chunk in chunks:
+                    self.wfile.write(f"data: {json.dumps({'choices': [{'text': chunk}]})}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(state["stream_delay"])
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                state["stream_aborted"] = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    set_llm_cache(LLMCache(path=None))
+    set_llm_client(LLMClient(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}", backoff_base=0.01))
+    yield state
+    set_llm_client(None)
+    set_llm_cache(None)
+    server.shutdown()
+
+REPO_FILES = {
+    "setup.py": "from setuptools import setup\n",
+    "pkg/__init__.py": "",
+    "pkg/core.py": "def add(a, b):\n    return a + b\n",
+    "pkg/sub/util.py": "class Helper:\n    pass\n",
+    "README.md": "# readme\n"
+}
+
+@pytest.fixture
+def github_stub(monkeypatch, tmp_path):
+    """
+    Local stand-in for the GitHub REST API and raw file host serving `files` at `commit`.
+    Ref lookups carry an ETag and answer If-None-Match with 304. Queue (status, headers, body)
+    tuples in `failures` to fail the next requests, and put X-RateLimit-* headers in
+    `rate_limit` to send them with every response.
+    """
+    state = {"requests": [], "files": dict(REPO_FILES), "commit": "c0ffee" + "0" * 34, "failures": [], "rate_limit": {}}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["requests"].append(self.path)
+            if state["failures"]:
+                status, headers, body = state["failures"].pop(0)
+                self._send(body, status, headers)
+                return
+            path = self.path.split("?")[0]
+            if path == "/repos/octo/demo":
+                self._send(json.dumps({"default_branch": "main"}))
+            elif path == "/repos/octo/demo/commits/main":
+                etag = '"%s"' % state["commit"]
+                if self.headers.get("If-None-Match") == etag:
+                    self._send("", 304)
+                else:
+                    self._send(state["commit"], headers={"ETag": etag})
+            elif path == f"/repos/octo/demo/git/trees/{state['commit']}":
+                tree = [{"path": name, "type": "blob", "sha": hashlib.sha1(code.encode()).hexdigest(), "size": len(code)}
+                        for name, code in state["files"].items()]
+                self._send(json.dumps({"tree": tree, "truncated": False}))
+            elif path.startswith(f"/raw/octo/demo/{state['commit']}/"):
+                self._send(state["files"][path.split(f"{state['commit']}/", 1)[1]])
+            else:
+                self._send("", 404)
+
+        def _send(self, body, status=200, headers=None):
+            payload = body.encode()
+            self.send_response(status)
+            for name, value in dict(state["rate_limit"], **(headers or {})).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    set_github_client(github_api.GitHubClient(secondary_backoff=0.01, max_wait=5, state=SharedState(None)))
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(github_api, "GITHUB_API_URL", base_url)
+    monkeypatch.setattr(github_api, "GITHUB_RAW_URL", f"{base_url}/raw")
+    set_snapshot_store(SnapshotStore(str(tmp_path / "snapshots")))
+    yield state
+    set_github_client(None)
+    set_snapshot_store(None)
+    server.shutdown()
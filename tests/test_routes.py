@@ -1,16 +1,28 @@
+import json
 import os
 import sys
+import threading
+import time
 import pytest
-from app import create_app
+from app import create_app, routes
+from app.utils.jobs import JobManager
+from app.utils.llm_cache import LLMCache, set_llm_cache
+from app.utils.response_cache import ResponseCache, set_response_cache
+from app.utils.shared_storage import SharedState
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 @pytest.fixture
-def client():
-    app = create_app()
-    app.config['TESTING'] = True
+def client(tmp_path):
+    # Keep rate-limit counters per test instead of in the shared SQLite file
+    app = create_app({"TESTING": True, "RATELIMIT_STORAGE_URI": "memory://"})
+    set_response_cache(ResponseCache(path=str(tmp_path / "route_cache.sqlite")))
+    # ...and completions in memory, so no test writes to the working tree's .cache
+    set_llm_cache(LLMCache(path=None))
     with app.test_client() as client:
         yield client
+    set_llm_cache(None)
+    set_response_cache(None)
 
 def test_home_route(client):
     response = client.get('/')
@@ -24,4 +36,332 @@ def test_generate_docstring_route(client):
 def test_check_docs_route(client):
     response = client.post("/check-docs", json={"code": "def add(a, b): return a + b", "docs": "Old documentation"})
     assert response.status_code == 200
-    assert "Documentation is outdated" in response.json["message"]
\ No newline at end of file
+    assert "Documentation is outdated" in response.json["message"]
+
+def test_check_docs_target_stays_inside_docs_folder(client, monkeypatch, tmp_path):
+    monkeypatch.setattr("app.utils.docs_writer.DOCS_DIR", str(tmp_path / "docs"))
+    (tmp_path / "secret.manifest.json").write_text("{}")
+    for target in ("../secret.md", str(tmp_path / "secret.md")):
+        response = client.post("/check-docs", json={"code": "def a(): pass", "docs": "", "target": target})
+        assert response.status_code == 403
+
+def test_parse_file_route_uses_symbol_index(client, monkeypatch):
+    monkeypatch.setattr(routes, "download_file_contents", lambda url: "class A:\n    def run(self):\n        pass\n")
+    response = client.post("/parse-file", json={"download_url": "https://example.com/a.py"})
+    assert response.status_code == 200
+    assert response.json["functions"] == []
+    assert response.json["classes"][0]["methods"] == ["run"]
+
+
+def test_parse_file_coalesces_identical_requests_and_revalidates(client, monkeypatch):
+    from app.utils.response_cache import get_response_cache
+    release = threading.Event()
+    downloads = []
+
+    def slow_download(url):
+        downloads.append(url)
+        release.wait(5)
+        return "def run():\n    pass\n"
+
+    monkeypatch.setattr(routes, "download_file_contents", slow_download)
+    body = {"download_url": "https://example.com/a.py", "ref": "main"}
+    responses = []
+    threads = [
+        threading.Thread(target=lambda: responses.append(client.application.test_client().post("/parse-file", json=body)))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for _ in range(500):
+        if get_response_cache().stats()["coalesced"] == 2:
+            break
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(downloads) == 1
+    assert sorted(response.headers["X-Cache"] for response in responses) == ["COALESCED", "COALESCED", "MISS"]
+    assert len({response.data for response in responses}) == 1 and responses[0].json["functions"][0]["name"] == "run"
+
+    # Key order doesn't matter; a cached response is revalidated with its ETag
+    cached = client.post("/parse-file", json={"ref": "main", "download_url": "https://example.com/a.py"})
+    assert cached.headers["X-Cache"] == "HIT" and cached.headers["ETag"] == responses[0].headers["ETag"]
+    revalidated = client.post("/parse-file", json=body, headers={"If-None-Match": cached.headers["ETag"]})
+    assert revalidated.status_code == 304 and revalidated.data == b""
+    assert client.post("/parse-file", json=dict(body, no_cache=True)).status_code == 200
+    assert len(downloads) == 2
+    assert client.get("/route-cache/stats").json["hits"] == 2
+
+def test_shared_generate_docstring_responses_report_no_usage(client, deepseek_stub):
+    body = {"code": "def a():\n    pass\n"}
+    first = client.post("/generate-docstring", json=body)
+    second = client.post("/generate-docstring", json=body)
+    assert (first.headers["X-Cache"], second.headers["X-Cache"]) == ("MISS", "HIT")
+    assert first.json["usage"]["calls"] == 1 and "shared" not in first.json["usage"]
+    assert second.json["usage"]["calls"] == second.json["usage"]["prompt_tokens"] == 0
+    assert second.json["usage"]["shared"] == "hit"
+    assert first.json["docstring"] == second.json["docstring"] and first.headers["ETag"] == second.headers["ETag"]
+
+
+def test_generate_repo_docs_async_job(client, monkeypatch, tmp_path):
+    release = threading.Event()
+    runs = []
+
+    def fake_generate_repo_docs(owner, repo, ref=None, manifest=None, progress=None, writer=None):
+        runs.append((owner, repo, ref))
+        progress(files_total=2)
+        progress(files_processed=1, symbols_processed=3)
+        release.wait(5)
+        writer.write("# API Documentation\n\n")
+        writer.write_module("pkg/core.py", "## `pkg/core.py`\n\n### Functions\n\n#### `add`\nAdds.\n\n")
+        manifest["last_run"] = {"reused": 0, "generated": 3}
+
+    monkeypatch.setattr(routes, "generate_repo_docs", fake_generate_repo_docs)
+    monkeypatch.setattr(routes, "load_docs_manifest", lambda filename: {"symbols": {}})
+    monkeypatch.setattr(routes, "save_docs_manifest", lambda manifest, filename: None)
+    monkeypatch.setattr("app.utils.jobs.JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr("app.utils.docs_writer.DOCS_DIR", str(tmp_path / "docs"))
+    state = SharedState(str(tmp_path / "state.sqlite"))
+    monkeypatch.setattr("app.utils.jobs._manager", JobManager(state=state))
+
+    payload = {"owner": "octo", "repo": "demo", "async": True}
+    first = client.post("/generate-repo-docs", json=payload)
+    second = client.post("/generate-repo-docs", json=payload)
+    assert first.status_code == second.status_code == 202
+    assert second.json["job_id"] == first.json["job_id"] and second.json["deduplicated"]
+
+    for _ in range(100):
+        status = client.get(first.json["status_url"]).json
+        if status["symbols_processed"]:
+            break
+        time.sleep(0.01)
+    assert status["status"] == "running"
+    assert (status["files_total"], status["files_processed"], status["symbols_processed"]) == (2, 1, 3)
+    assert status["eta_seconds"] is not None
+
+    release.set()
+    for _ in range(100):
+        status = client.get(first.json["status_url"]).json
+        if status["status"] != "running":
+            break
+        time.sleep(0.01)
+    assert status["status"] == "succeeded"
+    assert runs == [("octo", "demo", None)]
+    assert status["result"]["pages"]["pages"] == 1
+    artifact = client.get(status["artifact_urls"]["index.md"])
+    assert artifact.status_code == 200
+    assert artifact.data.decode() == "# API Documentation\n\n## Modules\n\n- [`pkg/core.py`](modules/pkg/core.md)\n\n"
+    search = client.get(status["artifact_urls"]["search.json"]).json
+    assert search["symbols"] == [{"name": "add", "module": "pkg/core.py", "url": "modules/pkg/core.html#add"}]
+    assert status["result"]["index_url"] == "/docs/repo_docs/octo/demo/HEAD/index.html"
+    page = client.get("/docs/repo_docs/octo/demo/HEAD/modules/pkg/core.html")
+    assert page.status_code == 200 and b'<h4 id="add"><code>add</code></h4>' in page.data
+    assert client.get("/docs/../app/routes.py").status_code == 404
+    assert client.get("/jobs/unknown").status_code == 404
+
+    # Another worker process only sees the job through its saved status
+    other_worker = JobManager(state=state)
+    assert other_worker.get(first.json["job_id"]).to_dict()["status"] == "succeeded"
+    assert open(other_worker.get(first.json["job_id"]).artifacts["index.md"]).read().startswith("# API Documentation\n")
+
+
+def test_repo_docs_of_different_repositories_keep_separate_folders(client, monkeypatch, tmp_path):
+    def fake_generate_repo_docs(owner, repo, ref=None, manifest=None, progress=None, writer=None):
+        writer.write("# API Documentation\n\n")
+        writer.write_module(f"{repo}.py", f"## `{repo}.py`\n\n")
+        manifest["symbols"][f"{repo}.py::{repo}"] = {"fingerprint": "f", "kind": "function", "body": ""}
+        manifest["last_run"] = {"reused": 0, "generated": 1}
+
+    monkeypatch.setattr(routes, "generate_repo_docs", fake_generate_repo_docs)
+    monkeypatch.setattr("app.utils.docs_writer.DOCS_DIR", str(tmp_path))
+
+    for repo, ref in (("one", None), ("two", "feature/x")):
+        response = client.post("/generate-repo-docs", json={"owner": "octo", "repo": repo, "ref": ref})
+        assert response.status_code == 200, response.json
+    assert response.json["index_url"] == "/docs/repo_docs/octo/two/feature_x/index.html"
+    assert (tmp_path / "repo_docs" / "octo" / "one" / "HEAD" / "modules" / "one.md").exists()
+    manifest = json.loads((tmp_path / "repo_docs" / "octo" / "one" / "HEAD" / "index.manifest.json").read_text())
+    assert list(manifest["symbols"]) == ["one.py::one"]
+
+
+def test_repo_docs_routes_reject_missing_repository(client):
+    for body in ({}, {"owner": "octo"}, {"owner": "octo", "repo": ["demo"]}, {"owner": "octo", "repo": "demo", "ref": 1}):
+        response = client.post("/generate-repo-docs", json=body)
+        assert response.status_code == 400 and "error" in response.json
+    assert client.post("/check-docs", json={"owner": "octo"}).status_code == 400
+
+
+def test_generate_local_docs_from_uploaded_archive(client, deepseek_stub, monkeypatch, tmp_path):
+    import io
+    import zipfile
+    monkeypatch.setattr("app.utils.docs_writer.DOCS_DIR", str(tmp_path / "docs"))
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as bundle:
+        bundle.writestr("project/.gitignore", "generated/\n")
+        bundle.writestr("project/pkg/core.py", "def add(a, b):\n    return a + b\n")
+        bundle.writestr("project/pkg/generated/out.py", "def out():\n    pass\n")
+        bundle.writestr("project/pkg/vendored.py", "def vendored():\n    pass\n")
+    archive.seek(0)
+
+    response = client.post(
+        "/generate-local-docs", content_type="multipart/form-data",
+        data={"archive": (archive, "project.zip"), "exclude": "vendored.py"}
+    )
+    assert response.status_code == 200, response.json
+    assert response.json["pages"]["pages"] == 1
+    search = client.get(response.json["search_url"]).json
+    assert search["modules"] == ["pkg/core.py"] and search["symbols"][0]["name"] == "add"
+
+    # Server paths are only read from inside LOCAL_SOURCE_ROOT
+    assert client.post("/generate-local-docs", json={"path": "."}).status_code == 403
+    monkeypatch.setattr(routes, "LOCAL_SOURCE_ROOT", str(tmp_path))
+    assert client.post("/generate-local-docs", json={"path": "../"}).status_code == 403
+    assert client.post("/generate-local-docs", json={"path": "missing"}).status_code == 404
+
+
+def test_chatbot_streams_server_sent_events(client, deepseek_stub):
+    response = client.post("/chatbot", json={"input": "What does f do?", "code": "def f(): pass", "stream": True})
+    assert response.mimetype == "text/event-stream"
+    body = response.get_data(as_text=True)
+    assert body.startswith('data: {"token": "completion"}')
+    done = json.loads(body.rsplit("event: done\ndata: ", 1)[1])
+    assert done["usage"]["by_call_type"]["chat"]["calls"] == 1
+    assert done["usage"]["completion_tokens"] > 0
+
+    # Non-streaming clients keep the JSON response (served from cache here)
+    response = client.post("/chatbot", json={"input": "What does f do?", "code": "def f(): pass"})
+    assert response.json["response"] == "completion #1"
+    assert response.json["usage"]["cached_calls"] == 1
+    assert response.json["usage"]["prompt_tokens"] == 0
+
+
+def test_explain_code_reports_token_usage(client, deepseek_stub):
+    response = client.post("/explain-code", json={"code": "def f(): pass", "query": "What does f do?"})
+    usage = response.json["usage"]
+    assert usage["by_call_type"]["explain"] == {
+        "calls": 1, "cached_calls": 0,
+        "prompt_tokens": len(deepseek_stub["requests"][0]["prompt"]) // 4, "completion_tokens": 3
+    }
+    assert deepseek_stub["requests"][0]["max_tokens"] == 200
+
+
+def test_generate_docstrings_batch_skips_documented_symbols(client, deepseek_stub):
+    code = (
+        "def undocumented(a):\n    return a\n\n"
+        "def documented(b):\n    \"\"\"Already there.\"\"\"\n    return b\n\n"
+        "class Box:\n    def open(self):\n        pass\n"
+    )
+    response = client.post("/generate-docstrings", json={"code": code})
+    assert [result["name"] for result in response.json["results"]] == ["undocumented", "Box", "Box.open"]
+    assert response.json["succeeded"] == 3 and response.json["failed"] == 0
+
+    response = client.post("/generate-docstrings", json={"code": code, "force": True})
+    assert "documented" in [result["name"] for result in response.json["results"]]
+
+
+def test_generate_docstrings_batch_reports_per_item_errors(client, deepseek_stub):
+    deepseek_stub["failures"].append((400, {}))
+    response = client.post("/generate-docstrings", json={"items": ["def a(): pass"], "no_cache": True})
+    assert response.json["results"] == [{"index": 0, "error": "DeepSeek request failed: 400"}]
+
+    response = client.post("/improve-docstrings", json={"items": ["Does a thing.", {"docstring": "Does b."}]})
+    assert response.json["failed"] == 0
+    assert [result["index"] for result in response.json["results"]] == [0, 1]
+    assert all(result["improved_docstring"].startswith("completion #") for result in response.json["results"])
+
+
+def test_generate_docstrings_batch_rejects_malformed_and_oversized_batches(client, monkeypatch):
+    response = client.post("/generate-docstrings", json={"items": ["def a(): pass", 42]})
+    assert response.status_code == 400 and response.json["error"] == "Item 1 must be a string or an object"
+    response = client.post("/improve-docstrings", json={"items": [{"docstring": "Does a."}, {"context": "def b(): pass"}]})
+    assert response.status_code == 400 and response.json["error"] == 'Item 1 must have a "docstring" string'
+    response = client.post("/improve-docstrings", json={"code": "def a():\n    return (\n"})
+    assert response.status_code == 400 and "line" in response.json["error"]
+
+    monkeypatch.setattr(routes, "DOCSTRING_BATCH_MAX_ITEMS", 2)
+    code = "def a():\n    pass\n\ndef b():\n    pass\n\ndef c():\n    pass\n"
+    assert client.post("/generate-docstrings", json={"code": code}).status_code == 400
+    assert client.post("/improve-docstrings", json={"items": ["a", "b", "c"]}).status_code == 400
+
+
+def test_compare_ai_route_uses_selected_providers(client, monkeypatch):
+    stub = lambda code, timeout: {"text": "stub docs", "prompt_tokens": 1, "completion_tokens": 2}
+    monkeypatch.setitem(routes.PROVIDERS, "claude", stub)
+
+    response = client.post("/compare-ai", json={"code": "x = 1", "providers": ["claude"], "timeout": 5})
+    assert response.json["claude"] == "stub docs"
+    assert response.json["metrics"]["claude"]["status"] == "ok"
+    assert "deepseek" not in response.json
+
+    response = client.post("/compare-ai", json={"code": "x = 1", "providers": ["bard"]})
+    assert response.status_code == 400
+
+
+def test_metrics_and_trace_spans(client, deepseek_stub):
+    response = client.post(
+        "/explain-code", json={"code": "def f(): pass", "query": "What does f do?", "no_cache": True},
+        headers={"X-Trace": "1"}
+    )
+    assert "llm;dur=" in response.headers["Server-Timing"]
+    assert "Server-Timing" not in client.post("/explain-code", json={"code": "def f(): pass", "query": "Why?"}).headers
+
+    metrics = client.get("/metrics").get_data(as_text=True)
+    assert 'llm_requests_total{call_type="explain",outcome="ok"}' in metrics
+    assert 'http_request_duration_seconds_count{route="/explain-code",method="POST",status="200"}' in metrics
+    assert 'pipeline_stage_duration_seconds_bucket{stage="llm",le="+Inf"}' in metrics
+    assert 'cache_hit_ratio{cache="llm"}' in metrics
+
+
+def test_rate_limits_use_the_configured_storage(tmp_path):
+    app = create_app({"TESTING": True, "RATELIMIT_STORAGE_URI": f"sqlite:///{tmp_path / 'limits.sqlite'}"})
+    client = app.test_client()
+    statuses = [client.post("/compare-ai", json={"providers": ["bard"]}).status_code for _ in range(6)]
+    assert statuses == [400] * 5 + [429]
+    assert (tmp_path / "limits.sqlite").exists()
+
+
+def test_rate_limits_key_on_the_forwarded_client_address():
+    app = create_app({"TESTING": True, "RATELIMIT_STORAGE_URI": "memory://", "PROXY_COUNT": 1})
+    client = app.test_client()
+
+    def post(address):
+        return client.post("/compare-ai", json={"providers": ["bard"]}, headers={"X-Forwarded-For": address}).status_code
+
+    assert [post("203.0.113.1") for _ in range(6)] == [400] * 5 + [429]
+    assert post("203.0.113.2") == 400
+
+
+def test_job_keys_are_deduplicated_across_worker_processes(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.utils.jobs.JOBS_DIR", str(tmp_path / "jobs"))
+    state = SharedState(str(tmp_path / "state.sqlite"))
+    # Two managers on one state file behave like two gunicorn workers
+    workers = [JobManager(state=state), JobManager(state=state)]
+    release = threading.Event()
+
+    job, created = workers[0].submit(("repo-docs", "octo", "demo"), lambda job: release.wait(5))
+    other, other_created = workers[1].submit(("repo-docs", "octo", "demo"), lambda job: None)
+    assert created and not other_created and other.id == job.id
+    assert sorted(os.listdir(tmp_path / "jobs")) == [job.id]
+
+    release.set()
+    for _ in range(100):
+        if workers[0].get(job.id).status == "succeeded":
+            break
+        time.sleep(0.01)
+    rerun, created = workers[1].submit(("repo-docs", "octo", "demo"), lambda job: None)
+    assert created and rerun.id != job.id
+    for _ in range(100):
+        if workers[1].get(rerun.id).finished_at is not None:
+            break
+        time.sleep(0.01)
+    assert workers[1].get(rerun.id).status == "succeeded"
+
+
+def test_llm_calls_are_scheduled_for_the_forwarded_client(monkeypatch):
+    from app.utils.llm_scheduler import _caller
+    callers = []
+    monkeypatch.setattr(routes, "compare_ai_tools", lambda code, providers=None, timeouts=None: callers.append(_caller.get()) or {})
+    app = create_app({"TESTING": True, "RATELIMIT_STORAGE_URI": "memory://", "PROXY_COUNT": 1})
+    app.test_client().post("/compare-ai", json={"code": "x = 1"}, headers={"X-Forwarded-For": "203.0.113.7"})
+    assert callers == ["203.0.113.7"]
@@ -0,0 +1,949 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.utils import docstring_generator
+from app.utils import code_parser, github_api, prompt_builder, query_handler, retrieval
+from app.utils.llm_cache import LLMCache
+from app.utils.llm_client import LLMError, get_llm_client, track_usage
+
+SAMPLE_CODE = '''
+def first(a):
+    return a
+
+def second(b):
+    return b
+
+class Third:
+    def method(self):
+        pass
+'''
+
+@pytest.fixture
+def separate_prompts(monkeypatch):
+    """
+    Ask the explanation and example questions one call at a time, as the explain_code fakes expect.
+    """
+    monkeypatch.setattr(docstring_generator, "DOCS_BATCH_PROMPTS", False)
+
+def test_generate_markdown_docs_keeps_symbol_order(monkeypatch, separate_prompts):
+    def fake_explain_code(code, query, **kwargs):
+        # Finish the earliest symbols last to make sure output order doesn't follow completion order
+        time.sleep(0.05 if "first" in query else 0)
+        return f"answer for {query}"
+
+    monkeypatch.setattr(docstring_generator, "explain_code", fake_explain_code)
+    docs = docstring_generator.generate_markdown_docs(SAMPLE_CODE, max_workers=4)
+
+    assert docs.index("### `first`") < docs.index("### `second`") < docs.index("### `Third`")
+    assert "What does the function `first` do?" in docs
+    assert "Provide an example usage for the class `Third`." in docs
+
+def test_generate_markdown_docs_reports_symbol_failures(monkeypatch, separate_prompts):
+    def fake_explain_code(code, query, **kwargs):
+        if "second" in query:
+            raise Exception("Failed to generate explanation: 500")
+        return "ok"
+
+    monkeypatch.setattr(docstring_generator, "explain_code", fake_explain_code)
+    docs = docstring_generator.generate_markdown_docs(SAMPLE_CODE, max_workers=2)
+
+    assert "**Error:** Failed to generate documentation for `second`" in docs
+    assert "### `Third`" in docs
+    assert docs.count("**Explanation:** ok") == 2  # first and Third; methods aren't listed as functions
+
+def test_llm_cache_serves_repeated_prompts_from_disk(tmp_path):
+    payload = {"model": "deepseek-chat", "prompt": "Explain", "max_tokens": 200, "temperature": 0.7}
+    calls = []
+
+    def create():
+        calls.append(1)
+        return "answer"
+
+    cache = LLMCache(path=str(tmp_path / "cache.sqlite"))
+    assert cache.get_or_create(payload, create) == "answer"
+    assert cache.get_or_create(payload, create) == "answer"
+
+    # A fresh instance has an empty memory tier, so this hit comes from SQLite
+    reopened = LLMCache(path=str(tmp_path / "cache.sqlite"))
+    assert reopened.get_or_create(payload, create) == "answer"
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    cache.get_or_create(payload, create, bypass=True)
+    assert len(calls) == 2
+
+def test_llm_cache_evicts_by_age_and_size(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "cache.sqlite"), memory_entries=1, max_entries=2, max_age=60)
+    for key in ["a", "b", "c"]:
+        cache.set(key, key.upper())
+    cache._evict()
+    assert cache.stats()["disk_entries"] == 2
+    assert cache.stats()["memory_entries"] == 1
+
+    expired = LLMCache(path=str(tmp_path / "cache.sqlite"), max_age=-1)
+    assert expired.stats()["disk_entries"] == 0
+
+def test_llm_client_retries_rate_limits(deepseek_stub):
+    deepseek_stub["failures"] = [(429, {"Retry-After": "0"}), (503, {})]
+    assert query_handler.explain_code("def f(): pass", "What does f do?") == "completion #3"
+    assert deepseek_stub["requests"][0]["model"] == "deepseek-chat"
+
+    # Cached: no further round-trip
+    assert query_handler.explain_code("def f(): pass", "What does f do?") == "completion #3"
+    assert len(deepseek_stub["requests"]) == 3
+
+def test_llm_client_gives_up_on_client_errors(deepseek_stub):
+    deepseek_stub["failures"] = [(401, {})]
+    with pytest.raises(LLMError) as excinfo:
+        docstring_generator.generate_docstring("def f(): pass")
+    assert excinfo.value.status_code == 401
+    assert len(deepseek_stub["requests"]) == 1
+
+
+def test_llm_retry_does_not_wait_past_the_deadline(deepseek_stub):
+    from app.utils.llm_client import LLMError, deadline, get_llm_client
+
+    deepseek_stub["failures"].append((429, {"Retry-After": "5"}))
+    start = time.monotonic()
+    with deadline(1), pytest.raises(LLMError, match="deadline exceeded"):
+        get_llm_client().complete("prompt", max_tokens=5)
+    assert time.monotonic() - start < 0.5 and len(deepseek_stub["requests"]) == 1
+
+def test_circuit_breaker_opens_and_recovers_through_probes():
+    from app.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+    breaker = CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, open_seconds=0.05, half_open_probes=1)
+    for success in (True, True, False, False):
+        breaker.before_call()
+        breaker.record(success, 0.01)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()  # the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(True, 0.01)
+    assert breaker.stats()["state"] == "closed" and breaker.stats()["rejected_calls"] == 2
+
+    # Calls slower than the threshold count against it too
+    slow = CircuitBreaker(window=2, min_calls=2, slow_call_seconds=1, slow_call_rate=1.0)
+    slow.record(True, 2)
+    slow.record(True, 3)
+    assert slow.state == "open"
+
+def test_llm_client_fails_fast_while_the_circuit_is_open(deepseek_stub):
+    from app.utils.circuit_breaker import CircuitBreaker
+    from app.utils.llm_client import LLMClient, set_llm_client
+
+    client = LLMClient(api_key="test", base_url=get_llm_client().base_url, max_retries=1, backoff_base=0.01,
+                       breaker=CircuitBreaker(window=2, min_calls=2, open_seconds=60))
+    set_llm_client(client)
+    deepseek_stub["failures"] = [(503, {}), (503, {})]
+    with pytest.raises(LLMError, match="503"):
+        query_handler.explain_code("def f(): pass", "Why?", use_cache=False)
+    with pytest.raises(LLMError, match="circuit open"):
+        query_handler.explain_code("def f(): pass", "Why?", use_cache=False)
+    assert len(deepseek_stub["requests"]) == 2
+    assert client.stats()["circuit"]["state"] == "open"
+
+def test_llm_client_hedges_slow_interactive_requests(deepseek_stub):
+    from app.utils.llm_client import LLMClient, set_llm_client
+    from app.utils.llm_scheduler import BULK
+
+    def responder(body):
+        if len(deepseek_stub["requests"]) == 1:
+            time.sleep(0.5)  # the first request stalls
+        return f"completion #{len(deepseek_stub['requests'])}"
+
+    deepseek_stub["responder"] = responder
+    client = LLMClient(api_key="test", base_url=get_llm_client().base_url, hedge=True, hedge_min_delay=0.05)
+    client._latencies.extend([0.01] * 20)
+    set_llm_client(client)
+    assert query_handler.explain_code("def f(): pass", "Why?", use_cache=False) == "completion #2"
+    assert client.stats()["hedging"]["hedge_won"] == 1 and client.stats()["hedging"]["win_rate"] == 1.0
+
+    # Bulk calls are never hedged
+    deepseek_stub["requests"].clear()
+    query_handler.explain_code("def g(): pass", "Why?", use_cache=False, priority=BULK)
+    assert client.stats()["hedging"]["sent"] == 1
+
+def test_fetch_repo_contents_lists_tree_in_one_request(github_stub):
+    files = github_api.fetch_repo_contents("octo", "demo")
+    assert sorted(file["path"] for file in files) == sorted(github_stub["files"])
+    assert [path for path in github_stub["requests"] if "/git/trees/" in path] == [f"/repos/octo/demo/git/trees/{github_stub['commit']}?recursive=1"]
+    assert github_api.fetch_repo_contents("octo", "demo", path="pkg/sub")[0]["name"] == "util.py"
+
+def test_fetch_and_process_repo_downloads_python_files(github_stub):
+    code = github_api.fetch_and_process_repo("octo", "demo", max_workers=4)
+    assert "# File: pkg/core.py" in code
+    assert "class Helper" in code
+    assert "readme" not in code
+    assert sum(path.startswith("/raw/") for path in github_stub["requests"]) == 4
+
+def test_fetch_and_process_repo_reuses_snapshots(github_stub):
+    first = github_api.fetch_and_process_repo("octo", "demo")
+    github_stub["requests"].clear()
+
+    # Same commit: only the conditional ref lookups hit the API, and they come back 304
+    assert github_api.fetch_and_process_repo("octo", "demo") == first
+    assert not any(path.startswith("/raw/") or "/git/trees/" in path for path in github_stub["requests"])
+
+    # New commit with one changed file: only that blob is downloaded
+    github_stub["commit"] = "beef" + "0" * 36
+    github_stub["files"]["pkg/core.py"] = "def add(a, b):\n    return b + a\n"
+    github_stub["requests"].clear()
+    assert "return b + a" in github_api.fetch_and_process_repo("octo", "demo")
+    assert [path for path in github_stub["requests"] if path.startswith("/raw/")] == [f"/raw/octo/demo/{github_stub['commit']}/pkg/core.py"]
+
+def test_snapshot_etags_are_merged_across_worker_processes(tmp_path):
+    from app.utils.snapshot_store import SnapshotStore
+    # Two stores on one folder behave like two gunicorn workers
+    first, second = SnapshotStore(str(tmp_path)), SnapshotStore(str(tmp_path))
+    assert first.get_etag("a") == second.get_etag("a") == (None, None)
+    first.set_etag("a", '"1"', "one")
+    second.set_etag("b", '"2"', "two")
+    assert first.get_etag("b") == ('"2"', "two")
+    assert SnapshotStore(str(tmp_path)).get_etag("a") == ('"1"', "one")
+
+def test_generate_markdown_docs_streams_files_and_skips_bad_ones(monkeypatch, tmp_path, separate_prompts):
+    monkeypatch.setattr(docstring_generator, "explain_code", lambda code, query, **kwargs: "ok")
+    (tmp_path / "good.py").write_text("def good():\n    pass\n")
+    (tmp_path / "bad.py").write_text("def bad(:\n")
+    (tmp_path / "empty.py").write_text("X = 1\n")
+
+    docs = docstring_generator.generate_markdown_docs(str(tmp_path))
+
+    assert f"## `{tmp_path / 'good.py'}`" in docs
+    assert "#### `good`" in docs
+    assert "## Skipped files" in docs and f"- `{tmp_path / 'bad.py'}`: SyntaxError" in docs
+    assert "empty.py" not in docs
+
+def test_generate_repo_docs_streams_repository_files(github_stub, monkeypatch, separate_prompts):
+    monkeypatch.setattr(docstring_generator, "explain_code", lambda code, query, **kwargs: "ok")
+    github_stub["files"]["pkg/broken.py"] = "class (\n"
+
+    docs = docstring_generator.generate_repo_docs("octo", "demo")
+
+    assert docs.index("## `pkg/core.py`") < docs.index("## `pkg/sub/util.py`")
+    assert "#### `Helper`" in docs
+    assert "- `pkg/broken.py`: SyntaxError" in docs
+
+def test_docs_site_writes_module_pages_and_only_rerenders_changed_ones(monkeypatch, tmp_path, separate_prompts):
+    from app.utils.docs_writer import DocsSite
+    monkeypatch.setattr(docstring_generator, "explain_code", lambda code, query, **kwargs: "ok")
+    files = {"pkg/a.py": "def alpha():\n    pass\n", "pkg/b.py": "class Beta:\n    pass\n", "old.py": "def old():\n    pass\n"}
+
+    site = DocsSite("site", directory=str(tmp_path))
+    assert docstring_generator.generate_markdown_docs(list(files.items()), writer=site) is None
+    assert site.close() == {"pages": 3, "rendered": 4, "reused_html": 0, "removed": 0}
+    assert (tmp_path / "site" / "modules" / "pkg" / "a.md").read_text().startswith("## `pkg/a.py`")
+    index = (tmp_path / "site" / "index.md").read_text()
+    assert index.startswith("# API Documentation\n\n## Modules\n\n- [`pkg/a.py`](modules/pkg/a.md)\n")
+    assert '<a href="modules/pkg/b.html">' in (tmp_path / "site" / "index.html").read_text()
+    search = json.loads((tmp_path / "site" / "search.json").read_text())
+    assert {"name": "Beta", "module": "pkg/b.py", "url": "modules/pkg/b.html#beta"} in search["symbols"]
+
+    # Change one module and drop another: only the changed page and the index are rendered again
+    files["pkg/b.py"] = "class Beta:\n    def run(self):\n        pass\n"
+    del files["old.py"]
+    site = DocsSite("site", directory=str(tmp_path))
+    docstring_generator.generate_markdown_docs(list(files.items()), writer=site)
+    assert site.close() == {"pages": 2, "rendered": 2, "reused_html": 1, "removed": 1}
+    assert not (tmp_path / "site" / "modules" / "old.html").exists()
+    assert "run" in (tmp_path / "site" / "modules" / "pkg" / "b.html").read_text()
+
+def test_docs_site_lock_serializes_writers_of_one_root(tmp_path):
+    import threading
+    from app.utils.docs_writer import DocsSite
+    order = []
+
+    def run(name, hold):
+        site = DocsSite("repo", directory=str(tmp_path))
+        with site.lock():
+            order.append(f"{name} start")
+            site.write_module(f"{name}.py", f"## `{name}.py`\n\n")
+            time.sleep(hold)
+            site.close()
+            order.append(f"{name} end")
+        return site
+
+    first = threading.Thread(target=run, args=("a", 0.2))
+    first.start()
+    time.sleep(0.05)
+    second = run("b", 0)
+    first.join()
+
+    assert order == ["a start", "a end", "b start", "b end"]
+    assert json.loads(second.outputs["search.json"])["modules"] == ["b.py"]
+    assert sorted(os.listdir(tmp_path / "repo" / "modules")) == ["b.html", "b.md"]
+
+LOCAL_FILES = {
+    ".gitignore": "build/\n*_pb2.py\n",
+    "setup.cfg": "[metadata]\n",
+    "pkg/core.py": "def add(a, b):\n    return a + b  # local\n",
+    "pkg/big.py": "# " + "x" * 200 + "\n",
+    "pkg/api_pb2.py": "X = 1\n",
+    "pkg/build/gen.py": "def gen():\n    pass\n",
+    "pkg/tests/test_core.py": "def test_add():\n    pass\n",
+    ".git/hooks/hook.py": "def hook():\n    pass\n"
+}
+
+def test_iter_local_indexes_filters_and_parses_directories_and_archives(monkeypatch, tmp_path):
+    import tarfile
+    import zipfile
+    from app.utils import local_source
+    monkeypatch.setattr(local_source, "LOCAL_PARSE_MIN_FILES", 0)
+    monkeypatch.setattr(local_source, "LOCAL_MAX_FILE_BYTES", 100)
+    root = tmp_path / "project"
+    for path, text in LOCAL_FILES.items():
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(text)
+    with tarfile.open(tmp_path / "project.tar.gz", "w:gz") as bundle:
+        bundle.add(root, arcname="project-1234")
+    with zipfile.ZipFile(tmp_path / "project.zip", "w") as bundle:
+        for path, text in LOCAL_FILES.items():
+            bundle.writestr(path, text)
+
+    expected = [("pkg/big.py", None, "File is larger than 100 bytes"), ("pkg/core.py", ["add"], None)]
+    for source, workers in ((root, 2), (tmp_path / "project.tar.gz", 2), (tmp_path / "project.zip", 1)):
+        indexes = local_source.iter_local_indexes(str(source), exclude=["tests/"], max_workers=workers)
+        assert sorted(
+            (path, [symbol.name for symbol in index.symbols] if index else None, error)
+            for path, code, index, error in indexes
+        ) == expected
+
+    # Indexes parsed by the workers are cached for the documentation pipeline
+    skipped = []
+    files = list(local_source.iter_local_files(
+        str(root), include=["pkg/*.py"], max_workers=2, on_error=lambda path, error: skipped.append(path)
+    ))
+    assert [path for path, _ in files] == ["pkg/core.py"] and skipped == ["pkg/big.py"]
+    assert hashlib.sha256(files[0][1].encode("utf-8")).hexdigest() in code_parser._index_cache
+
+PARSER_CODE = '''
+import functools
+
+@functools.cache
+async def fetch(url, *, timeout=5) -> bytes:
+    """Fetch a URL."""
+
+class Store:
+    """Key-value store."""
+
+    def get(self, key):
+        def missing():
+            return None
+        return missing()
+
+    async def aget(self, key):
+        return None
+'''
+
+def test_build_symbol_index_records_symbols_in_one_pass():
+    index = code_parser.build_symbol_index(PARSER_CODE)
+
+    assert [symbol.qualname for symbol in index.symbols] == [
+        "fetch", "Store", "Store.get", "Store.get.<locals>.missing", "Store.aget"
+    ]
+    assert [func.name for func in index.functions] == ["fetch"]
+    fetch = index.functions[0]
+    assert fetch.kind == "async_function"
+    assert fetch.signature == {"name": "fetch", "args": ["url", "timeout"], "returns": "bytes"}
+    assert fetch.source.startswith("@functools.cache\nasync def fetch")
+    assert fetch.docstring == "Fetch a URL."
+
+    store = index.classes[0]
+    assert store.methods == ["get", "aget"]
+    assert [method.kind for method in index.methods_of("Store")] == ["method", "async_method"]
+    assert index.methods_of("Store")[0].source.startswith("def get(self, key):")
+    assert (store.lineno, store.end_lineno) == (8, 17)
+
+    assert code_parser.build_symbol_index(PARSER_CODE) is index
+
+def test_generate_markdown_docs_only_regenerates_changed_symbols(monkeypatch, separate_prompts):
+    asked = []
+
+    def fake_explain_code(code, query, **kwargs):
+        asked.append(query)
+        return f"v{len(asked)}"
+
+    monkeypatch.setattr(docstring_generator, "explain_code", fake_explain_code)
+    manifest = {"version": 1, "document": None, "symbols": {}}
+    first = docstring_generator.generate_markdown_docs(SAMPLE_CODE, manifest=manifest)
+    assert manifest["last_run"] == {"reused": 0, "generated": 3, "deduplicated": 0, "dedupe_ratio": 0.0}
+
+    asked.clear()
+    changed = SAMPLE_CODE.replace("return b", "return b * 2")
+    second = docstring_generator.generate_markdown_docs(changed, manifest=manifest)
+
+    assert all("second" in query for query in asked) and len(asked) == 2
+    assert manifest["last_run"] == {"reused": 2, "generated": 1, "deduplicated": 0, "dedupe_ratio": 0.0}
+    # Unchanged sections are spliced in verbatim
+    assert first.split("### `second`")[0] == second.split("### `second`")[0]
+    assert first.split("### `Third`")[1] == second.split("### `Third`")[1]
+
+def test_detect_outdated_docs_reports_symbol_changes_without_llm(monkeypatch, separate_prompts):
+    monkeypatch.setattr(docstring_generator, "explain_code", lambda code, query, **kwargs: "ok")
+    manifest = {"version": 1, "document": None, "symbols": {}}
+    docs = docstring_generator.generate_markdown_docs(SAMPLE_CODE, manifest=manifest)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("detect_outdated_docs must not call the model")
+
+    monkeypatch.setattr(docstring_generator, "explain_code", fail)
+    assert not docstring_generator.detect_outdated_docs(SAMPLE_CODE, docs, manifest)["outdated"]
+
+    # Reformatting and comments don't count as changes
+    reformatted = SAMPLE_CODE.replace("return a", "return (a)  # same")
+    assert not docstring_generator.detect_outdated_docs(reformatted, docs, manifest)["outdated"]
+
+    edited = SAMPLE_CODE.replace("return a", "return -a").replace("def second(b):\n    return b\n", "def fourth():\n    pass\n")
+    report = docstring_generator.detect_outdated_docs(edited, docs, manifest)
+    assert report["outdated"]
+    assert (report["added"], report["removed"], report["changed"]) == (["fourth"], ["second"], ["first"])
+
+def test_llm_client_streams_and_caches_completions(deepseek_stub):
+    assert list(query_handler.stream_explanation("def f(): pass", "What?")) == ["completion", " #1 "]
+    assert deepseek_stub["requests"][0]["stream"] is True
+    assert query_handler.explain_code("def f(): pass", "What?") == "completion #1"
+    assert len(deepseek_stub["requests"]) == 1
+
+def test_llm_client_stream_close_cancels_upstream(deepseek_stub):
+    deepseek_stub["stream_chunks"] = [f" token{i}" for i in range(500)]
+    deepseek_stub["stream_delay"] = 0.01
+    fragments = get_llm_client().stream("long prompt")
+    assert next(fragments) == "token0"
+    fragments.close()
+    for _ in range(100):
+        if deepseek_stub["stream_aborted"]:
+            break
+        time.sleep(0.02)
+    assert deepseek_stub["stream_aborted"]
+
+def test_tokenize_splits_identifiers():
+    assert retrieval.tokenize("def parseConfigFile(self, max_retries): return HTTPServer") == [
+        "parse", "config", "file", "parseconfigfile", "max", "retries", "max_retries", "http", "server", "httpserver"
+    ]
+
+def test_retrieve_context_selects_relevant_symbols_within_budget():
+    filler = "\n".join(f"def helper_{i}(value):\n    return value + {i}\n" for i in range(300))
+    code = filler + '''
+class ConfigLoader:
+    def parse_config_file(self, path):
+        """Read a YAML config file."""
+        with open(path) as f:
+            return f.read()
+'''
+    assert retrieval.estimate_tokens(code) > 1000
+    context = retrieval.retrieve_context("How is the config file parsed?", code=code, token_budget=200)
+
+    assert context.startswith("# ConfigLoader.parse_config_file (line ")
+    assert "helper_" not in context
+    assert retrieval.estimate_tokens(context) <= 200
+
+    small = "def add(a, b):\n    return a + b\n"
+    assert retrieval.retrieve_context("add", code=small) == small
+
+def test_get_repo_index_is_persisted_per_snapshot(github_stub):
+    index = retrieval.get_repo_index("octo", "demo")
+    assert index.select("add numbers")[0]["path"] == "pkg/core.py"
+
+    github_stub["requests"].clear()
+    assert retrieval.get_repo_index("octo", "demo").documents == index.documents
+    assert not any(path.startswith("/raw/") or "/git/trees/" in path for path in github_stub["requests"])
+
+
+def test_fit_code_chunks_large_classes_by_method():
+    methods = "\n".join(
+        f"    def method_{i}(self, value):\n        \"\"\"Method {i}.\"\"\"\n" + "        value += 1\n" * 20 + "        return value\n"
+        for i in range(10)
+    )
+    source = f"class Big:\n{methods}"
+    assert prompt_builder.fit_code(source, budget=10000) == (source, "full")
+
+    text, mode = prompt_builder.fit_code(source, budget=400)
+    assert mode == "partial"
+    assert prompt_builder.estimate_tokens(text) <= 400
+    assert all(f"def method_{i}(self, value):" in text for i in range(10))
+    assert "value += 1" in text and "..." in text
+
+    text, mode = prompt_builder.fit_code(source, budget=200)
+    assert mode == "signatures"
+    assert "value += 1" not in text and "Method 9." in text
+
+    text, mode = prompt_builder.fit_code("def broken(:\n" * 100, budget=50)
+    assert mode == "truncated" and len(text) == 200
+
+    # The bodies left out come back as follow-up chunks that each fit the budget
+    text, mode, chunks = prompt_builder.chunk_code(source, budget=400)
+    included = [i for i in range(10) if f"Method {i}.\"\"\"\n        value += 1" in text]
+    assert chunks and all(prompt_builder.estimate_tokens(chunk) <= 400 for chunk in chunks)
+    assert sorted(included + [i for i in range(10) if any(f"def method_{i}(" in chunk for chunk in chunks)]) == list(range(10))
+
+
+def test_generate_markdown_docs_asks_about_methods_left_out_of_large_classes(monkeypatch, separate_prompts):
+    monkeypatch.setattr(docstring_generator, "PROMPT_TOKEN_BUDGET", 500)
+    monkeypatch.setattr(query_handler, "PROMPT_TOKEN_BUDGET", 500)
+    source = "class Big:\n" + "".join(
+        f"    def method_{i}(self, value):\n" + "        value += 1\n" * 20 + "        return value\n" for i in range(10)
+    )
+    asked = []
+
+    def fake_explain_code(code, query, **kwargs):
+        asked.append((query, code))
+        return "methods " + ", ".join(re.findall(r"def (method_\d+)", code)) if "didn't fit" in query else "main"
+
+    monkeypatch.setattr(docstring_generator, "explain_code", fake_explain_code)
+    docs = docstring_generator.generate_markdown_docs(source)
+
+    assert "**Explanation:** main\n\n**More methods:** methods method_" in docs
+    follow_ups = [(query, code) for query, code in asked if "didn't fit" in query]
+    assert follow_ups and all(prompt_builder.estimate_tokens(code) <= 500 for _, code in follow_ups)
+    # Every method body is in exactly one prompt: the main one or a follow-up, never cut from either
+    main, _ = prompt_builder.fit_code(source, query_handler.explain_code_budget("What does the class `Big` do?"))
+    in_main = re.findall(r"def (method_\d+)\(self, value\):\n\s+value \+= 1", main)
+    in_follow_ups = [name for _, code in follow_ups for name in re.findall(r"def (method_\d+)", code)]
+    assert sorted(in_main + in_follow_ups, key=lambda name: int(name.split("_")[1])) == [f"method_{i}" for i in range(10)]
+    assert all(
+        prompt_builder.fit_code(code, query_handler.explain_code_budget(query))[1] == "full" for query, code in follow_ups
+    )
+
+
+def test_generate_markdown_docs_reports_usage_per_call_type(deepseek_stub):
+    with track_usage() as usage:
+        docstring_generator.generate_markdown_docs(SAMPLE_CODE, max_workers=4, batched=False)
+    report = usage.to_dict()
+    assert report["by_call_type"]["doc_explanation"]["calls"] == 3
+    assert report["by_call_type"]["doc_example"]["calls"] == 3
+    assert report["completion_tokens"] == 18
+    assert {request["max_tokens"] for request in deepseek_stub["requests"]} == {
+        prompt_builder.output_budget("doc_explanation"), prompt_builder.output_budget("doc_example")
+    }
+
+
+def test_generate_markdown_docs_packs_symbols_into_combined_prompts(deepseek_stub):
+    def respond(body):
+        names = re.findall(r"### \w+ `(\w+)`", body["prompt"])
+        # Leave one symbol out to exercise the per-question fallback
+        return "```json\n" + json.dumps({
+            name: {"explanation": f"{name} explained", "example": f"{name}()"} for name in names if name != "second"
+        }) + "\n```"
+
+    deepseek_stub["responder"] = respond
+    with track_usage() as usage:
+        docs = docstring_generator.generate_markdown_docs(SAMPLE_CODE, batched=True)
+
+    by_call_type = usage.to_dict()["by_call_type"]
+    assert by_call_type["doc_batch"]["calls"] == 1
+    assert by_call_type["doc_explanation"]["calls"] == by_call_type["doc_example"]["calls"] == 1
+    assert "**Explanation:** first explained" in docs and "first()" in docs
+    assert "**Explanation:** Third explained" in docs
+    assert docs.count("**Explanation:**") == 3
+
+
+def test_fallback_questions_run_concurrently_on_the_executor(deepseek_stub):
+    lock = threading.Lock()
+    in_flight = [0, 0]  # now, peak
+
+    def respond(body):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.1)
+        with lock:
+            in_flight[0] -= 1
+        return "separate"
+
+    # The combined request fails, so every symbol's two questions are asked separately
+    deepseek_stub["failures"] = [(400, {})]
+    deepseek_stub["responder"] = respond
+    with track_usage() as usage:
+        docs = docstring_generator.generate_markdown_docs(SAMPLE_CODE, batched=True, max_workers=6)
+    assert usage.to_dict()["by_call_type"]["doc_explanation"]["calls"] == 3
+    assert docs.count("**Explanation:** separate") == 3
+    assert in_flight[1] == 6
+
+
+def test_combined_prompts_stay_within_prompt_and_output_budgets(deepseek_stub, monkeypatch):
+    monkeypatch.setattr(query_handler, "PROMPT_TOKEN_BUDGET", 400)
+    many = "".join(f"def f{i}(x):\n    return x + {i}\n\n" for i in range(40))
+    big = "class Big:\n" + "".join(
+        f"    def method_{i}(self, value):\n" + "        value += 1\n" * 20 + "        return value\n" for i in range(10)
+    )
+    # The first combined request fails outright; its symbols are asked about separately
+    deepseek_stub["failures"] = [(400, {})]
+    deepseek_stub["responder"] = lambda body: json.dumps({
+        name: {"explanation": "ok", "example": "x"} for name in re.findall(r"### \w+ `(\w+)`", body["prompt"])
+    }) if "Respond with only a JSON object" in body["prompt"] else "separate"
+    docs = docstring_generator.generate_markdown_docs(many + big, batched=True, max_workers=1)
+
+    batches = [request for request in deepseek_stub["requests"] if "Respond with only a JSON object" in request["prompt"]]
+    assert max(request["max_tokens"] for request in batches) <= prompt_builder.MAX_OUTPUT_TOKENS
+    assert max(len(re.findall(r"### \w+ `", request["prompt"])) for request in batches) == docstring_generator.DOCS_BATCH_MAX_SYMBOLS
+    assert all(prompt_builder.estimate_tokens(request["prompt"]) <= 500 for request in deepseek_stub["requests"])
+    assert "**Error:**" not in docs
+    assert docs.count("**Explanation:** separate") == docstring_generator.DOCS_BATCH_MAX_SYMBOLS
+
+
+def test_shape_fingerprint_ignores_names_and_docstrings():
+    index = code_parser.build_symbol_index(
+        'def count(n):\n    """Count down."""\n    return count(n - 1) if n else 0\n\n'
+        'def tally(n):\n    return tally(n - 1) if n else 0\n\n'
+        'def other(n):\n    return other(n - 2) if n else 0\n'
+    )
+    count, tally, other = index.functions
+    assert count.shape == tally.shape != other.shape
+    assert count.fingerprint != tally.fingerprint
+
+
+def test_generate_markdown_docs_sends_identical_symbols_once(monkeypatch, separate_prompts):
+    asked = []
+
+    def fake_explain_code(code, query, **kwargs):
+        asked.append(query)
+        return "`load_a` reads a file; not load_ab."
+
+    monkeypatch.setattr(docstring_generator, "explain_code", fake_explain_code)
+    copies = [
+        ("a.py", "def load_a(path):\n    with open(path) as f:\n        return f.read()\n"),
+        ("b.py", 'def load_b(path):\n    """Copied helper."""\n    with open(path) as f:\n        return f.read()\n'),
+    ]
+    manifest = {"version": 1, "document": None, "symbols": {}}
+    docs = docstring_generator.generate_markdown_docs(iter(copies), manifest=manifest)
+
+    assert len(asked) == 2
+    assert "`load_b` reads a file; not load_ab." in docs
+    assert manifest["last_run"] == {"reused": 0, "generated": 2, "deduplicated": 1, "dedupe_ratio": 0.5}
+
+
+def test_duplicate_answers_only_rename_code():
+    original = ["get", lambda: ("`get(key)` returns the value; get it before ```\nget(1)\n```", "get('a')")]
+    explanation, example = docstring_generator._duplicate_answers(original, "fetch")()
+    assert explanation == "`fetch(key)` returns the value; get it before ```\nfetch(1)\n```"
+    assert example == "fetch('a')"
+
+
+def test_compare_ai_tools_runs_providers_concurrently_with_deadlines():
+    from app.utils.ai_comparison import compare_ai_tools
+
+    def fast(code, timeout):
+        return {"text": "docs for " + code, "prompt_tokens": 5, "completion_tokens": 3}
+
+    def slow(code, timeout):
+        time.sleep(1)
+        return {"text": "late", "prompt_tokens": 5, "completion_tokens": 3}
+
+    def broken(code, timeout):
+        raise RuntimeError("bad key")
+
+    start = time.monotonic()
+    results = compare_ai_tools(
+        "x = 1", providers={"deepseek": fast, "openai_gpt": slow, "claude": broken},
+        timeouts={"deepseek": 0.5, "openai_gpt": 0.2, "claude": 0.5}
+    )
+
+    assert time.monotonic() - start < 0.9
+    assert results["deepseek"] == "docs for x = 1"
+    assert results["metrics"]["deepseek"]["status"] == "ok"
+    assert results["metrics"]["deepseek"]["output_chars"] == len("docs for x = 1")
+    assert results["metrics"]["deepseek"]["completion_tokens"] == 3
+    assert results["openai_gpt"] is None and results["metrics"]["openai_gpt"]["status"] == "timeout"
+    assert results["errors"]["claude"] == "Claude Error: bad key"
+
+
+def test_compare_ai_tools_providers_keep_the_callers_context():
+    from app.utils.ai_comparison import compare_ai_tools
+    from app.utils.llm_scheduler import _caller, caller
+
+    def provider(code, timeout):
+        return {"text": _caller.get()}
+
+    with caller("client-1"):
+        results = compare_ai_tools("x = 1", providers={"deepseek": provider, "claude": provider})
+    assert results["deepseek"] == results["claude"] == "client-1"
+
+
+def test_deepseek_provider_stops_calling_deepseek_at_its_timeout(deepseek_stub):
+    from app.utils.ai_comparison import deepseek_provider
+
+    def slow(body):
+        time.sleep(0.5)
+        return "late"
+
+    deepseek_stub["responder"] = slow
+    start = time.monotonic()
+    result = deepseek_provider(SAMPLE_CODE, 0.2)
+    assert time.monotonic() - start < 0.45
+    assert "deadline exceeded" in result["text"]
+    time.sleep(0.1)
+    # Only the request in flight at the deadline was sent; the fallback questions never were
+    assert len(deepseek_stub["requests"]) == 1
+
+
+def test_metrics_render_prometheus_text():
+    from app.utils.metrics import Histogram, record_github_rate_limit, render_metrics
+
+    histogram = Histogram("demo_seconds", "Demo.", ("stage",), buckets=(0.1, 1))
+    histogram.observe(0.05, stage="parse")
+    histogram.observe(0.5, stage="parse")
+    assert histogram.render().splitlines()[2:] == [
+        'demo_seconds_bucket{stage="parse",le="0.1"} 1',
+        'demo_seconds_bucket{stage="parse",le="1"} 2',
+        'demo_seconds_bucket{stage="parse",le="+Inf"} 2',
+        'demo_seconds_sum{stage="parse"} 0.55',
+        'demo_seconds_count{stage="parse"} 2',
+    ]
+
+    class FakeResponse:
+        headers = {"X-RateLimit-Remaining": "4999", "X-RateLimit-Resource": "core"}
+
+    record_github_rate_limit(FakeResponse())
+    assert 'github_rate_limit_remaining{resource="core"} 4999' in render_metrics()
+
+
+def test_metrics_are_totals_over_worker_processes(metrics_state):
+    import subprocess
+    from app.utils.metrics import LLM_CIRCUIT_STATE, LLM_REQUESTS, WORKERS_KEY, render_metrics
+
+    LLM_CIRCUIT_STATE.set(0)
+    own = LLM_REQUESTS.value(call_type="demo", outcome="ok")
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    other = {
+        "llm_requests_total": [[["demo", "ok"], 5]],
+        "llm_circuit_state": [[[], 2]],
+    }
+    # One live worker (this test's parent process) and one that has exited
+    metrics_state.update(WORKERS_KEY, lambda workers: ({str(os.getppid()): other, str(dead.pid): other}, None))
+
+    text = render_metrics()
+    assert f'llm_requests_total{{call_type="demo",outcome="ok"}} {own + 10:g}' in text
+    assert "llm_circuit_state 2" in text
+    workers = metrics_state.get(WORKERS_KEY)
+    assert str(dead.pid) not in workers and workers["retired"] == {"llm_requests_total": [[["demo", "ok"], 5]]}
+
+    # The exited worker's counts stay in the totals once the live one stops reporting its gauge
+    workers[str(os.getppid())] = {}
+    metrics_state.update(WORKERS_KEY, lambda _: (workers, None))
+    text = render_metrics()
+    assert f'llm_requests_total{{call_type="demo",outcome="ok"}} {own + 5:g}' in text
+    assert "llm_circuit_state 0" in text
+
+
+def test_github_client_retries_secondary_rate_limits(github_stub):
+    github_stub["failures"] = [
+        (403, {}, "You have exceeded a secondary rate limit."),
+        (429, {"Retry-After": "0.01"}, ""),
+    ]
+    assert [file["path"] for file in github_api.fetch_repo_contents("octo", "demo", path="pkg/sub")] == ["pkg/sub/util.py"]
+
+    github_stub["failures"] = [(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 3600)}, "")]
+    with pytest.raises(Exception, match="rate limit exceeded"):
+        github_api.download_file_contents(f"{github_api.GITHUB_API_URL}/repos/octo/demo")
+
+
+def test_github_client_paces_requests_as_budget_drops(github_stub):
+    client = github_api.get_github_client()
+    now = time.time()
+    reset = now + 100
+    github_stub["rate_limit"] = {"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": str(reset)}
+    github_api.resolve_ref("octo", "demo", "main")
+    assert client.budget["remaining"] == 4000
+    assert client._interval(client.budget, now) == 0.0
+    assert 1.9 < client._interval({"limit": 5000, "remaining": 50, "reset": reset}, now) <= 2.0
+
+    # Once the budget is gone every queued caller waits for the reset itself (capped at max_wait)
+    client.max_wait = 3600
+    state = {"budget": {"limit": 5000, "remaining": 0, "reset": now + 600}, "next_slot": now}
+    slots = []
+    for _ in range(3):
+        state, slot = client._reserve(state, now)
+        slots.append(slot - now)
+    assert slots == [601, 601, 601]
+    # After the reset the pace follows the budget the next response reports
+    state["budget"] = {"limit": 5000, "remaining": 10, "reset": now + 4200}
+    state, slot = client._reserve(state, now + 601)
+    assert slot == now + 601 and state["next_slot"] == now + 601 + 3599 / 10
+
+
+def test_github_budget_is_shared_by_worker_processes(tmp_path):
+    from app.utils.shared_storage import SharedState
+    # Two clients on one state file behave like two worker processes using the same token
+    workers = [github_api.GitHubClient(token="t", state=SharedState(str(tmp_path / "state.sqlite"))) for _ in range(2)]
+    now = time.time()
+
+    class FakeResponse:
+        headers = {"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "100", "X-RateLimit-Reset": str(now + 1000)}
+
+    workers[0]._update_budget(FakeResponse())
+    assert workers[1].budget["remaining"] == 100
+    first = workers[0].state.update(workers[0]._state_key, lambda state: workers[0]._reserve(state, now))
+    second = workers[1].state.update(workers[1]._state_key, lambda state: workers[1]._reserve(state, now))
+    assert first == now and 9.9 < second - now <= 10
+    assert workers[0].budget["remaining"] == 98
+    assert github_api.GitHubClient(token="other", state=workers[0].state).budget is None
+
+
+def test_sqlite_rate_limit_storage_is_shared_between_processes(tmp_path):
+    from limits import parse, strategies
+    from app.utils.shared_storage import SQLiteStorage
+
+    uri = f"sqlite:///{tmp_path / 'limits.sqlite'}"
+    # Separate storage objects on one file behave like two worker processes
+    workers = [strategies.FixedWindowRateLimiter(SQLiteStorage(uri)) for _ in range(2)]
+    limit = parse("3/minute")
+    assert [workers[i % 2].hit(limit, "client") for i in range(4)] == [True, True, True, False]
+    assert workers[1].get_window_stats(limit, "client").remaining == 0
+    assert workers[0].hit(limit, "other-client")
+
+
+def test_benchmark_harness_writes_comparable_results(tmp_path):
+    import subprocess
+    from benchmarks.compare import compare_results
+
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    output = tmp_path / "results.json"
+    subprocess.run(
+        [sys.executable, "-m", "benchmarks.run", "--sizes", "2", "--repeats", "1", "--requests", "2",
+         "--latency", "0", "--github-latency", "0", "--output", str(output)],
+        cwd=root, check=True, capture_output=True, timeout=120
+    )
+    document = json.loads(output.read_text())
+    results = {result["scenario"]: result for result in document["results"]}
+    assert results["fetch_and_process_repo"]["calls"]["github"]["raw"] == 5  # 2 modules, 2 __init__.py and setup.py
+    assert results["generate_markdown_docs"]["symbols"]["generated"] == 8  # 3 functions and a class per module
+    assert results["ingest_local:pool"]["errors"] == 0 and results["ingest_local:pool"]["python_files"] == 5
+    assert results["route:explain_code"]["errors"] == 0
+    assert set(results["route:explain_code"]["latency_ms"]) == {"p50", "p95", "p99", "mean", "max"}
+
+    slower = json.loads(json.dumps(document))
+    slower["results"][0]["throughput"]["value"] /= 2
+    assert compare_results(document, slower)[0]["regressions"] == ["throughput"]
+
+
+def test_response_cache_keeps_only_successful_responses():
+    from app.utils.response_cache import CachedResponse, ResponseCache, make_request_key
+
+    assert make_request_key("/parse-file", {"a": 1, "b": [1, 2]}) == make_request_key("/parse-file", {"b": [1, 2], "a": 1})
+    assert make_request_key("/parse-file", {"a": 1}) != make_request_key("/fetch-repo", {"a": 1})
+
+    cache = ResponseCache(ttl=60, path=None)
+    failed = CachedResponse(500, b'{"error": "boom"}', "application/json")
+    assert cache.fetch("key", lambda: failed) == (failed, "miss")
+    ok = CachedResponse(200, b'{"ok": true}', "application/json")
+    assert cache.fetch("key", lambda: ok) == (ok, "miss")
+    assert cache.fetch("key", lambda: pytest.fail("recomputed")) == (ok, "hit")
+
+    def crash():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        cache.fetch("other", crash)
+    assert cache.stats() == {"entries": 1, "in_flight": 0, "hits": 1, "misses": 3, "coalesced": 0, "ttl_seconds": 60}
+
+    # A zero TTL still coalesces concurrent requests but keeps nothing
+    uncached = ResponseCache(ttl=0, path=None)
+    uncached.fetch("key", lambda: ok)
+    assert uncached.fetch("key", lambda: failed) == (failed, "miss")
+
+def test_response_cache_is_shared_by_worker_processes(tmp_path):
+    import sqlite3
+    import subprocess
+    from app.utils.response_cache import CachedResponse, ResponseCache
+
+    path = str(tmp_path / "route_cache.sqlite")
+    # Caches on one file behave like the caches of separate gunicorn workers
+    leader, waiter, later = (ResponseCache(ttl=60, path=path) for _ in range(3))
+    started, release = threading.Event(), threading.Event()
+    ok = CachedResponse(200, b'{"ok": true}', "application/json", has_usage=True)
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return ok
+
+    results = {}
+    computing = threading.Thread(target=lambda: results.update(leader=leader.fetch("key", slow)))
+    computing.start()
+    started.wait(5)
+    waiting = threading.Thread(target=lambda: results.update(waiter=waiter.fetch("key", lambda: pytest.fail("recomputed"))))
+    waiting.start()
+    time.sleep(0.1)
+    release.set()
+    computing.join(5)
+    waiting.join(5)
+
+    assert results["leader"][1] == "miss" and results["waiter"][1] == "coalesced"
+    response, outcome = later.fetch("key", lambda: pytest.fail("recomputed"))
+    assert outcome == "hit" and response.body == ok.body and response.etag == ok.etag and response.has_usage
+    assert later.stats()["entries"] == 1
+
+    # A computation claimed by a process that died is taken over
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO flights (key, flight, pid) VALUES (?, ?, ?)", ("other", "lost", dead.pid))
+    assert waiter.fetch("other", lambda: ok)[1] == "miss"
+
+def test_llm_scheduler_orders_by_priority_and_rotates_clients():
+    import threading
+    from app.utils.llm_scheduler import BULK, INTERACTIVE, LLMScheduler
+
+    scheduler = LLMScheduler(max_concurrency=1, reserved_interactive=0)
+    order = []
+    holder = scheduler.slot(1, BULK, client="holder")
+    holder.__enter__()
+
+    def call(name, priority, client):
+        with scheduler.slot(1, priority, client=client):
+            order.append(name)
+
+    threads = []
+    for queued, (name, priority, client) in enumerate(
+            [("a1", BULK, "a"), ("a2", BULK, "a"), ("b1", BULK, "b"), ("i1", INTERACTIVE, "c")], start=1):
+        threads.append(threading.Thread(target=call, args=(name, priority, client)))
+        threads[-1].start()
+        while sum(scheduler.stats()["queued"].values()) < queued:
+            time.sleep(0.001)
+    holder.__exit__(None, None, None)
+    for thread in threads:
+        thread.join(5)
+    assert order == ["i1", "a1", "b1", "a2"]
+    stats = scheduler.stats()
+    assert stats["in_flight"] == 0 and stats["waits"][BULK]["calls"] == 4
+
+
+def test_llm_scheduler_reserves_slots_and_token_budget():
+    import threading
+    from app.utils.llm_scheduler import BULK, INTERACTIVE, LLMScheduler
+
+    scheduler = LLMScheduler(max_concurrency=2, tokens_per_minute=100, reserved_interactive=1)
+    with scheduler.slot(80, BULK) as grant:
+        grant.settle(30)
+        # The second slot is kept for interactive calls
+        def bulk_call():
+            with scheduler.slot(10, BULK):
+                pass
+
+        second_bulk = threading.Thread(target=bulk_call)
+        second_bulk.start()
+        while scheduler.stats()["queued"][BULK] < 1:
+            time.sleep(0.001)
+        with scheduler.slot(60, INTERACTIVE):
+            assert scheduler.stats()["tokens_last_minute"] == 90
+            assert scheduler._budget_delay(20) > 0
+        assert scheduler.stats()["queued"][BULK] == 1
+    second_bulk.join(5)
+    stats = scheduler.stats()
+    assert stats["waits"][BULK]["calls"] == 2 and stats["tokens_last_minute"] == 100
@@ -0,0 +1,8 @@
+"""
+WSGI entry point for production servers, e.g. `gunicorn -c gunicorn.conf.py wsgi:app`.
+Production runs behind one reverse proxy (Heroku's router) unless PROXY_COUNT says otherwise.
+"""
+import os
+from app import create_app
+
+app = create_app({"PROXY_COUNT": int(os.getenv("PROXY_COUNT", "1"))})